@@ -63,24 +63,15 @@ class RSIStrategy(bt.Strategy):
 
 # --- 回测主程序 ---
 if __name__ == '__main__':
+    import sys
+    from stock_quant.test_Bash.data_store import bt_feed
+
     cerebro = bt.Cerebro()
     cerebro.addstrategy(RSIStrategy)
 
     # 加载数据
-    data = bt.feeds.GenericCSVData(
-        dataname='stock_quant/data/ETHUSDT_1d.csv',
-        dtformat='%Y-%m-%d',
-        datetime=0,
-        open=1,
-        high=2,
-        low=3,
-        close=4,
-        volume=5,
-        openinterest=-1,
-        nullvalue=0.0,
-        reverse=False,
-        headers=True
-    )
+    # 从列式缓存加载 (CSV 只在首次或文件变化时解析)
+    data = bt_feed('stock_quant/data/ETHUSDT_1d.csv')
 
     cerebro.adddata(data)
 
@@ -110,4 +101,6 @@ if __name__ == '__main__':
         print(f"{year}: {ret * 100:.2f}%")
 
     # --- 绘图 ---
-    cerebro.plot(style='candlestick')
+    # --no-plot: 批量运行时不弹出窗口 (也不导入 matplotlib)
+    if '--no-plot' not in sys.argv:
+        cerebro.plot(style='candlestick')
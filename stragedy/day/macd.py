@@ -71,22 +71,15 @@ class MacdStrategy(bt.Strategy):
 
 # --- 2. 回测引擎设置 ---
 if __name__ == '__main__':
+    import sys
+    from stock_quant.test_Bash.data_store import bt_feed
+
     cerebro = bt.Cerebro()
     cerebro.addstrategy(MacdStrategy)
 
     # 数据加载
-    data = bt.feeds.GenericCSVData(
-        dataname=r'stock_quant\data\SOLUSDT_1d.csv',
-        dtformat='%Y-%m-%d',
-        datetime=0,
-        open=1,
-        high=2,
-        low=3,
-        close=4,
-        volume=5,
-        openinterest=-1,
-        reverse=False
-    )
+    # 从列式缓存加载 (CSV 只在首次或文件变化时解析)
+    data = bt_feed(r'stock_quant\data\SOLUSDT_1d.csv')
 
     cerebro.adddata(data)
     cerebro.broker.setcash(10000.0)
@@ -112,4 +105,6 @@ if __name__ == '__main__':
     for year, ret in strat.analyzers.annual.get_analysis().items():
         print(f"{year}: {ret*100:.2f}%")
 
-    cerebro.plot()
+    # --no-plot: 批量运行时不弹出窗口 (也不导入 matplotlib)
+    if '--no-plot' not in sys.argv:
+        cerebro.plot()
@@ -7,13 +7,19 @@ class OBV(bt.Indicator):
     plotinfo = dict(subplot=True)
 
     def __init__(self):
-        obv_daily_change = bt.If(self.data.close > self.data.close(-1),
-                                 self.data.volume,
-                                 bt.If(self.data.close < self.data.close(-1),
-                                       -self.data.volume,
-                                       0))
-        self.lines.obv = bt.If(bt.indicators.All(self.data.close(-1)),
-                               obv_daily_change + self.lines.obv(-1), obv_daily_change)
+        self.addminperiod(1)
+
+    def next(self):
+        # 逐根递推；在 __init__ 中用 self.lines.obv(-1) 自引用时 backtrader 得到的全是 NaN
+        if len(self) == 1:
+            self.lines.obv[0] = self.data.volume[0]
+        else:
+            if self.data.close[0] > self.data.close[-1]:
+                self.lines.obv[0] = self.lines.obv[-1] + self.data.volume[0]
+            elif self.data.close[0] < self.data.close[-1]:
+                self.lines.obv[0] = self.lines.obv[-1] - self.data.volume[0]
+            else:
+                self.lines.obv[0] = self.lines.obv[-1]
 
 class OBV_MACD_RSI_Strategy(bt.Strategy):
     params = dict(
@@ -54,6 +60,12 @@ class OBV_MACD_RSI_Strategy(bt.Strategy):
         dt = dt or self.data.datetime.date(0)
         print(f'{dt.isoformat()} {txt}')
 
+    def notify_order(self, order):
+        if order.status in [order.Submitted, order.Accepted]:
+            return
+        # 订单完成或被拒绝后才允许下新单，否则 self.order 永远非空，策略在第一笔买入后就停止
+        self.order = None
+
     def next(self):
         if self.order:
             return
@@ -137,6 +149,9 @@ class OBV_MACD_RSI_Strategy(bt.Strategy):
 
 
 if __name__ == '__main__':
+    import sys
+    from stock_quant.test_Bash.data_store import bt_feed
+
     cerebro = bt.Cerebro()
     cerebro.addstrategy(OBV_MACD_RSI_Strategy,
                         buy_logic_type='MIXED',
@@ -147,10 +162,9 @@ if __name__ == '__main__':
                         trailing_stop_active=True,
                         trailing_stop_multiplier=2.0)
 
-    data = bt.feeds.GenericCSVData(
-        dataname=r'stock_quant\data\day\SOLUSDT_1d.csv',
-        dtformat='%Y-%m-%d',
-        datetime=0, open=1, high=2, low=3, close=4, volume=5, openinterest=-1,
+    # 从列式缓存加载 (CSV 只在首次或文件变化时解析)
+    data = bt_feed(
+        r'stock_quant\data\day\SOLUSDT_1d.csv',
         fromdate=datetime.datetime(2021, 1, 1),
         todate=datetime.datetime(2024, 12, 31)
     )
@@ -191,4 +205,6 @@ if __name__ == '__main__':
     else:
         print("\n⚠️ No closed trades found in the analysis.")
 
-    cerebro.plot()
+    # --no-plot: 批量运行时不弹出窗口 (也不导入 matplotlib)
+    if '--no-plot' not in sys.argv:
+        cerebro.plot()
@@ -88,22 +88,15 @@ class OBVStrategy(bt.Strategy):
 # 回测主程序
 # ----------------------
 if __name__ == '__main__':
+    import sys
+    from stock_quant.test_Bash.data_store import bt_feed
+
     cerebro = bt.Cerebro()
     cerebro.addstrategy(OBVStrategy)
 
     # 加载 CSV 数据
-    data = bt.feeds.GenericCSVData(
-        dataname=r'stock_quant\data\day\DOGEUSDT_1d.csv',  # ✅ 替换为你自己的绝对路径
-        dtformat='%Y-%m-%d',
-        datetime=0,
-        open=1,
-        high=2,
-        low=3,
-        close=4,
-        volume=5,
-        openinterest=-1,
-        reverse=False
-    )
+    # 从列式缓存加载 (CSV 只在首次或文件变化时解析)
+    data = bt_feed(r'stock_quant\data\day\DOGEUSDT_1d.csv')  # ✅ 替换为你自己的绝对路径
     cerebro.adddata(data)
 
     cerebro.broker.setcash(10000.0)
@@ -131,4 +124,6 @@ if __name__ == '__main__':
         print(f"{year}: {ret*100:.2f}%")
 
     # 绘图
-    cerebro.plot(style='candlestick')
+    # --no-plot: 批量运行时不弹出窗口 (也不导入 matplotlib)
+    if '--no-plot' not in sys.argv:
+        cerebro.plot(style='candlestick')
@@ -33,6 +33,12 @@ class CombinedStrategy(bt.Strategy):
         dt = self.datas[0].datetime.date(0)
         print(f'{dt} - {txt}')
 
+    def notify_order(self, order):
+        if order.status in [order.Submitted, order.Accepted]:
+            return
+        # 订单完成或被拒绝后才允许下新单，否则 self.order 永远非空，策略在第一笔买入后就停止
+        self.order = None
+
     def next(self):
         if self.order:
             return  # 有订单未完成
@@ -74,19 +80,15 @@ class CombinedStrategy(bt.Strategy):
 # 回测引擎设置
 # -----------------------------
 if __name__ == '__main__':
+    import sys
+    from stock_quant.test_Bash.data_store import bt_feed
+
     cerebro = bt.Cerebro()
     cerebro.addstrategy(CombinedStrategy)
 
-    data = bt.feeds.GenericCSVData(
-        dataname=r'stock_quant\data\day\ETHUSDT_1d.csv',  # 改为你自己的 CSV 文件路径
-        dtformat='%Y-%m-%d',
-        datetime=0,
-        open=1,
-        high=2,
-        low=3,
-        close=4,
-        volume=5,
-        openinterest=-1,
+    # 从列式缓存加载 (CSV 只在首次或文件变化时解析)
+    data = bt_feed(
+        r'stock_quant\data\day\ETHUSDT_1d.csv',  # 改为你自己的 CSV 文件路径
         fromdate=datetime.datetime(2021, 1, 1),
         todate=datetime.datetime(2024, 12, 31)
     )
@@ -110,4 +112,6 @@ if __name__ == '__main__':
 
     trades = strat.analyzers.trades.get_analysis()
 
-    cerebro.plot()
+    # --no-plot: 批量运行时不弹出窗口 (也不导入 matplotlib)
+    if '--no-plot' not in sys.argv:
+        cerebro.plot()
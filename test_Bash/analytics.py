@@ -0,0 +1,173 @@
+import numpy as np
+
+# 绩效指标：输入资金曲线数组 (单条 (T,) 或一批 (P × T))，全部按行向量化计算，
+# 不构造 pandas 对象，参数搜索可以一次给成百上千条曲线打分。
+# 加密货币全年交易：日线一年 365 根，4 小时线一年 365 * 6 根 (见 periods_per_year)。
+
+_NS_PER_YEAR = 365 * 86400 * 1_000_000_000
+
+METRIC_NAMES = ('total_return', 'annual_return', 'volatility', 'sharpe', 'sortino', 'calmar',
+                'max_drawdown', 'max_drawdown_duration')
+TRADE_METRIC_NAMES = ('trades', 'win_rate', 'profit_factor')
+
+
+def periods_per_year(interval):
+    """
+    一年的 K 线根数 (按 365 天计)，如 '1d' -> 365，'4h' -> 2190。
+    """
+    from day_data import interval_to_ns
+
+    return _NS_PER_YEAR / interval_to_ns(interval)
+
+
+def infer_periods_per_year(times):
+    """
+    由时间戳 (int64 纳秒或 datetime64[ns]) 的典型间隔推断一年的 K 线根数。
+    """
+    times = np.asarray(times)
+    if times.dtype.kind == 'M':
+        times = times.astype('datetime64[ns]').view(np.int64)
+    step = np.median(np.diff(times[:1000])) if len(times) > 1 else 86400e9
+    return _NS_PER_YEAR / step
+
+
+def _rows(values):
+    values = np.asarray(values, dtype=float)
+    return values[None, :] if values.ndim == 1 else values, values.ndim == 1
+
+
+def _squeeze(result, single):
+    if single:
+        return {k: v[0].item() for k, v in result.items()}
+    return result
+
+
+def max_drawdown(equity):
+    """
+    最大回撤 (比例) 与最长水下持续时间 (K 线数，从前一个高点算起，直到收复该高点)。
+    equity: (T,) 或 (P × T)
+    返回: (max_drawdown, duration)，每行一个值
+    """
+    equity, single = _rows(equity)
+    peak = np.maximum.accumulate(equity, axis=1)
+    drawdown = (peak - equity) / peak
+    # 每根 K 线距离最近一次创新高的根数
+    bars = np.arange(equity.shape[1])
+    last_peak = np.maximum.accumulate(np.where(drawdown > 0, 0, bars), axis=1)
+    duration = (bars - last_peak).max(axis=1, initial=0)
+    mdd = drawdown.max(axis=1, initial=0.0)
+    return (mdd[0].item(), int(duration[0])) if single else (mdd, duration)
+
+
+def return_metrics(returns, periods_per_year, exposure=None):
+    """
+    由每根 K 线的收益率计算指标 (资金曲线以 1 起步)。
+    returns: (T,) 或 (P × T) 收益率
+    exposure: 可选的 (T,) 或 (P × T) 持仓标记 (非零为持仓)，给定时另外返回持仓时间占比 'exposure'
+    返回: {指标名: 值}，名称见 METRIC_NAMES；输入为二维时每个值是 (P,) 数组
+    """
+    returns, single = _rows(returns)
+    n = returns.shape[1]
+    mean = returns.mean(axis=1)
+    std = np.sqrt(np.maximum(np.einsum('ij,ij->i', returns, returns) / n - mean ** 2, 0.0))
+    downside = np.minimum(returns, 0.0)
+    downside = np.sqrt(np.einsum('ij,ij->i', downside, downside) / n)
+
+    equity = np.empty((len(returns), n + 1))
+    equity[:, 0] = 1.0
+    np.add(returns, 1.0, out=equity[:, 1:])
+    np.cumprod(equity, axis=1, out=equity)
+    final = equity[:, -1]
+    mdd, duration = max_drawdown(equity)
+
+    scale = np.sqrt(periods_per_year)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        annual = np.power(np.maximum(final, 0.0), periods_per_year / n) - 1.0 if n else np.zeros(len(final))
+        result = {
+            'total_return': final - 1.0,
+            'annual_return': annual,
+            'volatility': std * scale,
+            'sharpe': np.where(std > 0, mean / std * scale, 0.0),
+            'sortino': np.where(downside > 0, mean / downside * scale, 0.0),
+            'calmar': np.where(mdd > 0, annual / mdd, np.nan),
+            'max_drawdown': mdd,
+            'max_drawdown_duration': duration,
+        }
+    if exposure is not None:
+        exposure, _ = _rows(exposure)
+        result['exposure'] = (exposure != 0).mean(axis=1)
+    return _squeeze(result, single)
+
+
+def performance(equity, periods_per_year, exposure=None):
+    """
+    由资金曲线计算指标，见 return_metrics。
+    equity: (T,) 或 (P × T) 资金曲线 (各行长度相同)
+    """
+    equity, single = _rows(equity)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = np.diff(equity, axis=1) / equity[:, :-1]
+    result = return_metrics(returns, periods_per_year, exposure)
+    # 收益率路径复利得到的总收益与 equity[-1] / equity[0] - 1 只差舍入误差，这里直接用原值
+    result['total_return'] = equity[:, -1] / equity[:, 0] - 1.0
+    return _squeeze(result, single)
+
+
+def trade_stats(trade_returns):
+    """
+    单笔交易收益率的统计：交易数、胜率、盈亏比 (总盈利 / 总亏损)。
+    trade_returns: (K,) 或 (P × K)；各行交易数不同时以 NaN 补齐
+    返回: {指标名: 值}，名称见 TRADE_METRIC_NAMES；没有交易时胜率与盈亏比为 NaN，没有亏损时盈亏比为 inf
+    """
+    trade_returns, single = _rows(trade_returns)
+    valid = ~np.isnan(trade_returns)
+    count = valid.sum(axis=1)
+    gains = np.where(trade_returns > 0, trade_returns, 0.0).sum(axis=1)
+    losses = -np.where(trade_returns < 0, trade_returns, 0.0).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = {
+            'trades': count,
+            'win_rate': np.where(count > 0, (trade_returns > 0).sum(axis=1) / count, np.nan),
+            'profit_factor': np.where(count > 0, np.where(losses > 0, gains / losses, np.inf), np.nan),
+        }
+    return _squeeze(result, single)
+
+
+def format_metrics(metrics):
+    """
+    指标字典 -> 便于打印的字符串字典 (比例显示为百分比，NaN 显示为 'n/a')。
+    """
+    percent = {'total_return', 'annual_return', 'volatility', 'max_drawdown', 'exposure', 'win_rate'}
+    out = {}
+    for key, value in metrics.items():
+        if not isinstance(value, (int, float, np.number)):
+            out[key] = str(value)
+        elif np.isnan(value):
+            out[key] = 'n/a'
+        elif isinstance(value, (int, np.integer)):
+            out[key] = f"{value:,}"
+        elif key in percent:
+            out[key] = f"{value * 100:.2f}%"
+        else:
+            out[key] = f"{value:,.2f}"
+    return out
+
+
+if __name__ == '__main__':
+    import time
+
+    from benchmark import synthetic_klines
+
+    # 1000 条 4 小时资金曲线 (约 6 年) 一次打分
+    rng = np.random.default_rng(0)
+    returns = rng.normal(0.0002, 0.01, size=(1000, 12800))
+    equity = 10000 * np.cumprod(1 + returns, axis=1)
+    t0 = time.perf_counter()
+    scores = performance(equity, periods_per_year('4h'))
+    print(f"{equity.shape[0]} curves x {equity.shape[1]} bars in {(time.perf_counter() - t0) * 1e3:.1f} ms")
+    for name in METRIC_NAMES:
+        print(f"  {name:24s} median {np.nanmedian(scores[name]):.4f}")
+
+    close = synthetic_klines(2000, '1d')['Close Price'].to_numpy()
+    single = performance(close, periods_per_year('1d'), exposure=np.ones(len(close)))
+    print(format_metrics(single))
@@ -0,0 +1,250 @@
+import asyncio
+import random
+import time
+
+import aiohttp
+import numpy as np
+
+from day_data import _sync_plan, _apply_sync, _klines_to_frame
+
+# 币安公开 K 线接口 (无需 API 密钥)
+FUTURES_URL = 'https://fapi.binance.com/fapi/v1/klines'
+SPOT_URL = 'https://api.binance.com/api/v3/klines'
+# 每次请求的 K 线数量 (现货上限 1000，合约上限 1500，取两者都支持的值)
+PAGE_LIMIT = 1000
+# 需要重试的 HTTP 状态：限流 (429/418) 与服务端错误
+RETRY_STATUS = {418, 429, 500, 502, 503, 504}
+# 币安 "Invalid symbol" 错误码：合约市场没有该交易对，转用现货
+INVALID_SYMBOL = -1121
+
+
+class KlineRequestError(Exception):
+    """
+    K 线请求失败 (不可重试的错误或重试次数用尽)。
+    """
+
+
+class TokenBucket:
+    """
+    令牌桶限速器，所有交易对的请求共享。
+    rate: 每秒补充的令牌数
+    capacity: 桶容量，即允许的突发请求数
+    """
+
+    def __init__(self, rate=10.0, capacity=20):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, cost=1):
+        async with self._lock: # 排队取令牌，先到先得
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= cost:
+                    self._tokens -= cost
+                    return
+                await asyncio.sleep((cost - self._tokens) / self.rate)
+
+    def penalize(self, seconds):
+        # 服务端要求等待 (Retry-After) 时清空令牌，所有请求一起暂停
+        self._tokens = min(self._tokens, -seconds * self.rate)
+
+
+def page_ranges(gap_start_ns, gap_end_ns, step_ns, limit=PAGE_LIMIT):
+    """
+    把缺失区间 (开盘时间，闭区间) 切成每页最多 limit 根 K 线的请求区间。
+    返回: [(start_ms, end_ms), ...]
+    """
+    starts = np.arange(gap_start_ns, gap_end_ns + 1, step_ns * limit, dtype=np.int64)
+    ends = np.minimum(starts + step_ns * (limit - 1), gap_end_ns)
+    return [(int(a) // 1_000_000, int(b) // 1_000_000) for a, b in zip(starts, ends)]
+
+
+async def fetch_page(session, limiter, url, symbol, interval, start_ms, end_ms,
+                     limit=PAGE_LIMIT, retries=5, backoff=0.5):
+    """
+    请求一页 K 线，限流或服务端错误时按指数退避 (带随机抖动) 重试。
+    交易对在该市场不存在时返回空列表。
+    """
+    params = {'symbol': symbol, 'interval': interval, 'startTime': start_ms, 'endTime': end_ms, 'limit': limit}
+    for attempt in range(retries + 1):
+        await limiter.acquire()
+        try:
+            async with session.get(url, params=params) as resp:
+                if resp.status == 200:
+                    return await resp.json()
+                if resp.status not in RETRY_STATUS:
+                    body = await resp.json(content_type=None)
+                    if isinstance(body, dict) and body.get('code') == INVALID_SYMBOL:
+                        return []
+                    raise KlineRequestError(f"{url} {symbol} HTTP {resp.status}: {body}")
+                retry_after = resp.headers.get('Retry-After')
+                error = f"HTTP {resp.status}"
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            retry_after, error = None, f"{type(e).__name__}: {e}"
+        if attempt == retries:
+            break
+        delay = backoff * 2 ** attempt * (1 + random.random())
+        if retry_after:
+            delay = max(delay, float(retry_after))
+            limiter.penalize(float(retry_after))
+        await asyncio.sleep(delay)
+    raise KlineRequestError(f"{url} {symbol} failed after {retries + 1} attempts ({error})")
+
+
+async def _fetch_gap(session, limiter, symbol, interval, gap, step, futures_url, spot_url, **kwargs):
+    # 与 _fetch_klines 相同：优先合约数据，整个区间都没有合约数据时改用现货
+    pages = page_ranges(gap[0], gap[1], step)
+    for url in (futures_url, spot_url):
+        results = await asyncio.gather(*(fetch_page(session, limiter, url, symbol, interval, a, b, **kwargs)
+                                         for a, b in pages))
+        klines = [row for page in results for row in page]
+        if klines:
+            return klines
+        if url == futures_url:
+            print(f"No Futures data for {symbol}, trying Spot data...")
+    return []
+
+
+async def sync_symbol(session, limiter, symbol, interval, start_str, end_str, data_path="data/",
+                      futures_url=FUTURES_URL, spot_url=SPOT_URL, now=None, **kwargs):
+    """
+    异步增量同步单个交易对，缺失区间的各页并发请求，下载完成后立即合并写入本地数据。
+    返回: (df, fetched)，与 sync_klines 相同
+    """
+    plan = await asyncio.to_thread(_sync_plan, symbol, interval, start_str, end_str, data_path, now)
+    if not plan['gaps']:
+        return plan['df'], False
+
+    print(f"Downloading {len(plan['gaps'])} missing range(s) for {symbol} from Binance...")
+    gap_klines = await asyncio.gather(*(_fetch_gap(session, limiter, symbol, interval, gap, plan['step'],
+                                                   futures_url, spot_url, **kwargs)
+                                        for gap in plan['gaps']), return_exceptions=True)
+    requested, frames = [], []
+    for gap, klines in zip(plan['gaps'], gap_klines):
+        if isinstance(klines, KlineRequestError):
+            print(f"Error fetching {symbol} data from Binance: {klines}")
+        elif isinstance(klines, BaseException):
+            raise klines
+        else:
+            requested.append(gap)
+            if klines:
+                frames.append(_klines_to_frame(klines))
+    if not requested:
+        return plan['df'], False
+    # 失败的区间不合并也不记为空区间；CSV 写入放到线程中，不阻塞其他交易对的下载
+    return await asyncio.to_thread(_apply_sync, plan, frames, symbol, interval, requested), True
+
+
+async def download_all(symbols, interval, start_str, end_str, data_path="data/", rate=10.0, burst=20,
+                       max_connections=20, timeout=30, futures_url=FUTURES_URL, spot_url=SPOT_URL,
+                       now=None, retries=5, backoff=0.5):
+    """
+    并发同步多个交易对的 K 线，共享一个连接池与一个令牌桶限速器。
+    rate / burst: 每秒请求数与突发请求数上限
+    max_connections: 连接池大小
+    futures_url / spot_url: K 线接口地址，测试时指向本地模拟服务 (见 MockKlineServer)
+    返回: {交易对: (df, fetched)}，按完成顺序逐个写入本地数据
+    """
+    limiter = TokenBucket(rate, burst)
+    connector = aiohttp.TCPConnector(limit=max_connections)
+    results = {}
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        async def run(symbol):
+            return symbol, await sync_symbol(session, limiter, symbol, interval, start_str, end_str, data_path,
+                                             futures_url=futures_url, spot_url=spot_url, now=now,
+                                             retries=retries, backoff=backoff)
+
+        for task in asyncio.as_completed([run(symbol) for symbol in symbols]):
+            symbol, result = await task
+            results[symbol] = result
+    return {symbol: results[symbol] for symbol in symbols}
+
+
+class MockKlineServer:
+    """
+    本地模拟的币安 K 线接口，用于测试下载器 (需要 aiohttp)。
+    futures / spot: {交易对: 带 'Open Time' 索引和 OHLCV 列的 DataFrame}，只出现在 spot 中的
+                    交易对在合约接口返回 Invalid symbol
+    fail_rate: 以该概率返回 429 (带 Retry-After)，用于测试重试
+    用法:
+        async with MockKlineServer(futures={'BTCUSDT': df}) as server:
+            await download_all(['BTCUSDT'], '4h', ..., futures_url=server.futures_url, spot_url=server.spot_url)
+    """
+
+    def __init__(self, futures=None, spot=None, fail_rate=0.0, retry_after=0, seed=0):
+        self.markets = {'/fapi/v1/klines': futures or {}, '/api/v3/klines': spot or {}}
+        self.fail_rate = fail_rate
+        self.retry_after = retry_after
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._runner = None
+
+    async def _handle(self, request):
+        from aiohttp import web
+
+        self.requests += 1
+        if self._random.random() < self.fail_rate:
+            return web.json_response({'code': -1003, 'msg': 'Too many requests.'}, status=429,
+                                     headers={'Retry-After': str(self.retry_after)})
+        q = request.query
+        data = self.markets[request.path].get(q['symbol'])
+        if data is None:
+            return web.json_response({'code': INVALID_SYMBOL, 'msg': 'Invalid symbol.'}, status=400)
+        times = data.index.values.astype('datetime64[ms]').view(np.int64)
+        lo = np.searchsorted(times, int(q['startTime']))
+        hi = min(np.searchsorted(times, int(q['endTime']), side='right'), lo + int(q.get('limit', 500)))
+        step = int(np.median(np.diff(times))) if len(times) > 1 else 0
+        rows = data.iloc[lo:hi]
+        body = [[int(t), *(f"{v:.8f}" for v in row), int(t) + step - 1, '0', 0, '0', '0', '0']
+                for t, row in zip(times[lo:hi], rows[['Open', 'High', 'Low', 'Close Price', 'Volume']].to_numpy())]
+        return web.json_response(body)
+
+    async def __aenter__(self):
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_get('/fapi/v1/klines', self._handle)
+        app.router.add_get('/api/v3/klines', self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.futures_url = f'http://127.0.0.1:{port}/fapi/v1/klines'
+        self.spot_url = f'http://127.0.0.1:{port}/api/v3/klines'
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._runner.cleanup()
+
+
+if __name__ == '__main__':
+    import glob
+    import os
+    import tempfile
+
+    from data_store import load_klines
+
+    # 用本地 4 小时数据启动模拟接口，下载到临时目录，并与原文件比对
+    paths = sorted(glob.glob('../data/4hour/*_4h.csv'))
+    source = {os.path.basename(p).split('_')[0]: load_klines(p) for p in paths}
+
+    async def demo(out):
+        async with MockKlineServer(futures=source, fail_rate=0.05) as server:
+            t0 = time.perf_counter()
+            results = await download_all(list(source), '4h', '1 Jan, 2018', '31 Dec, 2025', out,
+                                         rate=200, burst=50, futures_url=server.futures_url,
+                                         spot_url=server.spot_url, now='2026-01-01', backoff=0.05)
+            print(f"{server.requests} requests in {time.perf_counter() - t0:.2f}s")
+        return results
+
+    with tempfile.TemporaryDirectory() as out:
+        for symbol, (df, _) in asyncio.run(demo(out)).items():
+            expected = source[symbol]
+            same = df.index.equals(expected.index) and np.allclose(df.to_numpy(), expected.to_numpy())
+            print(f"{symbol}: {len(df)} bars, matches source: {same}")
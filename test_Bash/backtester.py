@@ -1,32 +1,174 @@
 import pandas as pd
 import numpy as np
+import bisect
 import datetime
 
+import profiling
+from analytics import METRIC_NAMES, performance, trade_stats, infer_periods_per_year
+
+
 class Backtester:
-    def __init__(self, initial_capital, commission_rate, slippage_rate):
+    def __init__(self, initial_capital, commission_rate, slippage_rate, execution=None, margin=None):
+        """
+        execution: engine='execution' 时传给 execution.simulate_execution 的选项 (fill / entry_limit / stop_loss /
+                   take_profit / trail_pct / trail_atr / participation / fees 等)；另可给 'atr_period' (默认 14)，
+                   fees 默认 maker 与 taker 都为 commission_rate
+        margin: engine='margin' 时传给 margin.simulate_margin 的选项 (leverage / allow_short / maintenance_margin /
+                liquidation_fee)；另可给 'funding_file' (本地资金费率 CSV 路径)
+        """
         self.initial_capital = float(initial_capital)
         self.commission_rate = float(commission_rate)
         self.slippage_rate = float(slippage_rate)
+        self.execution = dict(execution or {})
+        self.margin = dict(margin or {})
         self.portfolio = {
             'cash': self.initial_capital,
             'assets': 0 # 持有的资产数量
         }
-        self.trades = [] # 记录每次交易
-        self.equity_curve = pd.Series(dtype=float) # 资金曲线
+        self.trade_log = TradeLog() # 记录每次交易 (结构化数组)
+        # 资金曲线：float64 数组 + datetime64[ns] 时间戳 (单次回测时直接引用数据的索引，不复制)
+        self.equity = np.empty(0)
+        self.equity_times = np.empty(0, dtype='datetime64[ns]')
+        self._equity_curve = None
+
+    @property
+    def equity_curve(self):
+        """
+        资金曲线 pd.Series (首次访问时由数组构造)。
+        """
+        if self._equity_curve is None:
+            self._equity_curve = pd.Series(self.equity, index=pd.DatetimeIndex(self.equity_times), dtype=float)
+        return self._equity_curve
+
+    @property
+    def trades(self):
+        """
+        成交记录 [dict, ...] (按需由 trade_log 转换)。
+        """
+        return self.trade_log.to_frame().to_dict('records')
 
-    def run_backtest(self, data):
+    def run(self, data, engine='vectorized'):
+        """
+        执行回测，结果只保存为数组，不构造 DataFrame / Series。
+        参数同 run_backtest
+        返回: (equity, trade_log)，equity 为 float64 数组 (时间戳见 self.equity_times)
+        """
+        if engine == 'vectorized':
+            self._run_backtest_vectorized(data)
+        elif engine == 'compiled':
+            from kernels import simulate_long_only_compiled # numba 导入较慢，只在使用时加载
+            self._run_backtest_vectorized(data, simulate_long_only_compiled)
+        elif engine == 'loop':
+            self._run_backtest_loop(data)
+        elif engine == 'execution':
+            self._run_backtest_vectorized(data, self._simulate_execution(data))
+        elif engine == 'margin':
+            self._run_backtest_vectorized(data, self._simulate_margin(data))
+        else:
+            raise ValueError(f"Unknown backtest engine: {engine}")
+        return self.equity, self.trade_log
+
+    def run_backtest(self, data, engine='vectorized'):
         """
         执行回测模拟。
         data: 包含 'Close Price' 和 'Signal' 的 DataFrame
+        engine: 'vectorized' 使用 NumPy 事件引擎 (默认)；'compiled' 使用 kernels.py 的编译循环
+                (需要 numba，否则退回纯 Python)；'loop' 使用逐行 iterrows 的参考实现。
+                三者输出完全一致，可用于相互校验。
+                'execution' 使用 execution.py 的 K 线内成交模型 (需要 OHLCV 列，选项见 __init__ 的 execution)；
+                'margin' 使用 margin.py 的多空杠杆模型 (-1 信号开空，选项见 __init__ 的 margin)
+        返回: (equity_curve, trades_df)
+        """
+        self.run(data, engine)
+        return self.equity_curve, self.trade_log.to_frame()
+
+    def _record_equity(self, times, equity):
+        """
+        与已有资金曲线合并：同一时间戳只保留最后一次写入的值，并按时间排序。
+        索引本身唯一且有序时 (单次回测的常见情况) 直接引用 times，不复制。
+        """
+        if len(self.equity):
+            times = np.concatenate((self.equity_times, times))
+            equity = np.concatenate((self.equity, equity))
+        if len(times) > 1 and not (times[1:] > times[:-1]).all():
+            keep = ~pd.Index(times).duplicated(keep='last')
+            times, equity = times[keep], equity[keep]
+            order = np.argsort(times, kind='stable')
+            times, equity = times[order], equity[order]
+        self.equity_times, self.equity = times, equity
+        self._equity_curve = None
+
+    def _run_backtest_vectorized(self, data, simulate=None):
+        """
+        向量化回测：把 'Signal' 列转换为持仓变化事件，只在事件处推进现金/持仓状态，
+        资金曲线按整列数组一次性计算。
+        simulate: 数组回测函数，默认 simulate_long_only
         """
+        simulate = simulate or simulate_long_only
+        result = simulate(data['Close Price'].to_numpy(dtype=float),
+                          data['Signal'].to_numpy(),
+                          self.portfolio['cash'],
+                          self.commission_rate,
+                          self.slippage_rate)
+
+        times = _index_times(data)
+        self.trade_log.extend(times, result['fills'])
+        self.portfolio['cash'] = result['cash']
+        self.portfolio['assets'] = result['assets']
+        self._record_equity(times, np.asarray(result['equity'], dtype=np.float64))
+
+    def _simulate_execution(self, data):
+        """
+        把 K 线内成交模型包装成 simulate_long_only 的调用形式，其余列 (Open / High / Low / Volume) 从 data 读取。
+        """
+        from execution import simulate_execution
+        from indicators import atr
+
+        options = dict(self.execution)
+        options.setdefault('fees', (self.commission_rate, self.commission_rate))
+        atr_period = options.pop('atr_period', 14)
+        columns = [data[c].to_numpy(dtype=float) for c in ('Open', 'High', 'Low', 'Volume')]
+        if options.get('trail_atr') is not None and options.get('atr') is None:
+            options['atr'] = atr(columns[1], columns[2], data['Close Price'].to_numpy(dtype=float), atr_period)
+
+        def simulate(close, signal, cash, commission_rate, slippage_rate):
+            open_, high, low, volume = columns
+            return simulate_execution(open_, high, low, close, volume, signal, cash,
+                                      slippage_rate=slippage_rate, **options)
+        return simulate
+
+    def _simulate_margin(self, data):
+        """
+        把多空杠杆模型包装成 simulate_long_only 的调用形式：资金费率按 K 线对齐，Open / High / Low 用于强平判断。
+        """
+        from margin import simulate_margin, load_funding_rates, funding_per_bar
+
+        options = dict(self.margin)
+        path = options.pop('funding_file', None)
+        if path is not None:
+            options['funding'] = funding_per_bar(_index_times(data), load_funding_rates(path))
+        columns = {name: data[c].to_numpy(dtype=float) for name, c in
+                   (('open_', 'Open'), ('high', 'High'), ('low', 'Low')) if c in data}
+
+        def simulate(close, signal, cash, commission_rate, slippage_rate):
+            return simulate_margin(close, signal, cash, commission_rate, slippage_rate, **columns, **options)
+        return simulate
+
+    def _run_backtest_loop(self, data):
+        """
+        逐行参考实现 (iterrows)，保留用于校验向量化引擎。
+        """
+        profiling.count('loop_rows', len(data))
         current_position = 0 # -1: 空仓, 0: 无仓位, 1: 多仓
+        times = _index_times(data)
+        equity = np.empty(len(data))
 
-        for i, row in data.iterrows():
+        for k, (i, row) in enumerate(data.iterrows()):
             current_price = row['Close Price']
             signal = row['Signal']
             
             # 记录每日总资产
-            self.equity_curve.loc[i] = self.portfolio['cash'] + self.portfolio['assets'] * current_price
+            equity[k] = self.portfolio['cash'] + self.portfolio['assets'] * current_price
 
             # 交易逻辑
             if signal == 1 and current_position <= 0: # 买入信号且当前不是多头 (空仓或无仓位)
@@ -35,24 +177,18 @@ class Backtester:
                 if available_cash <= 0:
                     continue # 没有钱不能买
 
-                # 模拟买入
+                # 模拟买入：成交额与佣金合计不超过扣除滑点后的资金
                 trade_amount_usd = available_cash * (1 - self.slippage_rate) # 考虑滑点
-                amount_to_buy = trade_amount_usd / current_price
+                amount_to_buy = trade_amount_usd / (current_price * (1 + self.commission_rate))
                 commission = amount_to_buy * current_price * self.commission_rate # 买入佣金
 
-                if self.portfolio['cash'] >= (amount_to_buy * current_price + commission):
-                    self.portfolio['cash'] -= (amount_to_buy * current_price + commission)
-                    self.portfolio['assets'] += amount_to_buy
-                    self.trades.append({
-                        'Date': i,
-                        'Type': 'BUY',
-                        'Price': current_price,
-                        'Amount': amount_to_buy,
-                        'Commission': commission,
-                        'Cash_After_Trade': self.portfolio['cash'],
-                        'Assets_After_Trade': self.portfolio['assets']
-                    })
-                    current_position = 1 # 转为多仓
+                # 舍入误差可能让现金出现极小的负数，截断为 0
+                cost = amount_to_buy * current_price + commission
+                self.portfolio['cash'] = max(self.portfolio['cash'] - cost, 0.0)
+                self.portfolio['assets'] += amount_to_buy
+                self.trade_log.append(times[k], FILL_BUY, current_price, amount_to_buy, commission,
+                                      self.portfolio['cash'], self.portfolio['assets'])
+                current_position = 1 # 转为多仓
 
             elif signal == -1 and current_position >= 0: # 卖出信号且当前不是空头 (多仓或无仓位)
                 # 模拟卖出
@@ -62,15 +198,8 @@ class Backtester:
                     
                     self.portfolio['cash'] += (amount_to_sell * current_price * (1 - self.slippage_rate) - commission) # 考虑滑点
                     self.portfolio['assets'] = 0 # 清仓
-                    self.trades.append({
-                        'Date': i,
-                        'Type': 'SELL',
-                        'Price': current_price,
-                        'Amount': amount_to_sell,
-                        'Commission': commission,
-                        'Cash_After_Trade': self.portfolio['cash'],
-                        'Assets_After_Trade': self.portfolio['assets']
-                    })
+                    self.trade_log.append(times[k], FILL_SELL, current_price, amount_to_sell, commission,
+                                          self.portfolio['cash'], self.portfolio['assets'])
                     current_position = -1 # 转为空仓 (这里简单处理为空仓，不涉及卖空)
                 else: # 如果是无仓位，卖出信号不操作
                     current_position = -1 # 也记录为无仓位，等待买入信号
@@ -82,36 +211,243 @@ class Backtester:
             commission = amount_to_sell * final_price * self.commission_rate
             self.portfolio['cash'] += (amount_to_sell * final_price * (1 - self.slippage_rate) - commission)
             self.portfolio['assets'] = 0
-            self.trades.append({
-                'Date': data.index[-1],
-                'Type': 'SELL_FINAL',
-                'Price': final_price,
-                'Amount': amount_to_sell,
-                'Commission': commission,
-                'Cash_After_Trade': self.portfolio['cash'],
-                'Assets_After_Trade': self.portfolio['assets']
-            })
-
-        self.equity_curve.loc[data.index[-1]] = self.portfolio['cash'] + self.portfolio['assets'] * data['Close Price'].iloc[-1]
+            self.trade_log.append(times[-1], FILL_SELL_FINAL, final_price, amount_to_sell, commission,
+                                  self.portfolio['cash'], self.portfolio['assets'])
+
+        equity[-1] = self.portfolio['cash'] + self.portfolio['assets'] * data['Close Price'].iloc[-1]
         
         # 确保资金曲线索引是唯一的，并且排序
-        self.equity_curve = self.equity_curve.loc[~self.equity_curve.index.duplicated(keep='last')].sort_index()
-        return self.equity_curve, pd.DataFrame(self.trades)
-
-    def analyze_performance(self, equity_curve, trades_df):
-        # Add this block at the beginning of the method
-        if trades_df.empty or 'Type' not in trades_df.columns:
-            print("Warning: No trades recorded or 'Type' column not found in trades data. Returning default performance metrics.")
-            # Return a default performance dictionary for no trades
-            final_capital = equity_curve.iloc[-1] if not equity_curve.empty else self.initial_capital
-            return {
-                'Initial Capital': f"{self.initial_capital:,.2f}",
-                'Final Capital': f"{final_capital:,.2f}",
-                'Cumulative Return (%)': "0.00%",
-                'Annualized Return (%)': "0.00%",
-                'Max Drawdown (%)': "0.00%",
-                'Sharpe Ratio': "0.00",
-                'Total Trades': 0,
-                'Win Rate (%)': "0.00%",
-                'Profit/Loss Ratio': "0.00"
-            }
\ No newline at end of file
+        self._record_equity(times, equity)
+
+    def analyze_performance(self, equity_curve=None, trades_df=None):
+        """
+        计算绩效指标 (数值，比例不乘 100；显示时用 analytics.format_metrics 格式化)。
+        equity_curve / trades_df: 可选的资金曲线 Series 与成交 DataFrame，默认使用本次回测的数组
+        返回: dict，包含 initial_capital、final_capital、analytics.METRIC_NAMES、exposure 与
+              analytics.TRADE_METRIC_NAMES (交易按 买入 -> 卖出 配对，收益率已扣除成本)
+        """
+        if equity_curve is None:
+            equity, times = self.equity, self.equity_times
+        else:
+            equity, times = equity_curve.to_numpy(dtype=float), _index_times(equity_curve)
+        records = self.trade_log.records if trades_df is None else _records_from_frame(trades_df)
+
+        metrics = {'initial_capital': self.initial_capital,
+                   'final_capital': float(equity[-1]) if len(equity) else self.initial_capital}
+        if len(equity) > 1:
+            metrics.update(performance(equity, infer_periods_per_year(times), exposure_mask(times, records)))
+        else:
+            metrics.update({name: 0.0 for name in METRIC_NAMES}, exposure=0.0)
+        metrics.update(trade_stats(trade_returns(records, self.initial_capital)))
+        return metrics
+
+
+# 回测结果的版本：修改引擎导致相同输入得到不同结果时递增，results.ResultStore 中的旧结果随之失效
+ENGINE_VERSION = 3
+
+# 成交类型，fills 中以下标记录 (STOP / TAKE_PROFIT 只由 execution.simulate_execution 产生，
+# SHORT / COVER / LIQUIDATION 只由 margin.simulate_margin 产生；空头持仓的 assets 为负数)
+FILL_BUY, FILL_SELL, FILL_SELL_FINAL, FILL_STOP, FILL_TAKE_PROFIT = 0, 1, 2, 3, 4
+FILL_SHORT, FILL_COVER, FILL_LIQUIDATION = 5, 6, 7
+FILL_TYPES = ('BUY', 'SELL', 'SELL_FINAL', 'STOP', 'TAKE_PROFIT', 'SHORT', 'COVER', 'LIQUIDATION')
+
+# 一笔成交 57 字节 (dict 形式约 1KB)；可直接 pickle 或放入共享内存
+TRADE_DTYPE = np.dtype([
+    ('time', 'datetime64[ns]'),
+    ('type', np.int8),
+    ('price', np.float64),
+    ('amount', np.float64),
+    ('commission', np.float64),
+    ('cash', np.float64),
+    ('assets', np.float64),
+])
+# simulate_long_only 的 fills 元组布局
+_FILL_DTYPE = np.dtype([('bar', np.int64)] + TRADE_DTYPE.descr[1:])
+TRADE_COLUMNS = {'time': 'Date', 'type': 'Type', 'price': 'Price', 'amount': 'Amount',
+                 'commission': 'Commission', 'cash': 'Cash_After_Trade', 'assets': 'Assets_After_Trade'}
+
+
+def _index_times(data):
+    # datetime64[ns] 索引直接返回底层数组 (不复制)
+    return data.index.values.astype('datetime64[ns]', copy=False)
+
+
+def _records_from_frame(trades_df):
+    # trades_frame 的逆变换
+    records = np.zeros(len(trades_df), dtype=TRADE_DTYPE)
+    if len(trades_df):
+        records['time'] = pd.DatetimeIndex(trades_df['Date']).values
+        records['type'] = pd.Index(FILL_TYPES).get_indexer(trades_df['Type'])
+        for name in ('price', 'amount', 'commission', 'cash', 'assets'):
+            records[name] = trades_df[TRADE_COLUMNS[name]].to_numpy(dtype=float)
+    return records
+
+
+def trade_returns(records, initial_cash):
+    """
+    每笔完整交易 (开仓到平仓，多空均可) 扣除成本后的收益率：平仓后现金 / 开仓前现金 - 1。
+    全仓进出，开仓前现金即上一笔成交后的现金 (第一笔为 initial_cash)；平仓可以分多笔成交，未平仓的交易不计。
+    records: TRADE_DTYPE 结构化数组
+    """
+    assets = records['assets']
+    held_before = np.concatenate(([0.0], assets[:-1])) != 0
+    cash_after = records['cash']
+    cash_before = np.concatenate(([initial_cash], cash_after[:-1]))
+    closes = np.flatnonzero((assets == 0) & held_before)
+    opens = np.maximum.accumulate(np.where((assets != 0) & ~held_before, np.arange(len(assets)), -1))[closes]
+    return cash_after[closes] / cash_before[opens] - 1.0
+
+
+def exposure_mask(times, records):
+    """
+    每根 K 线收盘后是否持仓 (最近一笔成交后仍有持仓)。
+    times: 资金曲线的时间戳；records: TRADE_DTYPE 结构化数组
+    """
+    if not len(records):
+        return np.zeros(len(times), dtype=bool)
+    last = np.searchsorted(records['time'], times, side='right') - 1
+    return (last >= 0) & (records['assets'][np.maximum(last, 0)] != 0)
+
+
+def trades_frame(records):
+    """
+    TRADE_DTYPE 结构化数组 -> 成交 DataFrame (列名与原来的字典记录相同)。
+    """
+    return pd.DataFrame({
+        'Date': pd.DatetimeIndex(records['time']),
+        'Type': np.asarray(FILL_TYPES, dtype=object)[records['type']],
+        **{TRADE_COLUMNS[name]: records[name] for name in ('price', 'amount', 'commission', 'cash', 'assets')},
+    })
+
+
+class TradeLog:
+    """
+    紧凑的成交记录：预分配的 TRADE_DTYPE 结构化数组，容量不足时倍增。
+    只在 to_frame() 时构造 DataFrame。
+    """
+    __slots__ = ('_records', '_n')
+
+    def __init__(self, capacity=16):
+        self._records = np.empty(capacity, dtype=TRADE_DTYPE)
+        self._n = 0
+
+    def _reserve(self, extra):
+        needed = self._n + extra
+        if needed > len(self._records):
+            grown = np.empty(max(needed, 2 * len(self._records)), dtype=TRADE_DTYPE)
+            grown[:self._n] = self._records[:self._n]
+            self._records = grown
+
+    def append(self, time, kind, price, amount, commission, cash, assets):
+        self._reserve(1)
+        self._records[self._n] = (time, kind, price, amount, commission, cash, assets)
+        self._n += 1
+
+    def extend(self, times, fills):
+        """
+        追加 simulate_long_only 格式的成交 [(bar, type, price, amount, commission, cash, assets), ...]。
+        times: 回测数据的时间戳数组，bar 为其下标
+        """
+        if not len(fills):
+            return
+        fills = np.array(fills, dtype=_FILL_DTYPE)
+        self._reserve(len(fills))
+        out = self._records[self._n:self._n + len(fills)]
+        out['time'] = times[fills['bar']]
+        for name in TRADE_DTYPE.names[1:]:
+            out[name] = fills[name]
+        self._n += len(fills)
+
+    @property
+    def records(self):
+        """
+        已记录成交的结构化数组视图 (不复制)。
+        """
+        return self._records[:self._n]
+
+    def to_frame(self):
+        return trades_frame(self.records)
+
+    def __len__(self):
+        return self._n
+
+    def __reduce__(self):
+        # 只 pickle 已使用的部分
+        return (_trade_log_from_records, (self.records.copy(),))
+
+
+def _trade_log_from_records(records):
+    log = TradeLog(max(len(records), 1))
+    log._records[:len(records)] = records
+    log._n = len(records)
+    return log
+
+
+def simulate_long_only(close, signal, cash, commission_rate, slippage_rate):
+    """
+    纯数组版的多头回测核心，与 Backtester 的逐行循环逐位一致。
+    close: 收盘价 float64 数组
+    signal: 信号数组 (1: 买入, -1: 卖出, 其他: 保持)
+    cash: 初始现金
+    返回: dict
+        'equity': 每根 K 线成交前的总资产 (最后一根为期末清仓后的总资产)
+        'fills': [(bar, type, price, amount, commission, cash_after, assets_after), ...]
+        'cash', 'assets': 回测结束后的现金与持仓
+    """
+    close = np.asarray(close, dtype=float)
+    signal = np.asarray(signal)
+    n = len(close)
+    initial_cash = cash = float(cash)
+    assets = 0
+    keep = 1 - slippage_rate
+
+    # 持仓状态只在信号切换处变化：进场 = 前一个非零信号不是 1 的买入信号，
+    # 出场 = 前一个非零信号是 1 的卖出信号。事件数远小于 K 线数，逐事件推进现金即可
+    active = np.flatnonzero((signal == 1) | (signal == -1))
+    side = signal[active]
+    prev = np.concatenate(([0], side[:-1]))
+    entries = active[(side == 1) & (prev != 1)].tolist()
+    exits = active[(side == -1) & (prev == 1)].tolist()
+    entry_prices = close[entries].tolist()
+    exit_prices = close[exits].tolist()
+
+    fills = []
+    i = 0
+    while i < len(entries) and cash > 0:
+        bar, price = entries[i], entry_prices[i]
+        amount = (cash * keep) / (price * (1 + commission_rate))
+        commission = amount * price * commission_rate
+        cash = max(cash - (amount * price + commission), 0.0)
+        assets += amount
+        fills.append((bar, FILL_BUY, price, amount, commission, cash, assets))
+
+        # 持仓：在下一根卖出信号处清仓 (它一定是出场事件)
+        j = bisect.bisect_right(exits, bar)
+        if j == len(exits):
+            break
+        bar, price = exits[j], exit_prices[j]
+        amount = assets
+        commission = amount * price * commission_rate
+        cash += (amount * price * keep - commission)
+        assets = 0
+        fills.append((bar, FILL_SELL, price, amount, commission, cash, assets))
+        i = bisect.bisect_right(entries, bar)
+
+    # 每根 K 线的资金 = 该 K 线成交前的现金 + 持仓 * 收盘价
+    fill_bars = np.array([f[0] for f in fills], dtype=np.int64)
+    cash_states = np.array([initial_cash] + [f[5] for f in fills], dtype=float)
+    asset_states = np.array([0.0] + [f[6] for f in fills], dtype=float)
+    k = np.searchsorted(fill_bars, np.arange(n), side='left')
+    equity = cash_states[k] + asset_states[k] * close
+
+    # 策略结束时清仓
+    if assets > 0:
+        price = float(close[-1])
+        amount = assets
+        commission = amount * price * commission_rate
+        cash += (amount * price * keep - commission)
+        assets = 0
+        fills.append((n - 1, FILL_SELL_FINAL, price, amount, commission, cash, assets))
+    equity[-1] = cash + assets * close[-1]
+
+    return {'equity': equity, 'fills': fills, 'cash': cash, 'assets': assets}
@@ -0,0 +1,309 @@
+import argparse
+import gc
+import glob
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import data_store
+import profiling
+from data_store import load_klines, bt_feed
+from indicators import calculate_indicators_for_strategy
+from strategy import Strategy
+from backtester import Backtester
+
+# 回测流程各阶段的基准测试：加载、指标、信号、模拟、backtrader 策略。
+# 每个阶段重复 repeat 次取最短耗时，再单独运行一次用 tracemalloc 记录峰值内存。
+
+STAGES = ['load', 'indicators', 'signals', 'simulate', 'backtrader']
+# 冷启动 (新解释器执行到 import main 完成) 的目标耗时；启动时不应导入的重量级依赖，
+# 它们只在下载、绘图、backtrader 对照或编译内核时按需导入
+STARTUP_TARGET_MS = 400
+HEAVY_MODULES = ('binance', 'matplotlib', 'seaborn', 'backtrader', 'ta', 'numba', 'aiohttp')
+MACD_STRATEGY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'stragedy', 'day', 'macd.py')
+
+
+def synthetic_klines(n, interval='4h', seed=0, start='2000-01-01'):
+    """
+    生成 n 根几何布朗运动的合成 K 线，用于大规模测试。
+    返回: 与 load_klines 格式相同的 DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    close = 100.0 * np.exp(np.cumsum(rng.normal(0.0, 0.01, n)))
+    open_ = np.concatenate(([100.0], close[:-1]))
+    spread = np.abs(rng.normal(0.0, 0.005, n)) * close
+    index = pd.date_range(start, periods=n, freq=pd.Timedelta(interval), name='Open Time')
+    return pd.DataFrame({
+        'Open': open_,
+        'High': np.maximum(open_, close) + spread,
+        'Low': np.minimum(open_, close) - spread,
+        'Close Price': close,
+        'Volume': rng.lognormal(10.0, 1.0, n),
+    }, index=index)
+
+
+def _load_macd_strategy():
+    # stragedy 目录不是本目录下的包，按文件路径加载策略类 (backtrader 需要在 sys.modules 中找到模块)
+    module = sys.modules.get('bench_macd')
+    if module is None:
+        spec = importlib.util.spec_from_file_location('bench_macd', MACD_STRATEGY_FILE)
+        module = sys.modules['bench_macd'] = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    return module.MacdStrategy
+
+
+def _run_backtrader(csv_path, strategy_params, initial_capital, commission_rate):
+    import backtrader as bt
+
+    cerebro = bt.Cerebro()
+    cerebro.addstrategy(_load_macd_strategy(), printlog=False,
+                        fast_period=strategy_params.get('fast_period', 12),
+                        slow_period=strategy_params.get('slow_period', 26),
+                        signal_period=strategy_params.get('signal_period', 9))
+    cerebro.adddata(bt_feed(csv_path))
+    cerebro.broker.setcash(initial_capital)
+    cerebro.broker.setcommission(commission=commission_rate)
+    with profiling.span('backtrader', path=csv_path):
+        cerebro.run()
+    profiling.count('backtrader_bars', len(cerebro.datas[0]))
+    return cerebro.broker.getvalue()
+
+
+def _load(csv_path):
+    # 清空进程内缓存，计入打开内存映射与构造 DataFrame 的开销
+    data_store._opened.clear()
+    return load_klines(csv_path).sort_index().dropna()
+
+
+def _measure(func, repeat):
+    """
+    返回 (最短耗时秒数, 峰值内存 MB, 最后一次的返回值)。
+    """
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        gc.collect()
+        t0 = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - t0)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak / 2 ** 20, result
+
+
+def bench_pipeline(symbol, interval, csv_path=None, data=None, stages=STAGES, repeat=3, strategy='macd',
+                   strategy_params=None, initial_capital=10000, commission_rate=0.00075, slippage_rate=0.0001):
+    """
+    对一个交易对的数据依次测试各阶段。data 为 None 时从 csv_path 加载。
+    没有 csv_path (合成数据) 时跳过 'load' 与 'backtrader'。
+    返回: [{'stage', 'symbol', 'interval', 'bars', 'seconds', 'bars_per_sec', 'peak_mb'}, ...]
+    """
+    strategy_params = strategy_params or {}
+    rows = []
+
+    def record(stage, func, bars):
+        seconds, peak_mb, result = _measure(func, repeat)
+        rows.append({'stage': stage, 'symbol': symbol, 'interval': interval, 'bars': int(bars),
+                     'seconds': seconds, 'bars_per_sec': bars / seconds if seconds > 0 else float('inf'),
+                     'peak_mb': peak_mb})
+        print(f"{symbol:>10} {interval:>4} {stage:<11} {bars:>9} bars {seconds * 1e3:10.2f} ms "
+              f"{rows[-1]['bars_per_sec']:14,.0f} bars/s {peak_mb:9.1f} MB")
+        return result
+
+    if data is None:
+        data = _load(csv_path)
+        if 'load' in stages:
+            data = record('load', lambda: _load(csv_path), len(data))
+    n = len(data)
+
+    # 各阶段独立计时：指标不使用缓存，信号与模拟在各自输入的副本上运行
+    with_indicators = calculate_indicators_for_strategy(data.copy(), strategy, strategy_params, cache=None)
+    if 'indicators' in stages:
+        with_indicators = record('indicators', lambda: calculate_indicators_for_strategy(
+            data.copy(), strategy, strategy_params, cache=None), n)
+    with_signals = Strategy(strategy, strategy_params).generate_signals(with_indicators.copy())
+    if 'signals' in stages:
+        with_signals = record('signals', lambda: Strategy(strategy, strategy_params).generate_signals(
+            with_indicators.copy()), n)
+    with_signals = with_signals.dropna()
+    if 'simulate' in stages:
+        record('simulate', lambda: Backtester(initial_capital, commission_rate, slippage_rate).run_backtest(
+            with_signals), len(with_signals))
+    if 'backtrader' in stages and csv_path is not None and strategy == 'macd':
+        record('backtrader', lambda: _run_backtrader(csv_path, strategy_params, initial_capital,
+                                                     commission_rate), n)
+    return rows
+
+
+def compare(results, baseline, threshold=0.2, min_delta=0.001):
+    """
+    与基线比较，找出变慢超过 threshold (相对比例) 的阶段。
+    min_delta: 绝对差小于该秒数时忽略，避免毫秒以下的计时噪声造成误报
+    返回: 回归列表 [{'stage', 'symbol', 'interval', 'seconds', 'baseline', 'slowdown'}, ...]
+    """
+    base = {(r['stage'], r['symbol'], r['interval']): r for r in baseline['results']}
+    regressions = []
+    for r in results['results']:
+        b = base.get((r['stage'], r['symbol'], r['interval']))
+        if b is None or b['bars'] != r['bars']:
+            continue
+        if r['seconds'] > b['seconds'] * (1 + threshold) and r['seconds'] - b['seconds'] > min_delta:
+            regressions.append({'stage': r['stage'], 'symbol': r['symbol'], 'interval': r['interval'],
+                                'seconds': r['seconds'], 'baseline': b['seconds'],
+                                'slowdown': r['seconds'] / b['seconds'] - 1})
+    return regressions
+
+
+def bench_startup(modules=('main', 'runner'), repeat=5):
+    """
+    冷启动耗时：每次在新的解释器进程中导入模块，取最短耗时，并检查导入了哪些 HEAVY_MODULES。
+    返回: [{'module', 'seconds' (进程启动到导入完成), 'import_seconds', 'heavy'}, ...]
+    """
+    code = ("import sys, time; t0 = time.perf_counter(); import {0}; print(time.perf_counter() - t0); "
+            "print(','.join(m for m in {1!r} if m in sys.modules))")
+    here = os.path.dirname(os.path.abspath(__file__))
+    rows = []
+    for module in modules:
+        best = best_import = float('inf')
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            out = subprocess.run([sys.executable, '-c', code.format(module, HEAVY_MODULES)], cwd=here,
+                                 capture_output=True, text=True, check=True).stdout.splitlines()
+            best = min(best, time.perf_counter() - t0)
+            best_import = min(best_import, float(out[0]))
+        heavy = [m for m in out[1].split(',') if m] if len(out) > 1 else []
+        rows.append({'module': module, 'seconds': best, 'import_seconds': best_import, 'heavy': heavy})
+        print(f"startup {module:<8} {best * 1e3:8.1f} ms (import {best_import * 1e3:.1f} ms)  "
+              f"heavy modules: {', '.join(heavy) or 'none'}")
+    return rows
+
+
+def run_suite(data_paths, symbols=None, stages=STAGES, repeat=3, synthetic_bars=(1_000_000,),
+              strategy='macd', strategy_params=None, initial_capital=10000, commission_rate=0.00075,
+              slippage_rate=0.0001):
+    """
+    在本地数据 (每个周期目录下的所有 CSV 或指定交易对) 与合成数据上运行全部基准测试。
+    data_paths: {周期: 数据目录}
+    synthetic_bars: 合成数据的 K 线数量列表，合成数据额外测试 'load' (写入临时 CSV 后从列式缓存加载)
+    返回: {'meta': 环境信息, 'results': [...]}
+    """
+    kwargs = dict(stages=stages, repeat=repeat, strategy=strategy, strategy_params=strategy_params,
+                  initial_capital=initial_capital, commission_rate=commission_rate, slippage_rate=slippage_rate)
+    rows = []
+    for interval, directory in data_paths.items():
+        for csv_path in sorted(glob.glob(os.path.join(directory, f'*_{interval}.csv'))):
+            symbol = os.path.basename(csv_path).split('_')[0]
+            if symbols and symbol not in symbols:
+                continue
+            rows += bench_pipeline(symbol, interval, csv_path=csv_path, **kwargs)
+
+    for n in synthetic_bars:
+        data = synthetic_klines(n)
+        label = f'SYN{n}'
+        if 'load' in stages:
+            with tempfile.TemporaryDirectory() as tmp:
+                csv_path = os.path.join(tmp, f'{label}_4h.csv')
+                data.to_csv(csv_path)
+                data_store.ensure_store(csv_path)
+                seconds, peak_mb, _ = _measure(lambda: _load(csv_path), repeat)
+                data_store._opened.clear()
+            rows.append({'stage': 'load', 'symbol': label, 'interval': '4h', 'bars': n, 'seconds': seconds,
+                         'bars_per_sec': n / seconds, 'peak_mb': peak_mb})
+            print(f"{label:>10} {'4h':>4} {'load':<11} {n:>9} bars {seconds * 1e3:10.2f} ms "
+                  f"{n / seconds:14,.0f} bars/s {peak_mb:9.1f} MB")
+        rows += bench_pipeline(label, '4h', data=data, **kwargs)
+
+    meta = {
+        'timestamp': pd.Timestamp.now(tz='UTC').isoformat(),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'repeat': repeat,
+        'strategy': strategy,
+    }
+    return {'meta': meta, 'results': rows}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the backtest pipeline stages.')
+    parser.add_argument('--config', default='config.json')
+    parser.add_argument('--symbols', nargs='*', help='only these symbols (default: every CSV in the data dirs)')
+    parser.add_argument('--intervals', nargs='*', help='only these intervals (default: all in data_paths)')
+    parser.add_argument('--stages', nargs='*', default=STAGES, choices=STAGES)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--synthetic', type=int, nargs='*', default=[1_000_000],
+                        help='synthetic bar counts (pass with no values to skip)')
+    parser.add_argument('--out', default='../output/benchmark.json')
+    parser.add_argument('--baseline', help='baseline JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed relative slowdown')
+    parser.add_argument('--save-baseline', action='store_true', help='also write the results to --baseline')
+    parser.add_argument('--startup', action='store_true',
+                        help=f'only check cold start: fail if importing main takes over {STARTUP_TARGET_MS} ms '
+                             'or pulls in a heavy dependency')
+    args = parser.parse_args(argv)
+
+    if args.startup:
+        rows = bench_startup()
+        slow = [r for r in rows if r['module'] == 'main' and r['seconds'] * 1e3 > STARTUP_TARGET_MS]
+        heavy = [r for r in rows if r['heavy']]
+        for r in slow:
+            print(f"SLOW STARTUP {r['module']}: {r['seconds'] * 1e3:.1f} ms > {STARTUP_TARGET_MS} ms")
+        for r in heavy:
+            print(f"HEAVY IMPORT {r['module']}: {', '.join(r['heavy'])}")
+        return 1 if slow or heavy else 0
+
+    with open(args.config, 'r') as f:
+        config = json.load(f)
+    data_paths = config.get('data_paths', {config['interval']: config['data_path']})
+    if args.intervals:
+        data_paths = {k: v for k, v in data_paths.items() if k in args.intervals}
+
+    results = run_suite(data_paths, symbols=args.symbols, stages=args.stages, repeat=args.repeat,
+                        synthetic_bars=args.synthetic,
+                        strategy_params=config['strategy_params'].get('macd', {}),
+                        initial_capital=config['initial_capital'], commission_rate=config['commission_rate'],
+                        slippage_rate=config['slippage_rate'])
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {args.out}")
+
+    if not args.baseline:
+        return 0
+    if args.save_baseline or not os.path.exists(args.baseline):
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    with open(args.baseline, 'r') as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    for r in regressions:
+        print(f"REGRESSION {r['symbol']} {r['interval']} {r['stage']}: {r['seconds'] * 1e3:.2f} ms vs "
+              f"{r['baseline'] * 1e3:.2f} ms baseline (+{r['slowdown']:.0%})")
+    if regressions:
+        return 1
+    print(f"No stage slower than baseline by more than {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
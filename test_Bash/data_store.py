@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+try:
+    import profiling
+except ImportError: # stragedy 下的脚本以 stock_quant.test_Bash.data_store 导入本模块
+    from . import profiling
+
+# 本地列式 K 线缓存：每个 CSV 只解析一次，之后以内存映射的 .npy 读取
+# 目录结构: <csv 所在目录>/.colstore/<SYMBOL>_<interval>/{time.npy, ohlcv.npy, meta.json}
+STORE_DIR = '.colstore'
+STORE_VERSION = 1
+OHLCV_COLUMNS = ['Open', 'High', 'Low', 'Close Price', 'Volume']
+
+# 进程内缓存: csv 路径 -> (mtime_ns, size, time, ohlcv)
+_opened = {}
+
+
+def _store_dir(csv_path):
+    head, name = os.path.split(os.path.abspath(csv_path))
+    return os.path.join(head, STORE_DIR, os.path.splitext(name)[0])
+
+
+def _file_hash(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _read_meta(store):
+    try:
+        with open(os.path.join(store, 'meta.json'), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _write_atomic(path, write):
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, 'wb') as f:
+        write(f)
+    os.replace(tmp, path)
+
+
+def _write_meta(store, meta):
+    _write_atomic(os.path.join(store, 'meta.json'),
+                  lambda f: f.write(json.dumps(meta, indent=2).encode('utf-8')))
+
+
+def build_store(csv_path):
+    """
+    从 CSV 构建列式缓存 (时间戳 int64 纳秒，OHLCV float64)。
+    数组先写入临时文件再原子替换，meta.json 最后写入，作为缓存有效的标记。
+    csv_path: K 线 CSV 路径，需包含 'Open Time' 以及 OHLCV_COLUMNS 列
+    返回: meta 字典
+    """
+    store = _store_dir(csv_path)
+    os.makedirs(store, exist_ok=True)
+    st = os.stat(csv_path)
+    digest = _file_hash(csv_path)
+
+    with profiling.span('parse_csv', path=csv_path):
+        df = pd.read_csv(csv_path, index_col='Open Time', parse_dates=True)
+    profiling.count('csv_rows', len(df))
+    times = df.index.values.astype('datetime64[ns]').view(np.int64)
+    # (5, n) 布局：每一行是一列数据，在内存中连续
+    ohlcv = np.ascontiguousarray(df[OHLCV_COLUMNS].to_numpy(dtype=np.float64).T)
+
+    _write_atomic(os.path.join(store, 'time.npy'), lambda f: np.save(f, times))
+    _write_atomic(os.path.join(store, 'ohlcv.npy'), lambda f: np.save(f, ohlcv))
+    meta = {
+        'version': STORE_VERSION,
+        'source': os.path.basename(csv_path),
+        'mtime_ns': st.st_mtime_ns,
+        'size': st.st_size,
+        'sha1': digest,
+        'rows': int(len(times)),
+    }
+    _write_meta(store, meta)
+    return meta
+
+
+def ensure_store(csv_path):
+    """
+    确认 csv_path 的列式缓存可用：mtime 与大小未变则直接使用；
+    mtime 变了但内容哈希相同则只刷新 meta；否则重建。
+    返回: meta 字典
+    """
+    store = _store_dir(csv_path)
+    st = os.stat(csv_path)
+    meta = _read_meta(store)
+    if meta is None or meta.get('version') != STORE_VERSION:
+        return build_store(csv_path)
+    if meta['mtime_ns'] == st.st_mtime_ns and meta['size'] == st.st_size:
+        return meta
+    if meta['size'] == st.st_size and meta['sha1'] == _file_hash(csv_path):
+        meta['mtime_ns'] = st.st_mtime_ns
+        _write_meta(store, meta)
+        return meta
+    print(f"Source {csv_path} changed, rebuilding column store.")
+    return build_store(csv_path)
+
+
+def load_arrays(csv_path):
+    """
+    以内存映射方式读取列式缓存 (必要时先构建)。
+    返回: (time, ohlcv)，time 为 int64 纳秒时间戳 (n,)，ohlcv 为 float64 (5, n)，
+          行顺序与 OHLCV_COLUMNS 一致。数组只读。
+    """
+    key = os.path.abspath(csv_path)
+    st = os.stat(key)
+    cached = _opened.get(key)
+    if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2], cached[3]
+
+    ensure_store(key)
+    store = _store_dir(key)
+    times = np.load(os.path.join(store, 'time.npy'), mmap_mode='r')
+    ohlcv = np.load(os.path.join(store, 'ohlcv.npy'), mmap_mode='r')
+    _opened[key] = (st.st_mtime_ns, st.st_size, times, ohlcv)
+    return times, ohlcv
+
+
+def data_fingerprint(csv_path):
+    """
+    返回 CSV 内容的哈希 (来自缓存的 meta)，可用作指标/结果缓存的键。
+    """
+    return ensure_store(csv_path)['sha1']
+
+
+def load_klines(csv_path):
+    """
+    读取 K 线为 DataFrame，格式与 pd.read_csv(csv_path, index_col='Open Time', parse_dates=True) 相同：
+    索引为 'Open Time'，列为 OHLCV_COLUMNS。
+    """
+    times, ohlcv = load_arrays(csv_path)
+    index = pd.DatetimeIndex(times.view('datetime64[ns]'), name='Open Time')
+    return pd.DataFrame({col: ohlcv[i] for i, col in enumerate(OHLCV_COLUMNS)}, index=index)
+
+
+def bt_feed(csv_path, **kwargs):
+    """
+    从列式缓存创建 backtrader 数据源，替代 bt.feeds.GenericCSVData。
+    kwargs: 透传给 bt.feeds.PandasData，如 fromdate/todate/timeframe/compression
+    """
+    import backtrader as bt
+
+    return bt.feeds.PandasData(
+        dataname=load_klines(csv_path),
+        datetime=None,
+        open='Open',
+        high='High',
+        low='Low',
+        close='Close Price',
+        volume='Volume',
+        openinterest=None,
+        **kwargs
+    )
+
+
+def sidecar_path(csv_path, name):
+    """
+    返回与 csv_path 关联的附属文件路径 (位于列式缓存目录中，如同步状态)。
+    """
+    store = _store_dir(csv_path)
+    os.makedirs(store, exist_ok=True)
+    return os.path.join(store, name)
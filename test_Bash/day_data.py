@@ -1,87 +1,275 @@
 import pandas as pd
-from binance.client import Client
-from binance.enums import HistoricalKlinesType
+import numpy as np
 import datetime
+import json
 import os
-import ta # Technical Analysis library
+import profiling
+from data_store import load_klines, sidecar_path
+from indicators import calculate_indicators_for_strategy
 
-def get_binance_klines(symbol, interval, start_str, end_str, client, data_path="data/"):
+KLINE_COLUMNS = [
+    'Open Time', 'Open', 'High', 'Low', 'Close', 'Volume', 'Close Time',
+    'Quote Asset Volume', 'Number of Trades', 'Taker Buy Base Asset Volume',
+    'Taker Buy Quote Asset Volume', 'Ignore'
+]
+
+_INTERVAL_UNITS = {'m': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+_NS = 1_000_000_000
+# 币安周线从周一 00:00 UTC 开始，1970-01-01 是周四
+_WEEK_ORIGIN_NS = 4 * 86400 * _NS
+
+
+def interval_to_ns(interval):
     """
-    从币安获取历史 K 线数据并保存到 CSV。
-    symbol: 交易对，如 'BTCUSDT'
-    interval: K 线周期，如 Client.KLINE_INTERVAL_1DAY
-    start_str: 开始日期字符串，如 '1 Jan, 2023'
-    end_str: 结束日期字符串，如 '31 Dec, 2023'
-    client: 币安 API 客户端实例
-    data_path: 数据保存路径
+    K 线周期字符串转换为纳秒，如 '4h' -> 4 * 3600 * 1e9。不支持按月的 '1M'。
+    """
+    unit = _INTERVAL_UNITS.get(interval[-1:])
+    if unit is None or not interval[:-1].isdigit():
+        raise ValueError(f"Unsupported kline interval: {interval}")
+    return int(interval[:-1]) * unit * _NS
+
+
+def _interval_origin(interval):
+    return _WEEK_ORIGIN_NS if interval.endswith('w') else 0
+
+
+def missing_ranges(times, start_ns, end_ns, step_ns):
+    """
+    计算 [start_ns, end_ns] 内缺失的 K 线区间 (开盘时间，闭区间)。
+    times: 已有 K 线的开盘时间 (int64 纳秒，升序)
+    返回: [(range_start_ns, range_end_ns), ...]
+    """
+    times = np.asarray(times, dtype=np.int64)
+    times = times[(times >= start_ns) & (times <= end_ns)]
+    if len(times) == 0:
+        return [(start_ns, end_ns)] if start_ns <= end_ns else []
+
+    ranges = []
+    if times[0] > start_ns:
+        ranges.append((start_ns, int(times[0]) - step_ns))
+    gaps = np.flatnonzero(np.diff(times) > step_ns)
+    ranges.extend((int(times[i]) + step_ns, int(times[i + 1]) - step_ns) for i in gaps)
+    if times[-1] < end_ns:
+        ranges.append((int(times[-1]) + step_ns, end_ns))
+    return ranges
+
+
+def check_continuity(df, interval):
+    """
+    检查 K 线是否连续：时间戳对齐到周期网格，且相邻 K 线间隔恰好一个周期。
+    返回: 缺口列表 [(gap_start, gap_end), ...]，为空表示连续
+    """
+    step = interval_to_ns(interval)
+    times = df.index.values.astype('datetime64[ns]').view(np.int64)
+    misaligned = np.count_nonzero((times - _interval_origin(interval)) % step)
+    if misaligned:
+        print(f"Warning: {misaligned} bars are not aligned to the {interval} grid.")
+    gaps = missing_ranges(times, int(times[0]), int(times[-1]), step) if len(times) else []
+    return [(pd.Timestamp(a), pd.Timestamp(b)) for a, b in gaps]
+
+
+def _fetch_klines(client, symbol, interval, start_ms, end_ms):
+    """
+    从 client 获取 [start_ms, end_ms] 的 K 线，优先合约数据，取不到再用现货。
+    client: 任何实现 get_historical_klines(symbol, interval, start_str, end_str, klines_type=...)
+            的对象，如 binance Client 或测试用的本地假交易所
+    """
+    from binance.enums import HistoricalKlinesType # binance 包导入约 0.3 s，只在真正下载时导入
+
+    klines = client.get_historical_klines(
+        symbol,
+        interval,
+        start_ms,
+        end_ms,
+        klines_type=HistoricalKlinesType.FUTURES # Prefer futures for wider availability
+    )
+    if not klines: # Fallback to SPOT if futures data not found or empty
+        print(f"No Futures data for {symbol}, trying Spot data...")
+        klines = client.get_historical_klines(
+            symbol,
+            interval,
+            start_ms,
+            end_ms
+        )
+    return klines
+
+
+def _klines_to_frame(klines):
+    df = pd.DataFrame(klines, columns=KLINE_COLUMNS)
+    df['Open Time'] = pd.to_datetime(df['Open Time'], unit='ms')
+    df['Close Time'] = pd.to_datetime(df['Close Time'], unit='ms')
+    df[['Open', 'High', 'Low', 'Close', 'Volume']] = df[['Open', 'High', 'Low', 'Close', 'Volume']].astype(float)
+    df = df.set_index('Open Time')
+    df = df[['Open', 'High', 'Low', 'Close', 'Volume']]
+    df.rename(columns={'Close': 'Close Price'}, inplace=True)
+    return df
+
+
+def _load_sync_state(file_path):
+    try:
+        with open(sidecar_path(file_path, 'sync.json'), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {'empty_ranges': []}
+
+
+def _save_sync_state(file_path, state):
+    path = sidecar_path(file_path, 'sync.json')
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+def _covered(rng, ranges):
+    return any(a <= rng[0] and rng[1] <= b for a, b in ranges)
+
+
+def _before_listing(ranges, times):
+    # 只有第一根已有 K 线之前的空区间 (上市之前) 是确定没有数据的；中间与结尾的空缺可能是交易所
+    # 暂时没有返回 (停机、空响应)，下次同步时重新请求。本地还没有数据时不能判断，全部重新请求
+    if len(times) == 0:
+        return []
+    return [r for r in ranges if r[1] < times[0]]
+
+
+def _sync_plan(symbol, interval, start_str, end_str, data_path, now=None):
+    """
+    计算一次同步需要下载的区间：读取本地 CSV 与同步状态，返回缺失且未被记为空的区间。
+    返回: dict，包含 file_path、df、state、gaps、step、last_closed、start_ns、end_ns
     """
     os.makedirs(data_path, exist_ok=True)
     file_path = os.path.join(data_path, f"{symbol}_{interval}.csv")
+    step = interval_to_ns(interval)
+    origin = _interval_origin(interval)
 
+    now = pd.Timestamp.now(tz='UTC').tz_localize(None) if now is None else pd.to_datetime(now)
+    last_closed = (now.value - origin) // step * step + origin - step
+    start_ns = -((origin - pd.to_datetime(start_str).value) // step) * step + origin # 向上对齐
+    end_ns = min(pd.to_datetime(end_str).value, last_closed)
+
+    df = pd.DataFrame()
+    times = np.empty(0, dtype=np.int64)
     if os.path.exists(file_path):
         print(f"Loading data for {symbol} from {file_path}")
-        df = pd.read_csv(file_path, index_col='Open Time', parse_dates=True)
-        # 检查数据是否完整，如果不完整或者需要更新，可以考虑重新下载
-        if df.index.min() <= pd.to_datetime(start_str) and df.index.max() >= pd.to_datetime(end_str):
-            return df
-        else:
-            print(f"Data for {symbol} in {file_path} is not complete for the requested period. Downloading again.")
+        df = load_klines(file_path) # 列式缓存，CSV 只在首次或文件变化时解析
+        times = df.index.values.astype('datetime64[ns]').view(np.int64)
+
+    state = _load_sync_state(file_path)
+    empty = _before_listing(state['empty_ranges'], times)
+    gaps = [g for g in missing_ranges(times, start_ns, end_ns, step) if not _covered(g, empty)]
+    return {'file_path': file_path, 'df': df, 'state': state, 'gaps': gaps, 'step': step,
+            'last_closed': last_closed, 'start_ns': start_ns, 'end_ns': end_ns}
+
+
+def _apply_sync(plan, frames, symbol, interval, requested=None):
+    """
+    把下载到的 K 线 (DataFrame 列表) 合并进本地数据并原子写回，更新同步状态。
+    requested: 成功完成请求的区间，默认为 plan['gaps'] 全部；部分区间请求失败时只传成功的部分，
+               失败的区间不会被记为空区间
+    返回: 合并后的 DataFrame
+    """
+    df, file_path = plan['df'], plan['file_path']
+    if frames:
+        merged = pd.concat([df] + frames) if not df.empty else pd.concat(frames)
+        merged = merged.loc[~merged.index.duplicated(keep='last')].sort_index()
+        # 只保留已收盘的 K 线
+        merged = merged.loc[merged.index.values.astype('datetime64[ns]').view(np.int64) <= plan['last_closed']]
+        gap_list = check_continuity(merged, interval)
+        if gap_list:
+            print(f"Warning: {symbol} {interval} has {len(gap_list)} gap(s) after sync, first: {gap_list[0]}")
 
-    print(f"Downloading data for {symbol} from Binance...")
+        tmp = f"{file_path}.tmp{os.getpid()}"
+        merged.to_csv(tmp)
+        os.replace(tmp, file_path) # 原子替换，读取方不会看到写了一半的文件
+        print(f"Data for {symbol} saved to {file_path} (+{len(merged) - len(df)} bars)")
+        df = merged
+    elif df.empty:
+        print(f"Could not retrieve historical data for {symbol}.")
+
+    # 请求过但交易所仍未返回、且在第一根 K 线之前的区间 (上市前) 记为空区间，下次跳过
+    times = df.index.values.astype('datetime64[ns]').view(np.int64) if not df.empty else np.empty(0, dtype=np.int64)
+    requested = plan['gaps'] if requested is None else requested
+    state = plan['state']
+    still_missing = missing_ranges(times, plan['start_ns'], plan['end_ns'], plan['step'])
+    state['empty_ranges'] = _before_listing(
+        state['empty_ranges'] + [g for g in still_missing if _covered(g, requested)], times)
+    _save_sync_state(file_path, state)
+    return df
+
+
+def sync_klines(symbol, interval, start_str, end_str, client, data_path="data/", now=None):
+    """
+    增量同步 K 线：只下载本地 CSV 缺失的区间 (开头、中间缺口、结尾)，合并后原子写回。
+    结束时间晚于最近一根已收盘 K 线时按最近收盘 K 线截断；交易所确认没有数据的区间
+    (如上市之前) 会记录在同步状态中，之后不再重复请求。
+    symbol: 交易对，如 'BTCUSDT'
+    interval: K 线周期，如 '1d'、'4h'
+    start_str / end_str: 起止日期字符串
+    client: 数据源，见 _fetch_klines；也可以是返回数据源的无参函数，只在确实需要下载时调用
+            (本地数据已完整时不会创建币安客户端)
+    data_path: 数据保存路径
+    now: 当前时间 (测试用)，默认取 UTC 当前时间
+    返回: (df, fetched)，fetched 表示本次是否有请求成功完成 (调用方据此决定是否需要限速等待)。
+          中途出错时已下载的区间照常合并写入
+    """
+    plan = _sync_plan(symbol, interval, start_str, end_str, data_path, now)
+    if not plan['gaps']:
+        return plan['df'], False
+
+    print(f"Downloading {len(plan['gaps'])} missing range(s) for {symbol} from Binance...")
+    frames, requested = [], []
     try:
-        klines = client.get_historical_klines(
-            symbol,
-            interval,
-            start_str,
-            end_str,
-            klines_type=HistoricalKlinesType.FUTURES # Prefer futures for wider availability
-        )
-        if not klines: # Fallback to SPOT if futures data not found or empty
-            print(f"No Futures data for {symbol}, trying Spot data...")
-            klines = client.get_historical_klines(
-                symbol,
-                interval,
-                start_str,
-                end_str
-            )
-            
-        if not klines:
-            print(f"Could not retrieve historical data for {symbol}.")
-            return pd.DataFrame()
-
-        df = pd.DataFrame(klines, columns=[
-            'Open Time', 'Open', 'High', 'Low', 'Close', 'Volume', 'Close Time',
-            'Quote Asset Volume', 'Number of Trades', 'Taker Buy Base Asset Volume',
-            'Taker Buy Quote Asset Volume', 'Ignore'
-        ])
-
-        df['Open Time'] = pd.to_datetime(df['Open Time'], unit='ms')
-        df['Close Time'] = pd.to_datetime(df['Close Time'], unit='ms')
-        df[['Open', 'High', 'Low', 'Close', 'Volume']] = df[['Open', 'High', 'Low', 'Close', 'Volume']].astype(float)
-        df = df.set_index('Open Time')
-        df = df[['Open', 'High', 'Low', 'Close', 'Volume']]
-        df.rename(columns={'Close': 'Close Price'}, inplace=True)
-        df.to_csv(file_path) # Save to CSV for future use
-        print(f"Data for {symbol} saved to {file_path}")
-        return df
+        if callable(client) and not hasattr(client, 'get_historical_klines'):
+            client = client()
+        for gap in plan['gaps']:
+            with profiling.span('download', symbol=symbol, interval=interval):
+                klines = _fetch_klines(client, symbol, interval, gap[0] // 1_000_000, gap[1] // 1_000_000)
+            profiling.count('downloaded_rows', len(klines))
+            requested.append(gap)
+            if klines:
+                frames.append(_klines_to_frame(klines))
     except Exception as e:
         print(f"Error fetching {symbol} data from Binance: {e}")
-        return pd.DataFrame()
+        if not requested:
+            return plan['df'], False
+
+    return _apply_sync(plan, frames, symbol, interval, requested), True
+
+
+def get_binance_klines(symbol, interval, start_str, end_str, client, data_path="data/"):
+    """
+    从币安获取历史 K 线数据并保存到 CSV。本地已有数据时只增量下载缺失部分。
+    symbol: 交易对，如 'BTCUSDT'
+    interval: K 线周期，如 '1d' (Client.KLINE_INTERVAL_1DAY)
+    start_str: 开始日期字符串，如 '1 Jan, 2023'
+    end_str: 结束日期字符串，如 '31 Dec, 2023'
+    client: 币安 API 客户端实例 (或实现 get_historical_klines 的替身)
+    data_path: 数据保存路径
+    """
+    df, _ = sync_klines(symbol, interval, start_str, end_str, client, data_path)
+    return df
+
+
+def calculate_all_indicators(data, strategy_name, strategy_params, symbol=None, interval=None):
+    """
+    计算策略所需的技术指标并作为新列加入 data (见 indicators.py)。
+    只计算 strategy_name 用得到的指标；结果按 (symbol, interval, 数据指纹, 指标, 参数) 做 LRU 缓存，
+    重复运行和参数扫描会直接复用。
+    data: 包含 OHLCV 的 DataFrame
+    strategy_name: 策略名，如 'macd'
+    strategy_params: 策略参数字典
+    symbol / interval: 可选，用于区分缓存
+    """
+    return calculate_indicators_for_strategy(data, strategy_name, strategy_params, symbol=symbol, interval=interval)
 
 
 
 if __name__ == "__main__":
-    import os
-    import pandas as pd
-    from binance.client import Client
-    from binance.enums import HistoricalKlinesType
-    
-    # 请替换为你的币安API密钥
-    api_key = 'YOUR_API_KEY'
-    api_secret = 'YOUR_API_SECRET'
-    
-    # 创建币安API客户端实例
-    client = Client(api_key, api_secret)
+    import asyncio
+    from async_download import download_all
+
+    # K 线为公开接口，异步下载器不需要 API 密钥
     
     # 定义要获取数据的加密货币列表（USDT交易对）
     symbols = [
@@ -107,9 +295,9 @@ if __name__ == "__main__":
     # 定义数据保存路径
     data_path = "data/4hour"
     
-    # 循环获取每种加密货币的数据
-    for symbol in symbols:
-        df = get_binance_klines(symbol, interval, start_str, end_str, client, data_path)
+    # 所有交易对并发下载 (共享连接池与限速器)，每个交易对下载完成后立即写入
+    results = asyncio.run(download_all(symbols, interval, start_str, end_str, data_path))
+    for symbol, (df, _) in results.items():
         if not df.empty:
             print(f"\n成功获取 {symbol} 的数据:")
             print(f"数据范围: {df.index.min()} 到 {df.index.max()}")
@@ -0,0 +1,247 @@
+import numpy as np
+import pandas as pd
+
+from backtester import FILL_BUY, FILL_SELL, FILL_SELL_FINAL, FILL_STOP, FILL_TAKE_PROFIT
+
+# K 线内的成交模型：在每根 K 线的 开 / 高 / 低 / 收 上撮合市价、限价、止损、止盈与移动止损单。
+# - 止损 / 移动止损在 Low 触及止损价时成交；开盘即跳空越过止损价时按开盘价成交 (比止损价更差)。
+#   止盈与限价买入同理：High / Low 触及时按挂单价成交，跳空越过时按 (更优的) 开盘价成交。
+#   同一根 K 线同时触及止损与止盈时无法判断先后，按保守假设先止损。
+# - 成交量约束：单根 K 线的成交数量不超过 participation * Volume。买入超出部分取消；
+#   卖出没成交的部分在之后的 K 线按收盘价继续卖出，直到清仓。
+# - 手续费按交易对区分 maker / taker：限价单 (限价买入、止盈) 按 maker，市价单与止损单按 taker，
+#   市价单与止损单另按 slippage_rate 让价。
+# 持仓区间由信号切换确定 (与 simulate_long_only 相同)，各区间互不重叠：入场价、逐 K 线的止损线
+# (区间内分段的历史最高价) 与首次触发的 K 线都按整列数组计算；只有现金的复利与部分成交需要逐笔交易推进。
+
+# 默认费率 (币安现货 VIP0)；交易对可以在 config.json 的 fee_schedule 中单独设置
+DEFAULT_FEES = {'maker': 0.001, 'taker': 0.001}
+FILL_MODES = ('close', 'next_open')
+
+
+def fee_rates(symbol, schedule=None, default=None):
+    """
+    交易对的 (maker, taker) 费率。
+    schedule: {交易对或 'default': {'maker': 费率, 'taker': 费率}}
+    default: 没有任何配置时两者都使用的费率 (如 config 中的 commission_rate)；None 时使用 DEFAULT_FEES
+    """
+    schedule = schedule or {}
+    base = schedule.get('default')
+    if base is None:
+        base = DEFAULT_FEES if default is None else {'maker': default, 'taker': default}
+    rates = dict(base, **schedule.get(symbol, {}))
+    return float(rates['maker']), float(rates['taker'])
+
+
+def _trades_from_signal(signal, n):
+    # 进场 = 前一个非零信号不是 1 的买入信号；出场 = 其后第一个卖出信号 (没有时为 -1，持有到结束)
+    active = np.flatnonzero((signal == 1) | (signal == -1))
+    side = signal[active]
+    prev = np.concatenate(([0], side[:-1]))
+    entries = active[(side == 1) & (prev != 1)]
+    exits = active[(side == -1) & (prev == 1)]
+    k = np.searchsorted(exits, entries, side='right')
+    exit_bars = np.full(len(entries), -1, dtype=np.int64)
+    exit_bars[k < len(exits)] = exits[k[k < len(exits)]]
+    return entries, exit_bars
+
+
+def _segments(starts, stops):
+    """
+    把若干闭区间 [start, stop] 展开成一列 K 线下标。
+    返回: (bars, seg, first)，seg 为每个元素所属的区间，first 为各非空区间在 bars 中的起点
+    """
+    lengths = np.maximum(stops - starts + 1, 0)
+    seg = np.repeat(np.arange(len(starts)), lengths)
+    first = np.cumsum(lengths) - lengths
+    bars = starts[seg] + np.arange(len(seg)) - first[seg]
+    return bars, seg, first[lengths > 0]
+
+
+def simulate_execution(open_, high, low, close, volume, signal, cash, fees=(0.001, 0.001), slippage_rate=0.0,
+                       fill='close', entry_limit=None, limit_bars=1, stop_loss=None, take_profit=None,
+                       trail_pct=None, trail_atr=None, atr=None, participation=None):
+    """
+    按 K 线内成交模型回测多头信号 (全仓买入 / 清仓卖出)。
+    signal: 信号数组 (1: 买入, -1: 卖出, 其他: 保持)
+    fees: (maker, taker) 费率，见 fee_rates
+    fill: 市价单的成交时点，'close' 为信号 K 线收盘 (与 Backtester 相同)，'next_open' 为下一根开盘 (与 backtrader 相同)
+    entry_limit: 给定时以 信号 K 线收盘价 * (1 - entry_limit) 挂限价买单，在之后 limit_bars 根 K 线内有效，
+                 未成交则放弃这笔交易
+    stop_loss: 固定止损，入场价下方的比例
+    take_profit: 止盈，入场价上方的比例
+    trail_pct: 移动止损，入场以来最高价下方的比例
+    trail_atr: 移动止损，入场以来最高价减去 trail_atr 倍的 ATR (使用上一根 K 线的 atr，不用未来数据)
+    participation: 单根 K 线成交量上限占 Volume 的比例，None 表示不限制
+    止损线在入场后的每根 K 线上取各止损的最高者；'close' 与限价入场从下一根 K 线开始检查，'next_open' 从入场 K 线开始。
+    返回: dict，与 simulate_long_only 相同
+        'equity': 每根 K 线收盘 (当根成交之后) 的总资产
+        'fills': [(bar, type, price, amount, commission, cash_after, assets_after), ...]，
+                 type 另有 FILL_STOP / FILL_TAKE_PROFIT
+        'cash', 'assets': 回测结束后的现金与持仓
+    """
+    if fill not in FILL_MODES:
+        raise ValueError(f"Unknown fill mode: {fill}")
+    open_, high, low, close, volume = (np.asarray(a, dtype=float) for a in (open_, high, low, close, volume))
+    signal = np.asarray(signal)
+    n = len(close)
+    maker, taker = fees
+    entries, exit_signals = _trades_from_signal(signal, n)
+
+    # --- 入场：成交 K 线与价格 ---
+    if entry_limit is not None:
+        limit = close[entries] * (1.0 - entry_limit)
+        window = entries[:, None] + np.arange(1, limit_bars + 1)
+        # 只在出场信号之前有效
+        last = np.where(exit_signals >= 0, exit_signals - 1, n - 1)
+        valid = window <= np.minimum(last, n - 1)[:, None]
+        window = np.minimum(window, n - 1)
+        touched = valid & (low[window] <= limit[:, None])
+        filled = touched.any(axis=1)
+        entry_bars = window[np.arange(len(entries)), np.argmax(touched, axis=1)]
+        entry_prices = np.minimum(open_[entry_bars], limit) # 跳空低开按开盘价成交
+        entry_fees = np.full(len(entries), maker)
+        first_check = entry_bars + 1
+    else:
+        entry_bars = entries + (fill == 'next_open')
+        filled = entry_bars < n
+        entry_bars = np.minimum(entry_bars, n - 1)
+        ref = close[entry_bars] if fill == 'close' else open_[entry_bars]
+        entry_prices = ref * (1.0 + slippage_rate)
+        entry_fees = np.full(len(entries), taker)
+        first_check = entry_bars + (fill == 'close')
+    entries, exit_signals = entries[filled], exit_signals[filled]
+    entry_bars, entry_prices, entry_fees = entry_bars[filled], entry_prices[filled], entry_fees[filled]
+    first_check = first_check[filled]
+
+    # --- 计划出场：出场信号 (收盘或下一根开盘)，没有出场信号时在最后一根 K 线清仓 ---
+    final = (exit_signals < 0) | ((fill == 'next_open') & (exit_signals >= n - 1))
+    exit_bars = np.where(final, n - 1, exit_signals + (fill == 'next_open'))
+    exit_prices = np.where(final | (fill == 'close'), close[exit_bars], open_[exit_bars]) * (1.0 - slippage_rate)
+    exit_kinds = np.where(final, FILL_SELL_FINAL, FILL_SELL)
+    exit_fees = np.full(len(entries), taker)
+    last_check = np.where(final, n - 1, exit_signals)
+
+    # --- 止损 / 止盈：在 [first_check, last_check] 的 K 线上按 High / Low 找第一次触发 ---
+    if any(x is not None for x in (stop_loss, take_profit, trail_pct, trail_atr)) and len(entries):
+        bars, seg, starts = _segments(first_check, last_check)
+        stop = np.full(len(bars), -np.inf)
+        if stop_loss is not None:
+            stop = np.maximum(stop, entry_prices[seg] * (1.0 - stop_loss))
+        if trail_pct is not None or trail_atr is not None:
+            # 入场以来 (不含当根) 的最高价，入场价作为起点
+            peak = pd.Series(high[bars]).groupby(seg).cummax().to_numpy()
+            peak = np.concatenate(([-np.inf], peak[:-1]))
+            peak[starts] = -np.inf
+            peak = np.maximum(peak, entry_prices[seg])
+            if trail_pct is not None:
+                stop = np.maximum(stop, peak * (1.0 - trail_pct))
+            if trail_atr is not None:
+                atr = np.asarray(atr, dtype=float)
+                prev_atr = atr[np.maximum(bars - 1, 0)]
+                stop = np.maximum(stop, np.where(np.isnan(prev_atr), -np.inf, peak - trail_atr * prev_atr))
+        target = entry_prices[seg] * (1.0 + take_profit) if take_profit is not None else np.full(len(bars), np.inf)
+
+        hit_stop = low[bars] <= stop
+        hit_target = high[bars] >= target
+        position = np.where(hit_stop | hit_target, np.arange(len(bars)), len(bars))
+        first_hit = np.full(len(entries), len(bars))
+        nonempty = np.flatnonzero(np.maximum(last_check - first_check + 1, 0) > 0)
+        if len(bars):
+            first_hit[nonempty] = np.minimum.reduceat(position, starts)
+        hit = np.flatnonzero(first_hit < len(bars))
+        at = first_hit[hit]
+        bar, level, goal = bars[at], stop[at], target[at]
+        gap_stop = open_[bar] <= level
+        gap_target = open_[bar] >= goal
+        is_stop = gap_stop | (~gap_target & hit_stop[at])
+        price = np.where(gap_stop | gap_target, open_[bar], np.where(is_stop, level, goal))
+        exit_bars[hit] = bar
+        exit_prices[hit] = np.where(is_stop, price * (1.0 - slippage_rate), price)
+        exit_kinds[hit] = np.where(is_stop, FILL_STOP, FILL_TAKE_PROFIT)
+        exit_fees[hit] = np.where(is_stop, taker, maker)
+
+    # --- 逐笔交易推进现金 (事件数远小于 K 线数) ---
+    cap = participation * volume if participation is not None else None
+    initial_cash = cash = float(cash)
+    assets = 0.0
+    fills = []
+    busy_until = -1
+    for i in range(len(entries)):
+        bar = int(entry_bars[i])
+        if bar <= busy_until or cash <= 0:
+            continue # 上一笔还没卖完
+        price, fee = float(entry_prices[i]), float(entry_fees[i])
+        amount = cash / (price * (1.0 + fee))
+        if cap is not None:
+            amount = min(amount, float(cap[bar]))
+        if amount <= 0:
+            continue
+        commission = amount * price * fee
+        cash = max(cash - (amount * price + commission), 0.0) # 全仓买入的舍入误差
+        assets = amount
+        fills.append((bar, FILL_BUY, price, amount, commission, cash, assets))
+
+        bar, price = int(exit_bars[i]), float(exit_prices[i])
+        kind, fee = int(exit_kinds[i]), float(exit_fees[i])
+        while True:
+            # 最后一根 K 线强制清仓，不受成交量限制
+            amount = assets if cap is None or bar == n - 1 else min(assets, float(cap[bar]))
+            if amount > 0:
+                commission = amount * price * fee
+                cash += amount * price - commission
+                assets = assets - amount if amount < assets else 0.0
+                fills.append((bar, kind, price, amount, commission, cash, assets))
+            if assets == 0:
+                break
+            # 剩余部分在下一根 K 线按收盘价继续卖出
+            bar += 1
+            price, fee = float(close[bar]) * (1.0 - slippage_rate), taker
+            kind = FILL_SELL_FINAL if bar == n - 1 else FILL_SELL
+        busy_until = bar
+
+    # 每根 K 线收盘时的资金 = 当根全部成交之后的现金 + 持仓 * 收盘价
+    fill_bars = np.array([f[0] for f in fills], dtype=np.int64)
+    cash_states = np.array([initial_cash] + [f[5] for f in fills], dtype=float)
+    asset_states = np.array([0.0] + [f[6] for f in fills], dtype=float)
+    k = np.searchsorted(fill_bars, np.arange(n), side='right')
+    equity = cash_states[k] + asset_states[k] * close
+    return {'equity': equity, 'fills': fills, 'cash': cash, 'assets': assets}
+
+
+if __name__ == '__main__':
+    import time
+
+    from backtester import simulate_long_only, FILL_TYPES
+    from data_store import load_klines
+    from indicators import atr as atr_indicator
+    from strategy import Strategy
+
+    data = Strategy('macd', {}).generate_signals(load_klines('../data/4hour/BTCUSDT_4h.csv'))
+    columns = [data[c].to_numpy() for c in ('Open', 'High', 'Low', 'Close Price', 'Volume')]
+    signal = data['Signal'].to_numpy()
+    atr_line = atr_indicator(*columns[1:4], 14)
+    fees = fee_rates('BTCUSDT', default=0.00075)
+
+    # 无成本、收盘成交、不设止损时两者的资金曲线与成交完全一致
+    t0 = time.perf_counter()
+    base = simulate_long_only(columns[3], signal, 10000, 0.0, 0.0)
+    base_s = time.perf_counter() - t0
+    same = simulate_execution(*columns, signal, 10000, (0.0, 0.0), 0.0)
+    print(f"simulate_long_only   {base_s * 1e3:7.2f} ms  final {base['equity'][-1]:12,.2f}  fills {len(base['fills'])}  "
+          f"(simulate_execution without costs: {same['equity'][-1]:,.2f}, {len(same['fills'])} fills)")
+    scenarios = {
+        'close': dict(fill='close'),
+        'next_open': dict(fill='next_open'),
+        'limit 0.2% x 3 bars': dict(entry_limit=0.002, limit_bars=3),
+        'stop 5% / target 15%': dict(stop_loss=0.05, take_profit=0.15),
+        'ATR trail x2 (H/L)': dict(trail_atr=2.0, atr=atr_line),
+        'trail 8% + 1% volume': dict(trail_pct=0.08, participation=0.01),
+    }
+    for name, options in scenarios.items():
+        t0 = time.perf_counter()
+        result = simulate_execution(*columns, signal, 10000, fees, 0.0001, **options)
+        elapsed = time.perf_counter() - t0
+        kinds = np.bincount([f[1] for f in result['fills']], minlength=len(FILL_TYPES))
+        print(f"{name:20s} {elapsed * 1e3:7.2f} ms  final {result['equity'][-1]:12,.2f}  "
+              f"fills {dict((t, c) for t, c in zip(FILL_TYPES, kinds.tolist()) if c)}  ({elapsed / base_s:.1f}x close fills)")
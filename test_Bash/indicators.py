@@ -0,0 +1,234 @@
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# 向量化技术指标库。计算方式与 backtrader 内置指标一致 (EMA/SMMA 以前 period 个值的
+# 简单平均作为种子，预热期为 NaN)，递推由 pandas 的编译实现完成，没有逐 K 线的 Python 循环。
+
+
+class LRUCache:
+    """
+    简单的 LRU 缓存，超过 maxsize 时淘汰最久未使用的条目。
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, compute):
+        if key in self._data:
+            self._data.move_to_end(key)
+            self.hits += 1
+            return self._data[key]
+        self.misses += 1
+        value = compute()
+        self._data[key] = value
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+        return value
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# 进程内指标缓存，键为 (symbol, interval, 数据指纹, 指标名, 参数)
+indicator_cache = LRUCache()
+
+
+def _first_valid(values):
+    valid = ~np.isnan(values)
+    return int(np.argmax(valid)) if valid.any() else len(values)
+
+
+def _seeded_smoothing(values, period, alpha):
+    """
+    指数平滑：第一个有效值起的前 period 个值取简单平均作为种子，之后 y = y_prev + alpha * (x - y_prev)。
+    """
+    values = np.asarray(values, dtype=float)
+    out = np.full(len(values), np.nan)
+    start = _first_valid(values)
+    seed = start + period - 1
+    if seed >= len(values):
+        return out
+    out[seed] = values[start:seed + 1].mean()
+    out[seed + 1:] = values[seed + 1:]
+    out[seed:] = pd.Series(out[seed:]).ewm(alpha=alpha, adjust=False).mean().to_numpy()
+    return out
+
+
+def sma(values, period):
+    """
+    简单移动平均，前 period - 1 个值为 NaN。
+    """
+    return pd.Series(np.asarray(values, dtype=float)).rolling(period).mean().to_numpy()
+
+
+def ema(values, period):
+    """
+    指数移动平均 (alpha = 2 / (period + 1))，与 bt.ind.EMA 一致。
+    """
+    return _seeded_smoothing(values, period, 2.0 / (period + 1))
+
+
+def smma(values, period):
+    """
+    Wilder 平滑移动平均 (alpha = 1 / period)，与 bt.ind.SMMA 一致。
+    """
+    return _seeded_smoothing(values, period, 1.0 / period)
+
+
+def macd(close, fast_period=12, slow_period=26, signal_period=9):
+    """
+    MACD，与 bt.ind.MACD 一致。
+    返回: (macd, signal, histogram)
+    """
+    line = ema(close, fast_period) - ema(close, slow_period)
+    signal = ema(line, signal_period)
+    return line, signal, line - signal
+
+
+def rsi(close, period=14, method='wilder'):
+    """
+    RSI。
+    method: 'wilder' 使用 SMMA 平滑 (bt.ind.RSI)；'sma' 使用简单平均 (bt.ind.RSI_SMA)
+    下跌均值为 0 时 RSI 取 100。
+    """
+    close = np.asarray(close, dtype=float)
+    delta = np.diff(close, prepend=np.nan)
+    up = np.where(np.isnan(delta), np.nan, np.maximum(delta, 0.0))
+    down = np.where(np.isnan(delta), np.nan, np.maximum(-delta, 0.0))
+    if method == 'wilder':
+        avg_up, avg_down = smma(up, period), smma(down, period)
+    elif method == 'sma':
+        avg_up, avg_down = sma(up, period), sma(down, period)
+    else:
+        raise ValueError(f"Unknown RSI method: {method}")
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return 100.0 - 100.0 / (1.0 + avg_up / avg_down)
+
+
+def obv(close, volume):
+    """
+    能量潮 OBV，与 onv.py 中的 OBV 指标一致：第一根为当根成交量，之后按涨跌累加/累减成交量。
+    """
+    close = np.asarray(close, dtype=float)
+    volume = np.asarray(volume, dtype=float)
+    if len(close) == 0:
+        return np.empty(0)
+    change = np.sign(np.diff(close)) * volume[1:]
+    return np.cumsum(np.concatenate(([volume[0]], change)))
+
+
+def true_range(high, low, close):
+    """
+    真实波幅，第一根 K 线没有前收盘价，为 NaN。
+    """
+    prev_close = np.concatenate(([np.nan], np.asarray(close, dtype=float)[:-1]))
+    return np.maximum(high, prev_close) - np.minimum(low, prev_close)
+
+
+def atr(high, low, close, period=14):
+    """
+    平均真实波幅，与 bt.ind.ATR 一致 (真实波幅的 SMMA)。
+    """
+    return smma(true_range(high, low, close), period)
+
+
+def data_fingerprint(data):
+    """
+    根据时间索引与 OHLCV 内容计算 DataFrame 的指纹，用于指标缓存的键。
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(data.index.values.astype('datetime64[ns]').view(np.int64).tobytes())
+    for column in ('Open', 'High', 'Low', 'Close Price', 'Volume'):
+        if column in data.columns:
+            h.update(np.ascontiguousarray(data[column].to_numpy(dtype=float)).tobytes())
+    return h.hexdigest()
+
+
+# 指标名 -> (计算函数, 输出列名)。计算函数接收 DataFrame 与参数元组，返回与输出列对应的数组
+INDICATORS = {
+    'macd': (lambda d, p: macd(d['Close Price'].to_numpy(dtype=float), *p),
+             ('MACD', 'MACD_Signal', 'MACD_Hist')),
+    'rsi': (lambda d, p: (rsi(d['Close Price'].to_numpy(dtype=float), *p),),
+            ('RSI',)),
+    'sma': (lambda d, p: (sma(d['Close Price'].to_numpy(dtype=float), *p),),
+            ('SMA_{0}',)),
+    'ema': (lambda d, p: (ema(d['Close Price'].to_numpy(dtype=float), *p),),
+            ('EMA_{0}',)),
+    'obv': (lambda d, p: _obv_with_ma(d, *p),
+            ('OBV', 'OBV_MA')),
+    'atr': (lambda d, p: (atr(d['High'].to_numpy(dtype=float), d['Low'].to_numpy(dtype=float),
+                              d['Close Price'].to_numpy(dtype=float), *p),),
+            ('ATR',)),
+}
+
+
+def _obv_with_ma(data, ma_period):
+    line = obv(data['Close Price'].to_numpy(dtype=float), data['Volume'].to_numpy(dtype=float))
+    return line, sma(line, ma_period)
+
+
+def _strategy_indicators(strategy_name, p):
+    """
+    策略名 -> 需要的 [(指标名, 参数元组), ...]，只计算策略用得到的指标。
+    参数中自带 'rules' 的策略 (见 strategy.py) 由规则自行计算指标，这里不需要额外的列。
+    """
+    if 'rules' in p:
+        return []
+    if strategy_name == 'macd':
+        return [('macd', (p.get('fast_period', 12), p.get('slow_period', 26), p.get('signal_period', 9)))]
+    if strategy_name == 'moving_average_crossover':
+        return [('sma', (p.get('short_period', 5),)), ('sma', (p.get('long_period', 20),))]
+    if strategy_name == 'rsi':
+        return [('rsi', (p.get('rsi_period', 14), p.get('rsi_method', 'sma')))]
+    if strategy_name == 'obv':
+        return [('obv', (p.get('obv_ma_period', 20),))]
+    if strategy_name == 'obv_macd_rsi':
+        from strategy import OBV_MACD_RSI_PARAMS # strategy 依赖本模块，在函数内导入避免循环
+        p = dict(OBV_MACD_RSI_PARAMS, **p)
+        return [('obv', (p['obv_period'],)), ('macd', (p['macd1'], p['macd2'], p['macdsig'])),
+                ('rsi', (p['rsi_period'], 'wilder')), ('atr', (p['atr_period'],))]
+    raise ValueError(f"Unknown strategy name: {strategy_name}")
+
+
+def compute_indicators(data, requests, symbol=None, interval=None, cache=indicator_cache):
+    """
+    计算一组指标并作为新列加入 data (原地修改并返回)。
+    requests: [(指标名, 参数元组), ...]
+    symbol / interval: 缓存键的一部分；结果按 (symbol, interval, 数据指纹, 指标, 参数) 缓存
+    """
+    fingerprint = data_fingerprint(data) if cache is not None else None
+    for name, params in requests:
+        compute, columns = INDICATORS[name]
+        if cache is None:
+            arrays = compute(data, params)
+        else:
+            key = (symbol, interval, fingerprint, name, params)
+            arrays = cache.get(key, lambda: _freeze(compute(data, params)))
+        for column, values in zip(columns, arrays):
+            data[column.format(*params)] = values
+    return data
+
+
+def _freeze(arrays):
+    # 缓存中的数组设为只读，防止调用方原地修改污染缓存
+    for values in arrays:
+        values.setflags(write=False)
+    return arrays
+
+
+def calculate_indicators_for_strategy(data, strategy_name, strategy_params, symbol=None, interval=None,
+                                      cache=indicator_cache):
+    """
+    只计算 strategy_name 需要的指标。
+    """
+    return compute_indicators(data, _strategy_indicators(strategy_name, strategy_params),
+                              symbol=symbol, interval=interval, cache=cache)
@@ -0,0 +1,359 @@
+import numpy as np
+
+from indicators import obv, sma, macd, rsi, atr
+from strategy import OBV_MACD_RSI_PARAMS
+
+# 依赖路径的策略逻辑 (全仓买入的现金检查、ATR 移动止损、全局回撤 + 冷却期) 写成对普通 float 数组的
+# 逐根循环。安装了 numba 时编译为机器码，否则以纯 Python 运行；两种方式的算术顺序完全相同，成交一致。
+
+try:
+    import numba
+except ImportError: # numba 是可选依赖
+    numba = None
+
+HAVE_NUMBA = numba is not None
+
+
+def _jit(func):
+    return numba.njit(cache=True, nogil=True)(func) if HAVE_NUMBA else func
+
+
+def _as_inputs(*arrays):
+    # 纯 Python 时逐元素读取 list 比读取 NumPy 标量快得多
+    arrays = [np.ascontiguousarray(a, dtype=np.float64) for a in arrays]
+    return arrays if HAVE_NUMBA else [a.tolist() for a in arrays]
+
+
+# ----------------------
+# Backtester: 全仓买入 / 清仓卖出
+# ----------------------
+@_jit
+def _long_only_kernel(close, signal, cash, commission_rate, slippage_rate,
+                      equity, fill_bar, fill_type, fill_price, fill_amount, fill_commission, fill_cash, fill_assets):
+    n = len(close)
+    assets = 0.0
+    position = 0
+    k = 0
+    for i in range(n):
+        price = close[i]
+        s = signal[i]
+        equity[i] = cash + assets * price
+        if s == 1.0 and position <= 0:
+            if cash <= 0:
+                continue
+            amount = (cash * (1 - slippage_rate)) / (price * (1 + commission_rate))
+            commission = amount * price * commission_rate
+            cash = max(cash - (amount * price + commission), 0.0)
+            assets += amount
+            fill_bar[k] = i
+            fill_type[k] = 0
+            fill_price[k] = price
+            fill_amount[k] = amount
+            fill_commission[k] = commission
+            fill_cash[k] = cash
+            fill_assets[k] = assets
+            k += 1
+            position = 1
+        elif s == -1.0 and position >= 0:
+            if assets > 0:
+                amount = assets
+                commission = amount * price * commission_rate
+                cash += (amount * price * (1 - slippage_rate) - commission)
+                assets = 0.0
+                fill_bar[k] = i
+                fill_type[k] = 1
+                fill_price[k] = price
+                fill_amount[k] = amount
+                fill_commission[k] = commission
+                fill_cash[k] = cash
+                fill_assets[k] = assets
+                k += 1
+            position = -1
+
+    if assets > 0:
+        price = close[n - 1]
+        amount = assets
+        commission = amount * price * commission_rate
+        cash += (amount * price * (1 - slippage_rate) - commission)
+        assets = 0.0
+        fill_bar[k] = n - 1
+        fill_type[k] = 2
+        fill_price[k] = price
+        fill_amount[k] = amount
+        fill_commission[k] = commission
+        fill_cash[k] = cash
+        fill_assets[k] = assets
+        k += 1
+    if n:
+        equity[n - 1] = cash + assets * close[n - 1]
+    return k, cash, assets
+
+
+def simulate_long_only_compiled(close, signal, cash, commission_rate, slippage_rate):
+    """
+    Backtester 逐行循环的编译版本，输入输出与 backtester.simulate_long_only 相同。
+    返回: dict，'equity'、'fills' [(bar, type, price, amount, commission, cash_after, assets_after), ...]、
+          'cash'、'assets'
+    """
+    close, signal = _as_inputs(close, signal)
+    n = len(close)
+    equity = np.empty(n)
+    bars, types = np.empty(n + 1, dtype=np.int64), np.empty(n + 1, dtype=np.int64)
+    cols = [np.empty(n + 1) for _ in range(5)]
+    k, cash, assets = _long_only_kernel(close, signal, float(cash), float(commission_rate), float(slippage_rate),
+                                        equity, bars, types, *cols)
+    fills = list(zip(bars[:k].tolist(), types[:k].tolist(), *(c[:k].tolist() for c in cols)))
+    return {'equity': equity, 'fills': fills, 'cash': cash, 'assets': assets}
+
+
+# ----------------------
+# backtrader 默认撮合 (BackBroker): 市价单在下一根 K 线开盘价成交
+# ----------------------
+@_jit
+def _next_open_kernel(open_, close, entry, exit_, cash, commission, size_pct, size_mode,
+                      value, fill_bar, fill_size, fill_price, fill_commission, fill_kind):
+    n = len(close)
+    position = 0.0
+    entry_price = 0.0
+    pending = 0.0
+    pending_price = 0.0
+    k = 0
+    rejected = 0
+    for t in range(n):
+        if pending != 0.0:
+            size = pending
+            pending = 0.0
+            check = cash + (-size * pending_price)
+            check -= abs(size) * commission * pending_price
+            if check >= 0.0:
+                price = open_[t]
+                comm = abs(size) * commission * price
+                ok = True
+                if size > 0:
+                    after = cash - size * price - comm
+                    if after < 0.0:
+                        ok = False
+                    else:
+                        cash = after
+                        entry_price = price
+                else:
+                    closed = -size
+                    cash += closed * entry_price + closed * (price - entry_price)
+                    cash -= comm
+                if ok:
+                    position += size
+                    fill_bar[k] = t
+                    fill_size[k] = size
+                    fill_price[k] = price
+                    fill_commission[k] = comm
+                    fill_kind[k] = 0 if size > 0 else 1
+                    k += 1
+                else:
+                    rejected += 1
+            else:
+                rejected += 1
+
+        c = close[t]
+        value[t] = cash + position * c
+        if not position:
+            if entry[t]:
+                # size_mode 0: int(cash * pct / close) (macd.py 等)；1: int(cash / close * pct) (mutil.py)
+                if size_mode == 0:
+                    size = float(int(cash * size_pct / c))
+                else:
+                    size = float(int(cash / c * size_pct))
+                if size > 0:
+                    pending, pending_price = size, c
+        elif exit_[t]:
+            pending, pending_price = -position, c
+    return k, cash, position, rejected
+
+
+def simulate_next_open(open_, close, entry, exit_, cash=10000.0, commission=0.0, size_pct=0.95, size_mode=0):
+    """
+    按入场 / 出场条件数组运行 "空仓时满足入场条件按现金比例买入整数数量，持仓时满足出场条件全部卖出"
+    的策略，撮合规则与 backtrader 默认 BackBroker 相同 (见 _obv_macd_rsi_kernel)。
+    entry / exit_: bool 数组，指标预热期应为 False (NaN 比较的结果即为 False)
+    返回: 与 simulate_obv_macd_rsi 相同的 dict，fills 的 kind 为 0 (BUY) / 1 (SELL)
+    """
+    open_, close, entry, exit_ = _as_inputs(open_, close, entry, exit_)
+    n = len(close)
+    value = np.empty(n)
+    bars, kinds = np.empty(n, dtype=np.int64), np.empty(n, dtype=np.int64)
+    sizes, prices, comms = np.empty(n), np.empty(n), np.empty(n)
+    k, cash, position, rejected = _next_open_kernel(open_, close, entry, exit_, float(cash), float(commission),
+                                                    float(size_pct), int(size_mode),
+                                                    value, bars, sizes, prices, comms, kinds)
+    fills = list(zip(bars[:k].tolist(), sizes[:k].tolist(), prices[:k].tolist(), comms[:k].tolist(),
+                     kinds[:k].tolist()))
+    return {'value': value, 'fills': fills, 'cash': cash, 'position': position, 'rejected': rejected}
+
+
+# ----------------------
+# OBV_MACD_RSI_Strategy (stragedy/day/macd_rsi_onv.py) + backtrader 默认撮合
+# ----------------------
+BUY_LOGIC = {'AND': 0, 'OR': 1, 'MIXED': 2}
+SELL_LOGIC = {'OR': 0, 'AND': 1}
+
+
+@_jit
+def _obv_macd_rsi_kernel(open_, high, close, obv_line, obv_ma, hist, rsi_line, atr_line,
+                         cash, commission, drawdown_limit, cooldown_period, rsi_overbought, rsi_oversold,
+                         trailing_stop_multiplier, trailing_stop_active, buy_logic, sell_logic,
+                         value, fill_bar, fill_size, fill_price, fill_commission, fill_kind):
+    n = len(close)
+    position = 0.0
+    entry_price = 0.0
+    pending = 0.0 # 待成交数量，0 表示没有挂单
+    pending_price = 0.0 # 下单时的收盘价 (提交预检用)
+    pending_kind = 0
+    max_value = cash
+    cooldown = 0
+    highest = -1.0
+    k = 0
+    rejected = 0
+    for t in range(n):
+        # 1. 开盘撮合上一根 K 线提交的市价单 (与 PaperBroker.on_bar_open 相同)
+        if pending != 0.0:
+            size = pending
+            pending = 0.0
+            check = cash + (-size * pending_price)
+            check -= abs(size) * commission * pending_price
+            if check >= 0.0:
+                price = open_[t]
+                comm = abs(size) * commission * price
+                ok = True
+                if size > 0:
+                    after = cash - size * price - comm
+                    if after < 0.0:
+                        ok = False
+                    else:
+                        cash = after
+                        entry_price = price
+                else:
+                    closed = -size
+                    cash += closed * entry_price + closed * (price - entry_price)
+                    cash -= comm
+                if ok:
+                    position += size
+                    fill_bar[k] = t
+                    fill_size[k] = size
+                    fill_price[k] = price
+                    fill_commission[k] = comm
+                    fill_kind[k] = pending_kind
+                    k += 1
+                else:
+                    rejected += 1
+            else:
+                rejected += 1
+
+        c = close[t]
+        value[t] = cash + position * c
+        # 2. 预热期 (backtrader 的 prenext)
+        if obv_ma[t] != obv_ma[t] or hist[t] != hist[t] or rsi_line[t] != rsi_line[t] or atr_line[t] != atr_line[t]:
+            continue
+
+        # 3. 全局回撤与冷却期
+        current = cash + position * c
+        max_value = max(max_value, current)
+        drawdown = (max_value - current) / max_value
+        if drawdown > drawdown_limit:
+            if position:
+                pending, pending_price, pending_kind = -position, c, 3
+            cooldown = cooldown_period
+            continue
+        if cooldown > 0:
+            cooldown -= 1
+            continue
+
+        prev_obv = obv_line[t - 1] if t > 0 else np.nan
+        prev_obv_ma = obv_ma[t - 1] if t > 0 else np.nan
+        prev_hist = hist[t - 1] if t > 0 else np.nan
+        prev_rsi = rsi_line[t - 1] if t > 0 else np.nan
+        o, om, h, r = obv_line[t], obv_ma[t], hist[t], rsi_line[t]
+
+        if not position:
+            obv_cross_up = o > om and prev_obv <= prev_obv_ma
+            macd_cross_up = h > 0 and prev_hist <= 0
+            rsi_not_overbought = r < rsi_overbought
+            buy = False
+            if c > 0.00000001:
+                if buy_logic == 0:
+                    buy = o > om and macd_cross_up and rsi_not_overbought
+                elif buy_logic == 1:
+                    rsi_bounce = r > rsi_oversold and prev_rsi <= rsi_oversold
+                    buy = (obv_cross_up and macd_cross_up) or (obv_cross_up and rsi_bounce) or \
+                          (macd_cross_up and rsi_bounce)
+                else:
+                    buy = (obv_cross_up or macd_cross_up) and rsi_not_overbought
+            if buy:
+                size = float(int(cash / c * 0.95))
+                if size > 0:
+                    pending, pending_price, pending_kind = size, c, 0
+                    highest = high[t]
+            continue
+
+        # 4. 持仓：ATR 移动止损与卖出条件
+        highest = max(highest, high[t])
+        exit_obv = o < om and prev_obv >= prev_obv_ma
+        exit_macd = h < 0 and prev_hist >= 0
+        exit_rsi = r > rsi_overbought
+        if sell_logic == 0:
+            sell = exit_obv or exit_macd or exit_rsi
+        else:
+            sell = exit_obv and exit_macd and exit_rsi
+
+        if trailing_stop_active and highest > 0:
+            stop_price = highest - (atr_line[t] * trailing_stop_multiplier)
+            if c < stop_price:
+                pending, pending_price, pending_kind = -position, c, 2
+                highest = -1.0
+                continue
+        if sell:
+            pending, pending_price, pending_kind = -position, c, 1
+            highest = -1.0
+    return k, cash, position, rejected
+
+
+FILL_KINDS = ('BUY', 'SELL', 'STOP', 'CLOSE')
+
+
+def obv_macd_rsi_indicators(high, low, close, volume, p):
+    """
+    OBV_MACD_RSI_Strategy 用到的指标 (与 backtrader 一致，见 indicators.py)。
+    返回: (obv, obv_ma, macd_hist, rsi, atr)
+    """
+    line = obv(close, volume)
+    hist = macd(close, p['macd1'], p['macd2'], p['macdsig'])[2]
+    return (line, sma(line, p['obv_period']), hist, rsi(close, p['rsi_period']),
+            atr(high, low, close, p['atr_period']))
+
+
+def simulate_obv_macd_rsi(open_, high, low, close, volume, cash=10000.0, commission=0.0, **params):
+    """
+    以编译循环运行 OBV_MACD_RSI_Strategy，成交规则与 backtrader 默认 BackBroker 相同
+    (市价单下一根开盘价成交，按成交额收取佣金，现金不足时拒绝)。
+    params: 与 OBV_MACD_RSI_Strategy.params 相同
+    返回: dict
+        'value': 每根 K 线收盘时的账户价值 (broker.getvalue())
+        'fills': [(bar, size, price, commission, kind), ...]，kind 为 FILL_KINDS 的下标
+        'cash', 'position': 回测结束时的现金与持仓
+        'rejected': 被拒绝的订单数
+    """
+    unknown = set(params) - set(OBV_MACD_RSI_PARAMS)
+    if unknown:
+        raise ValueError(f"Unknown parameters: {sorted(unknown)}")
+    p = dict(OBV_MACD_RSI_PARAMS, **params)
+    inputs = _as_inputs(open_, high, close, *obv_macd_rsi_indicators(high, low, close, volume, p))
+    n = len(close)
+    value = np.empty(n)
+    bars, kinds = np.empty(n, dtype=np.int64), np.empty(n, dtype=np.int64)
+    sizes, prices, comms = np.empty(n), np.empty(n), np.empty(n)
+    k, cash, position, rejected = _obv_macd_rsi_kernel(
+        *inputs, float(cash), float(commission), float(p['drawdown_limit']), int(p['cooldown_period']),
+        float(p['rsi_overbought']), float(p['rsi_oversold']), float(p['trailing_stop_multiplier']),
+        bool(p['trailing_stop_active']), BUY_LOGIC[p['buy_logic_type']], SELL_LOGIC[p['sell_logic_type']],
+        value, bars, sizes, prices, comms, kinds)
+    fills = list(zip(bars[:k].tolist(), sizes[:k].tolist(), prices[:k].tolist(), comms[:k].tolist(),
+                     kinds[:k].tolist()))
+    return {'value': value, 'fills': fills, 'cash': cash, 'position': position, 'rejected': rejected}
@@ -1,94 +1,169 @@
+import argparse
+import functools
 import json
 import pandas as pd
-from binance.client import Client
-import matplotlib.pyplot as plt # Needed for font setting in main sometimes
-import matplotlib as mpl
 import time
 # Import custom modules
-from stock_quant.test_Bash.day_data import get_binance_klines, calculate_all_indicators
-from strategy import Strategy
-from backtester import Backtester
-from result_plot import plot_results
-
-# --- Load Configuration ---
-try:
-    with open('config.json', 'r') as f:
-        config = json.load(f)
-except FileNotFoundError:
-    print("Error: config.json not found. Please create it based on the template.")
-    exit()
-except json.JSONDecodeError:
-    print("Error: config.json is not valid JSON. Please check its content.")
-    exit()
-
-# --- Binance API Setup ---
-api_key = config['binance_api_key']
-api_secret = config['binance_api_secret']
-binance_client = Client(api_key, api_secret)
-
-# --- General Settings ---
-tokens = config['tokens']
-interval = config['interval']
-start_date = config['start_date']
-end_date = config['end_date']
-initial_capital = config['initial_capital']
-commission_rate = config['commission_rate']
-slippage_rate = config['slippage_rate']
-data_path = config['data_path']
-
-# --- Strategy Specific Settings ---
-strategy_name = "macd" # You can change this to other strategies if implemented
-strategy_params = config['strategy_params'].get(strategy_name, {})
-
-# --- Font Settings for English (repeated for robustness) ---
-mpl.rcParams['font.family'] = 'sans-serif'
-mpl.rcParams['font.sans-serif'] = ['Arial', 'Helvetica', 'DejaVu Sans', 'Liberation Sans', 'Bitstream Vera Sans']
-mpl.rcParams['axes.unicode_minus'] = False
-
-# --- Main Backtesting Loop ---
-for token in tokens:
-    print(f"\n--- Running backtest for {token} with {strategy_name.upper()} Strategy ---")
-
-    # 1. Get Historical Data
-    data = get_binance_klines(token, interval, start_date, end_date, binance_client, data_path)
-    if data.empty:
-        print(f"Skipping {token} due to data issues.")
-        continue
-
-    # Ensure data is sorted by index (time)
-    data = data.sort_index()
-    # Remove any NaN values that might result from early indicator calculations
-    data = data.dropna()
-    if data.empty:
-        print(f"Skipping {token} as data became empty after dropping NaNs (likely due to short data period for indicator calculation).")
-        continue
-
-    # 2. Calculate Indicators
-    data = calculate_all_indicators(data, strategy_name, strategy_params)
-    data = data.dropna() # Drop rows with NaN from indicator calculation (e.g., beginning of MA)
-    if data.empty:
-        print(f"Skipping {token} as data became empty after dropping indicator NaNs.")
-        continue
-
-    # 3. Generate Signals
-    strategy = Strategy(strategy_name, strategy_params)
-    data_with_signals = strategy.generate_signals(data.copy()) # Use a copy to avoid modifying original data
-
-    # 4. Run Backtest Simulation
-    backtester = Backtester(initial_capital, commission_rate, slippage_rate)
-    equity_curve, trades_df = backtester.run_backtest(data_with_signals)
-    print(f"Trades DataFrame empty: {trades_df.empty}")
-    print("Trades DataFrame head:")
-    print(trades_df.head())
-    # 5. Analyze Performance
-    performance_metrics = backtester.analyze_performance(equity_curve, trades_df)
-
-    # 6. Visualize Results
-    if not equity_curve.empty:
-        plot_results(equity_curve, data_with_signals, performance_metrics, token, strategy_name)
-    else:
-        print(f"No equity curve generated for {token}. Cannot plot results.")
-
-    print(f"--- Backtest for {token} Finished ---")
-    # Add a small delay between tokens to avoid hitting API rate limits
-    time.sleep(2)
\ No newline at end of file
+from day_data import sync_klines
+from runner import make_jobs, run_jobs, prepare_data
+from backtester import trades_frame
+from analytics import format_metrics
+from report import REPORT_DIR, report_payload, render_reports
+from results import RESULTS_DB, ResultStore
+import profiling
+
+# Pause between network fetches to avoid hitting API rate limits
+RATE_LIMIT_PAUSE = 2
+
+
+def load_config(path='config.json'):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        print("Error: config.json not found. Please create it based on the template.")
+        exit()
+    except json.JSONDecodeError:
+        print("Error: config.json is not valid JSON. Please check its content.")
+        exit()
+
+
+@functools.lru_cache(maxsize=None)
+def binance_client(api_key, api_secret):
+    # binance 包导入约 0.3 s，创建 Client 还要访问网络；只在确实需要下载数据时调用
+    from binance.client import Client
+    return Client(api_key, api_secret)
+
+
+def client_factory(api_key, api_secret):
+    """
+    sync_klines 的延迟客户端：第一次需要下载时创建。创建失败 (如离线) 时记住异常，
+    之后的交易对直接失败，不再逐个重新连接。
+    """
+    failure = []
+
+    def factory():
+        if failure:
+            raise failure[0]
+        try:
+            return binance_client(api_key, api_secret)
+        except Exception as e:
+            failure.append(e)
+            raise
+
+    return factory
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Sync data and backtest every token / interval / strategy")
+    parser.add_argument('--no-plot', action='store_true',
+                        help="skip reports entirely (matplotlib is never imported)")
+    parser.add_argument('--show', action='store_true',
+                        help="open interactive matplotlib windows instead of writing reports")
+    parser.add_argument('--report-dir', default=REPORT_DIR, help="where PNG/HTML reports are written")
+    parser.add_argument('--results-db', default=RESULTS_DB, help="SQLite store of past backtest results")
+    parser.add_argument('--no-cache', action='store_true', help="recompute every backtest and leave the store untouched")
+    parser.add_argument('--trace', metavar='PATH',
+                        help="record per-stage timings from every worker and write a Chrome trace JSON to PATH")
+    parser.add_argument('--profile-dir', help="with --trace, also cProfile each job into PATH/<job>.prof")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # --- Load Configuration ---
+    config = load_config()
+
+    # --- Binance API Setup (the client is created on the first download, never when data is up to date) ---
+    client = client_factory(config['binance_api_key'], config['binance_api_secret'])
+
+    # --- General Settings ---
+    tokens = config['tokens']
+    intervals = config.get('intervals', [config['interval']])
+    start_date = config['start_date']
+    end_date = config['end_date']
+    initial_capital = config['initial_capital']
+    commission_rate = config['commission_rate']
+    slippage_rate = config['slippage_rate']
+    data_paths = {interval: config.get('data_paths', {}).get(interval, config['data_path'])
+                  for interval in intervals}
+
+    # --- Strategy Specific Settings ---
+    # Every strategy in strategy_params runs unless an optional 'strategies' list picks a subset
+    strategy_names = config.get('strategies', list(config['strategy_params']))
+    strategies = {name: config['strategy_params'].get(name, {}) for name in strategy_names}
+
+    # 1. Sync Historical Data (only missing ranges hit the network)
+    jobs = []
+    for interval in intervals:
+        ready = []
+        for token in tokens:
+            data, fetched = sync_klines(token, interval, start_date, end_date, client, data_paths[interval])
+            if fetched:
+                # Add a small delay after successful downloads to avoid hitting API rate limits
+                time.sleep(RATE_LIMIT_PAUSE)
+            if data.empty:
+                print(f"Skipping {token} ({interval}) due to data issues.")
+                continue
+            ready.append(token)
+        jobs += make_jobs(ready, [interval], strategies, data_paths,
+                          initial_capital, commission_rate, slippage_rate,
+                          config.get('execution'), config.get('fee_schedule'), config.get('margin'))
+
+    # 2. Run Backtests in Parallel (indicators, signals and simulation run in worker processes);
+    #    backtests whose inputs are unchanged are read back from the result store
+    store = None if args.no_cache else ResultStore(args.results_db)
+    trace = None
+    if args.trace:
+        profiling.enable()
+        trace = {'profile_dir': args.profile_dir}
+    results = run_jobs(jobs, store=store, trace=trace)
+
+    # 3. Report and Visualize Results
+    payloads = []
+    for job, result in zip(jobs, results):
+        token, strategy_name = job['symbol'], job['strategy']
+        cached = " (from result store)" if result.get('cached') else ""
+        print(f"\n--- Backtest for {token} ({job['interval']}) with {strategy_name.upper()} Strategy{cached} ---")
+        if 'error' in result:
+            print(f"Skipping {token}: {result['error']}")
+            continue
+
+        trades_df = trades_frame(result['trades'])
+        print(f"Trades DataFrame empty: {trades_df.empty}")
+        print("Trades DataFrame head:")
+        print(trades_df.head())
+
+        equity_curve = pd.Series(result['equity'], index=pd.to_datetime(result['equity_index']))
+        if equity_curve.empty:
+            print(f"No equity curve generated for {token}. Cannot plot results.")
+        elif args.show and not args.no_plot:
+            from result_plot import plot_results
+            with profiling.span('plot', symbol=token):
+                plot_results(equity_curve, prepare_data(job), result['metrics'], token, strategy_name)
+        else:
+            print(f"Metrics: {format_metrics(result['metrics'])}")
+            if not args.no_plot:
+                # 降采样后的小数据包，统一交给进程池无界面绘制
+                with profiling.span('report_payload', symbol=token):
+                    payloads.append(report_payload(equity_curve, prepare_data(job), result['metrics'],
+                                                   token, strategy_name, job['interval']))
+
+        print(f"--- Backtest for {token} Finished ---")
+
+    if store is not None:
+        store.close()
+
+    if payloads:
+        with profiling.span('reports', count=len(payloads)):
+            index = render_reports(payloads, args.report_dir)
+        print(f"\nReports written to {index}")
+
+    if args.trace:
+        print(f"\nStage timings:\n{profiling.summary().round(2).to_string()}")
+        print(f"Trace written to {profiling.write_chrome_trace(args.trace)}")
+
+
+if __name__ == '__main__':
+    main()
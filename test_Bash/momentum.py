@@ -0,0 +1,187 @@
+import numpy as np
+import pandas as pd
+
+from data_store import load_klines
+from day_data import interval_to_ns
+from portfolio import align_panel, tradable_mask
+
+# 横截面动量：整个交易对池对齐成 (时间 × 资产) 收盘价矩阵，滚动收益、滚动夏普 / 索提诺与排名
+# 对所有资产一次性按列计算 (没有按交易对的 Python 循环)。上市晚的资产 (如 SUI、ONDO)
+# 在上市前为 NaN，窗口内数据不足时得分为 NaN，不参与排名。
+# 每个再平衡 K 线选出得分前 k 的资产等权持有，得到的权重矩阵交给 PortfolioBacktester。
+
+_DAY_NS = 86400 * 1_000_000_000
+
+
+def days_to_bars(days, interval):
+    """
+    天数换算为 K 线根数，如 (7, '4h') -> 42。
+    """
+    return max(1, int(round(days * _DAY_NS / interval_to_ns(interval))))
+
+
+def load_universe(paths, column='Close Price'):
+    """
+    读取多个交易对并对齐到时间索引的并集。
+    paths: {交易对: CSV 路径}
+    返回: (index, symbols, matrix)，见 portfolio.align_panel
+    """
+    return align_panel({symbol: load_klines(path) for symbol, path in paths.items()}, column)
+
+
+def _returns(close):
+    # 上一根有效价格到本根的收益率；上市前与当根缺失为 NaN
+    prev = np.vstack((np.full((1, close.shape[1]), np.nan), close[:-1]))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return close / prev - 1.0
+
+
+def rolling_return(close, window):
+    """
+    过去 window 根 K 线的收益率 close[t] / close[t - window] - 1，历史不足 window 根时为 NaN。
+    """
+    close = np.asarray(close, dtype=float)
+    out = np.full_like(close, np.nan)
+    if window < len(close):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            out[window:] = close[window:] / close[:-window] - 1.0
+    return out
+
+
+def rolling_sharpe(close, window, periods_per_year):
+    """
+    过去 window 根 K 线收益率的年化夏普 (均值 / 标准差 * sqrt(periods_per_year))，无风险利率为 0。
+    """
+    returns = pd.DataFrame(_returns(np.asarray(close, dtype=float)))
+    rolling = returns.rolling(window, min_periods=window)
+    mean, std = rolling.mean().to_numpy(), rolling.std(ddof=0).to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(std > 0, mean / std * np.sqrt(periods_per_year), np.nan)
+
+
+def rolling_sortino(close, window, periods_per_year):
+    """
+    过去 window 根 K 线的年化索提诺：均值 / 下行偏差 (负收益的均方根) * sqrt(periods_per_year)。
+    窗口内没有负收益时为 NaN。
+    """
+    returns = _returns(np.asarray(close, dtype=float))
+    downside = np.where(np.isnan(returns), np.nan, np.minimum(returns, 0.0) ** 2)
+    mean = pd.DataFrame(returns).rolling(window, min_periods=window).mean().to_numpy()
+    dd = np.sqrt(pd.DataFrame(downside).rolling(window, min_periods=window).mean().to_numpy())
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(dd > 0, mean / dd * np.sqrt(periods_per_year), np.nan)
+
+
+def cross_rank(scores):
+    """
+    每根 K 线上对所有资产的得分排名 (1 为最高)，得分为 NaN 的资产不参与排名，结果为 NaN。
+    """
+    return pd.DataFrame(scores).rank(axis=1, ascending=False, method='first').to_numpy()
+
+
+def top_k_weights(scores, k, rebalance, eligible=None, exposure=1.0):
+    """
+    在再平衡 K 线上选出得分前 k 的资产等权持有 (合计 exposure)，两次再平衡之间权重不变。
+    scores: (T × N) 得分，NaN 表示不可选
+    rebalance: (T,) bool，再平衡 K 线
+    eligible: 可选的 (T × N) bool 过滤条件，如 滚动夏普 > 0
+    合格资产不足 k 个时只持有合格的资产，其余为现金。
+    返回: (T × N) 权重矩阵，第一次再平衡之前为 0
+    """
+    scores = np.asarray(scores, dtype=float)
+    if eligible is not None:
+        scores = np.where(eligible, scores, np.nan)
+    picked = cross_rank(scores) <= k
+    count = picked.sum(axis=1, keepdims=True)
+    weights = np.divide(picked * exposure, count, out=np.zeros(scores.shape), where=count > 0)
+    rebalance = np.asarray(rebalance, dtype=bool)
+    held = pd.DataFrame(np.where(rebalance[:, None], weights, np.nan)).ffill().to_numpy()
+    return np.nan_to_num(held)
+
+
+def momentum_scores(close, interval, windows=(7, 30), risk_window=30):
+    """
+    计算动量与风险调整指标。
+    windows: 收益率回看天数
+    risk_window: 滚动夏普 / 索提诺的回看天数
+    返回: {名称: (T × N) 数组}，如 'return_7d'、'return_30d'、'sharpe_30d'、'sortino_30d'
+    """
+    periods_per_year = days_to_bars(365, interval)
+    close = np.asarray(close, dtype=float)
+    scores = {f'return_{d}d': rolling_return(close, days_to_bars(d, interval)) for d in windows}
+    bars = days_to_bars(risk_window, interval)
+    scores[f'sharpe_{risk_window}d'] = rolling_sharpe(close, bars, periods_per_year)
+    scores[f'sortino_{risk_window}d'] = rolling_sortino(close, bars, periods_per_year)
+    return scores
+
+
+def momentum_weights(close, interval, lookback=30, k=3, rebalance_days=7, risk_window=30, min_sharpe=None,
+                     min_sortino=None, exposure=1.0):
+    """
+    横截面动量组合的目标权重：每 rebalance_days 天按 lookback 天收益率排名，买入前 k 名。
+    min_sharpe: 给定时只选择 risk_window 天滚动夏普不低于该值的资产
+    min_sortino: 给定时只选择 risk_window 天滚动索提诺不低于该值的资产 (窗口内没有负收益、索提诺为 NaN 时不入选)
+    返回: (weights, rebalance)，weights 为 (T × N) 矩阵，rebalance 为 (T,) bool
+    """
+    close = np.asarray(close, dtype=float)
+    score = rolling_return(close, days_to_bars(lookback, interval))
+    eligible = tradable_mask(close) & ~np.isnan(close)
+    risk_bars, periods_per_year = days_to_bars(risk_window, interval), days_to_bars(365, interval)
+    if min_sharpe is not None:
+        eligible &= rolling_sharpe(close, risk_bars, periods_per_year) >= min_sharpe
+    if min_sortino is not None:
+        eligible &= rolling_sortino(close, risk_bars, periods_per_year) >= min_sortino
+    rebalance = np.arange(len(close)) % days_to_bars(rebalance_days, interval) == 0
+    return top_k_weights(score, k, rebalance, eligible, exposure), rebalance
+
+
+def snapshot(index, symbols, scores, at=-1):
+    """
+    某一根 K 线上各资产的指标与排名 (按第一个指标排名)。
+    返回: DataFrame，索引为交易对
+    """
+    table = pd.DataFrame({name: values[at] for name, values in scores.items()},
+                         index=pd.Index(symbols, name='Symbol'))
+    first = next(iter(scores.values()))
+    table['rank'] = cross_rank(first[[at]])[0]
+    table.attrs['time'] = index[at]
+    return table.sort_values('rank')
+
+
+if __name__ == '__main__':
+    import glob
+    import json
+    import os
+    import time
+
+    from portfolio import PortfolioBacktester
+
+    with open('config.json', 'r') as f:
+        config = json.load(f)
+
+    for folder, interval in (('../data/day', '1d'), ('../data/4hour', '4h')):
+        paths = {os.path.basename(p).split('_')[0]: p for p in sorted(glob.glob(f'{folder}/*_{interval}.csv'))}
+        index, symbols, close = load_universe(paths)
+        t0 = time.perf_counter()
+        scores = momentum_scores(close, interval)
+        weights, rebalance = momentum_weights(close, interval, lookback=30, k=3, rebalance_days=7, min_sharpe=0.0)
+        elapsed = time.perf_counter() - t0
+        listed = pd.Series(index[np.argmax(~np.isnan(close), axis=0)], index=symbols)
+
+        print(f"\n=== {interval}: {len(symbols)} symbols x {len(index)} bars, scores + weights in "
+              f"{elapsed * 1e3:.1f} ms ===")
+        print("First bar per symbol:", ', '.join(f"{s} {t:%Y-%m-%d}" for s, t in listed.items()))
+        print(snapshot(index, symbols, scores).round(3).to_string())
+
+        data = {s: pd.DataFrame({'Close Price': close[:, i]}, index=index) for i, s in enumerate(symbols)}
+        rebalance_every = days_to_bars(7, interval)
+        sortino_weights, _ = momentum_weights(close, interval, lookback=30, k=3, rebalance_days=7, min_sortino=0.5)
+        for name, w in (('top 3 by 30d return, sharpe >= 0', weights),
+                        ('top 3 by 30d return, sortino >= 0.5', sortino_weights),
+                        ('equal weight universe', top_k_weights(np.where(tradable_mask(close), 1.0, np.nan),
+                                                                len(symbols), rebalance))):
+            backtester = PortfolioBacktester(config['initial_capital'], config['commission_rate'],
+                                             config['slippage_rate'])
+            equity, trades = backtester.run_backtest(
+                data, weights=pd.DataFrame(w, index=index, columns=symbols), rebalance_every=rebalance_every)
+            print(f"{name}: final equity {equity.iloc[-1]:,.2f}, {len(trades)} trades")
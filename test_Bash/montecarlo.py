@@ -0,0 +1,243 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import analytics
+
+# 蒙特卡洛 / 自助法稳健性检验。单次回测只给出一个夏普、回撤、胜率的点估计；
+# 这里对 K 线收益序列做分块自助重采样、对交易顺序做随机打乱 (或有放回重采样)，
+# 并随机扰动佣金与滑点，得到各指标的分布与置信区间。
+# 所有路径以 (路径 × 时间) 矩阵计算，按路径分块交给多个进程。
+
+PATH_CHUNK = 500 # 每块的路径数，10k 条 12k 长度的路径分块后每块约 50MB
+
+
+def return_metrics(returns, periods_per_year):
+    """
+    (路径 × 时间) 收益率矩阵 -> 每条路径的总收益、年化收益、波动率、夏普、索提诺、卡玛、最大回撤及其持续时间
+    (见 analytics.return_metrics)。
+    """
+    return analytics.return_metrics(np.atleast_2d(returns), periods_per_year)
+
+
+def trade_metrics(returns):
+    """
+    (路径 × 交易) 的单笔收益率矩阵 -> 每条路径按交易顺序复利的总收益、最大回撤、胜率、盈亏比。
+    """
+    returns = np.atleast_2d(returns)
+    equity = np.concatenate((np.ones((len(returns), 1)), np.cumprod(1.0 + returns, axis=1)), axis=1)
+    stats = analytics.trade_stats(returns)
+    return {'total_return': equity[:, -1] - 1.0, 'max_drawdown': analytics.max_drawdown(equity)[0],
+            'win_rate': stats['win_rate'], 'profit_factor': stats['profit_factor']}
+
+
+def block_bootstrap(rng, values, n_paths, block):
+    """
+    循环分块自助法：每条路径由随机起点的连续 block 个值拼接而成 (首尾循环)，
+    保留块内的波动聚集与自相关。
+    values: 一维序列，或 (k × 长度) 的多行序列 (各行使用同一组随机块，如收益率与每根 K 线的成交次数)
+    返回: (n_paths × 长度) 数组；多行时为 (k × n_paths × 长度)
+    """
+    values = np.asarray(values)
+    length = values.shape[-1]
+    n_blocks = -(-length // block)
+    # 序列末尾接上开头 block 个值，每个起点对应一个连续窗口，按整块复制而不是逐元素取下标
+    windows = np.lib.stride_tricks.sliding_window_view(
+        np.concatenate((values, values[..., :block]), axis=-1), block, axis=-1)
+    starts = rng.integers(0, length, size=(n_paths, n_blocks))
+    return windows[..., starts, :].reshape(values.shape[:-1] + (n_paths, -1))[..., :length]
+
+
+def fill_counts(times, fill_times):
+    """
+    每个 K 线收益率区间内的成交次数，与资金曲线的 pct_change()[1:] 对齐：
+    第 k 根 K 线的成交影响 equity[k] -> equity[k + 1] 的收益率；最后一根 K 线的期末清仓计入最后一个区间。
+    times: 资金曲线的时间索引；fill_times: 成交时间 (如 trades_df['Date'])
+    返回: 长度 len(times) - 1 的 int64 数组
+    """
+    times = np.asarray(times, dtype='datetime64[ns]')
+    bars = np.searchsorted(times, np.asarray(fill_times, dtype='datetime64[ns]'))
+    return np.bincount(np.minimum(bars, len(times) - 2), minlength=len(times) - 1)[:len(times) - 1]
+
+
+def net_bar_returns(returns, fills, commission_rate, slippage_rate):
+    """
+    不计成本的 K 线收益率加入成本：每次成交损失 (佣金 + 滑点) 比例的资金。
+    returns / fills 与成本可以广播，如 (路径 × 时间) 与 (路径 × 1)。
+    """
+    cost = np.asarray(commission_rate) + np.asarray(slippage_rate)
+    return (1.0 + returns) * (1.0 - cost) ** fills - 1.0
+
+
+def gross_trade_returns(trades_df):
+    """
+    从 Backtester 的成交记录配对买入与之后的卖出 (SELL / SELL_FINAL)，得到每笔交易的毛收益率 (不含成本)。
+    按成交价计算，成本由 net_trade_returns 另行加入；backtester.trade_returns 则是按资金变化计算的净收益率。
+    """
+    if trades_df.empty:
+        return np.empty(0)
+    buys = trades_df['Type'].to_numpy() == 'BUY'
+    prices = trades_df['Price'].to_numpy(dtype=float)
+    entry = prices[:-1][buys[:-1] & ~buys[1:]]
+    exit_ = prices[1:][buys[:-1] & ~buys[1:]]
+    return exit_ / entry - 1.0
+
+
+def net_trade_returns(gross, commission_rate, slippage_rate):
+    """
+    毛收益率加入成本：买入多付 (滑点 + 佣金)，卖出少收 (滑点 + 佣金)。
+    gross 与成本可以广播，如 (1 × 交易) 与 (路径 × 1)。
+    """
+    cost = np.asarray(commission_rate) + np.asarray(slippage_rate)
+    return (1.0 + gross) * (1.0 - cost) / (1.0 + cost) - 1.0
+
+
+def perturbed_costs(rng, n_paths, commission_rate, slippage_rate, spread=0.5):
+    """
+    每条路径随机抽取佣金与滑点：在配置值的 [1 - spread, 1 + spread] 倍之间均匀分布。
+    返回: (commission, slippage)，形状 (n_paths, 1)
+    """
+    low, high = 1.0 - spread, 1.0 + spread
+    return (commission_rate * rng.uniform(low, high, (n_paths, 1)),
+            slippage_rate * rng.uniform(low, high, (n_paths, 1)))
+
+
+def _bootstrap_chunk(returns, n_paths, block, periods_per_year, fills, commission_rate, slippage_rate, spread,
+                     seed):
+    rng = np.random.default_rng(seed)
+    if fills is None:
+        return return_metrics(block_bootstrap(rng, returns, n_paths, block), periods_per_year)
+    paths, path_fills = block_bootstrap(rng, np.vstack((returns, fills)), n_paths, block)
+    commission, slippage = perturbed_costs(rng, n_paths, commission_rate, slippage_rate, spread)
+    result = return_metrics(net_bar_returns(paths, path_fills, commission, slippage), periods_per_year)
+    result['commission_rate'] = commission[:, 0]
+    result['slippage_rate'] = slippage[:, 0]
+    return result
+
+
+def _trade_chunk(gross, n_paths, replace, commission_rate, slippage_rate, spread, seed):
+    rng = np.random.default_rng(seed)
+    if replace:
+        order = rng.integers(0, len(gross), size=(n_paths, len(gross)))
+    else:
+        order = np.argsort(rng.random((n_paths, len(gross))), axis=1)
+    commission, slippage = perturbed_costs(rng, n_paths, commission_rate, slippage_rate, spread)
+    result = trade_metrics(net_trade_returns(gross[order], commission, slippage))
+    result['commission_rate'] = commission[:, 0]
+    result['slippage_rate'] = slippage[:, 0]
+    return result
+
+
+def _run_chunks(func, n_paths, seed, max_workers, args):
+    """
+    把 n_paths 条路径按 PATH_CHUNK 分块并行计算，各块使用独立的随机数流 (结果只取决于 seed 与分块)。
+    """
+    sizes = [min(PATH_CHUNK, n_paths - i) for i in range(0, n_paths, PATH_CHUNK)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    max_workers = max_workers or min(len(sizes), os.cpu_count() or 1)
+    if max_workers <= 1:
+        parts = [func(*args[:1], size, *args[1:], s) for size, s in zip(sizes, seeds)]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(func, *args[:1], size, *args[1:], s) for size, s in zip(sizes, seeds)]
+            parts = [f.result() for f in futures]
+    return {key: np.concatenate([p[key] for p in parts]) for key in parts[0]}
+
+
+def bootstrap_returns(returns, n_paths=10000, block=24, periods_per_year=365, seed=0, max_workers=None,
+                      fills=None, commission_rate=0.0, slippage_rate=0.0, spread=0.5):
+    """
+    对 K 线收益率序列做分块自助重采样，返回每条路径的指标。
+    returns: 每根 K 线的收益率 (如资金曲线的 pct_change)
+    block: 块长度 (K 线数)
+    fills: 可选的每根 K 线成交次数 (见 fill_counts)。给出时 returns 应为不计成本的收益率：成交次数随收益率
+           一起重采样，每条路径按 perturbed_costs 随机扰动的佣金与滑点在有成交的 K 线上扣除成本。
+           不给时直接重采样 returns，其中已有的成本固定不变，路径之间没有成本的不确定性
+    返回: {指标名: (n_paths,) 数组}，见 return_metrics；给出 fills 时另含每条路径抽到的
+          'commission_rate' / 'slippage_rate'
+    """
+    returns = np.asarray(returns, dtype=float)
+    valid = ~np.isnan(returns)
+    returns = returns[valid]
+    if fills is not None:
+        fills = np.asarray(fills, dtype=float)[valid]
+    return _run_chunks(_bootstrap_chunk, n_paths, seed, max_workers,
+                       (returns, block, periods_per_year, fills, commission_rate, slippage_rate, spread))
+
+
+def resample_trades(gross, n_paths=10000, replace=False, commission_rate=0.0, slippage_rate=0.0, spread=0.5,
+                    seed=0, max_workers=None):
+    """
+    交易序列的蒙特卡洛：每条路径随机打乱交易顺序 (replace=True 时有放回重采样)，
+    并按 perturbed_costs 随机扰动佣金与滑点。
+    打乱顺序不改变总收益，但改变回撤路径；有放回重采样同时改变总收益与胜率。
+    gross: 每笔交易的毛收益率，见 gross_trade_returns
+    返回: {指标名: (n_paths,) 数组}，见 trade_metrics，另含每条路径抽到的 'commission_rate' / 'slippage_rate'
+    """
+    gross = np.asarray(gross, dtype=float)
+    if len(gross) == 0:
+        raise ValueError("No trades to resample")
+    return _run_chunks(_trade_chunk, n_paths, seed, max_workers,
+                       (gross, replace, commission_rate, slippage_rate, spread))
+
+
+def summarize(samples, point=None, ci=0.95):
+    """
+    汇总各指标的分布：均值、标准差、分位数与 ci 置信区间 (百分位法)。
+    samples: {指标名: 数组}
+    point: 可选的原始回测点估计 {指标名: 值}，同时给出分布中不超过该值的比例 ('percentile')
+    返回: DataFrame，每行一个指标
+    """
+    tail = (1.0 - ci) / 2 * 100
+    rows = {}
+    for name, values in samples.items():
+        values = values[np.isfinite(values)]
+        low, p50, high = np.percentile(values, [tail, 50, 100 - tail]) if len(values) else (np.nan,) * 3
+        row = {'mean': values.mean() if len(values) else np.nan, 'std': values.std() if len(values) else np.nan,
+               'ci_low': low, 'median': p50, 'ci_high': high}
+        if point is not None and name in point:
+            row['point'] = point[name]
+            row['percentile'] = (values <= point[name]).mean() * 100 if len(values) else np.nan
+        rows[name] = row
+    return pd.DataFrame(rows).T
+
+
+if __name__ == '__main__':
+    import json
+    import time
+
+    from runner import prepare_data
+    from backtester import Backtester
+
+    with open('config.json', 'r') as f:
+        config = json.load(f)
+
+    job = {'symbol': 'BTCUSDT', 'interval': '4h', 'csv_path': '../data/4hour/BTCUSDT_4h.csv',
+           'strategy': 'macd', 'params': config['strategy_params']['macd']}
+    data = prepare_data(job)
+    # 以不计成本的回测得到毛收益交易序列，成本在蒙特卡洛中按配置值随机扰动后加入
+    backtester = Backtester(config['initial_capital'], 0.0, 0.0)
+    equity_curve, trades_df = backtester.run_backtest(data)
+    periods_per_year = analytics.periods_per_year(job['interval'])
+
+    t0 = time.perf_counter()
+    returns = equity_curve.pct_change().to_numpy()[1:]
+    fills = fill_counts(equity_curve.index.values, trades_df['Date'])
+    samples = bootstrap_returns(returns, n_paths=10000, block=42, periods_per_year=periods_per_year, fills=fills,
+                                commission_rate=config['commission_rate'], slippage_rate=config['slippage_rate'])
+    point = return_metrics(net_bar_returns(returns, fills, config['commission_rate'], config['slippage_rate']),
+                           periods_per_year)
+    print(f"Block bootstrap: 10000 paths x {len(equity_curve)} bars in {time.perf_counter() - t0:.2f}s")
+    print(summarize(samples, {k: v[0] for k, v in point.items()}).to_string())
+
+    gross = gross_trade_returns(trades_df)
+    for replace in (False, True):
+        t0 = time.perf_counter()
+        samples = resample_trades(gross, n_paths=10000, replace=replace,
+                                  commission_rate=config['commission_rate'], slippage_rate=config['slippage_rate'])
+        point = trade_metrics(net_trade_returns(gross, config['commission_rate'], config['slippage_rate']))
+        print(f"\nTrade {'resample' if replace else 'shuffle'}: 10000 paths x {len(gross)} trades "
+              f"in {time.perf_counter() - t0:.2f}s")
+        print(summarize(samples, {k: v[0] for k, v in point.items()}).to_string())
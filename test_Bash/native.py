@@ -0,0 +1,279 @@
+import argparse
+import contextlib
+import glob
+import importlib.util
+import io
+import math
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_store import load_arrays, bt_feed
+from rules import evaluate_rules
+from kernels import simulate_next_open, simulate_obv_macd_rsi, FILL_KINDS
+from strategy import OBV_MACD_RSI_PARAMS
+
+# 原生回测：不经过 Cerebro，直接在数组上运行 stragedy 目录下 backtrader 策略的进出场规则。
+# 每个策略的 next() 条件写成规则 (rules.py)，用 indicators.py 中与 backtrader 一致的指标算成整列布尔数组，
+# 再交给 kernels.py 中按 BackBroker 规则撮合的编译循环 (下一根开盘价成交、提交与成交时的现金检查)。
+# parity() 用 cerebro.run() 的结果逐项核对：期末资产、成交列表、夏普与最大回撤。
+
+STRATEGY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'stragedy')
+
+
+# 名称 -> 策略文件、类名、参数默认值 (与类的 params 相同，printlog 除外)、进出场规则与下单数量的写法。
+# 规则 (rules.py) 'entry' / 'exit' 即 next() 中的条件；cross_up(a, b) 为 a[0] > b[0] and a[-1] <= b[-1]，
+# NaN 参与的比较均为 False，指标预热期自然不触发
+STRATEGIES = {
+    'macd': {
+        'file': 'day/macd.py', 'class': 'MacdStrategy',
+        'rules': {'entry': 'cross_up(macd_hist(close, fast_period, slow_period, signal_period), 0)',
+                  'exit': 'cross_down(macd_hist(close, fast_period, slow_period, signal_period), 0)'},
+        'params': dict(fast_period=12, slow_period=26, signal_period=9, size_percentage=0.95),
+        'size_pct': 'size_percentage', 'size_mode': 0,
+    },
+    'rsi': {
+        'file': 'day/RSIStrategy.py', 'class': 'RSIStrategy',
+        'rules': {'entry': "rsi(close, rsi_period, 'sma') < rsi_lower",
+                  'exit': "rsi(close, rsi_period, 'sma') > rsi_upper"},
+        'params': dict(rsi_period=14, rsi_lower=30, rsi_upper=70, size_percentage=0.95),
+        'size_pct': 'size_percentage', 'size_mode': 0,
+    },
+    'obv': {
+        'file': 'day/onv.py', 'class': 'OBVStrategy',
+        'rules': {'entry': 'cross_up(obv(), sma(obv(), obv_ma_period))',
+                  'exit': 'cross_down(obv(), sma(obv(), obv_ma_period))'},
+        'params': dict(obv_ma_period=20, size_percentage=0.95),
+        'size_pct': 'size_percentage', 'size_mode': 0,
+    },
+    'combined': {
+        'file': 'mutil.py', 'class': 'CombinedStrategy',
+        'rules': {'ma_short_line': 'sma(close, ma_short)',
+                  'ma_long_line': 'sma(close, ma_long)',
+                  'macd_line': 'macd(close, macd_fast, macd_slow)',
+                  'signal_line': 'macd_signal(close, macd_fast, macd_slow, macd_signal)',
+                  'entry': 'cross_up(ma_short_line, ma_long_line) & cross_up(macd_line, signal_line)'
+                           ' & (rsi(close, rsi_period) < rsi_overbought)',
+                  'exit': '(ma_short_line < ma_long_line) | cross_down(macd_line, signal_line)'
+                          ' | (rsi(close, rsi_period) > rsi_overbought)'},
+        'params': dict(ma_short=5, ma_long=20, macd_fast=12, macd_slow=26, macd_signal=9, rsi_period=14,
+                       rsi_overbought=70, size_pct=0.95),
+        'size_pct': 'size_pct', 'size_mode': 1,
+    },
+    # 带回撤冷却与 ATR 移动止损，状态依赖路径，整段交给 kernels.simulate_obv_macd_rsi
+    'obv_macd_rsi': {
+        'file': 'day/macd_rsi_onv.py', 'class': 'OBV_MACD_RSI_Strategy', 'rules': None,
+        'params': dict(OBV_MACD_RSI_PARAMS),
+    },
+}
+
+
+def load_strategy_class(name):
+    """
+    按文件路径加载 STRATEGIES[name] 对应的 backtrader 策略类 (stragedy 目录不是包)。
+    模块以 'native_<name>' 注册到 sys.modules，backtrader 需要在其中找到策略所在的模块。
+    """
+    spec = STRATEGIES[name]
+    module_name = f'native_{name}'
+    module = sys.modules.get(module_name)
+    if module is None:
+        loader = importlib.util.spec_from_file_location(module_name, os.path.join(STRATEGY_DIR, spec['file']))
+        module = sys.modules[module_name] = importlib.util.module_from_spec(loader)
+        loader.loader.exec_module(module)
+    return getattr(module, spec['class'])
+
+
+def bt_sharpe(times, value, cash, riskfreerate=0.01):
+    """
+    与 bt.analyzers.SharpeRatio 默认参数相同的夏普：按自然年计算收益 (TimeReturn，
+    每年以上一年最后一根 K 线的账户价值为基准，第一年以初始资金为基准)，无风险利率 1%，
+    总体标准差，不年化。收益不足以计算时返回 None。
+    times: int64 纳秒时间戳；value: 每根 K 线收盘时的账户价值
+    """
+    years = np.asarray(times).astype('datetime64[ns]').astype('datetime64[Y]')
+    ends = np.flatnonzero(np.append(years[1:] != years[:-1], True))
+    if len(ends) == 0:
+        return None
+    closes = np.asarray(value, dtype=float)[ends].tolist()
+    returns = [end / start - 1.0 for start, end in zip([float(cash)] + closes[:-1], closes)]
+    rate = pow(1.0 + riskfreerate, 1.0 / 1) - 1.0
+    ret_free = [r - rate for r in returns]
+    avg = math.fsum(ret_free) / len(ret_free)
+    dev = math.sqrt(math.fsum([pow(r - avg, 2.0) for r in ret_free]) / len(ret_free))
+    try:
+        return avg / dev
+    except ZeroDivisionError:
+        return None
+
+
+def bt_drawdown(value):
+    """
+    与 bt.analyzers.DrawDown 相同的最大回撤 (百分比) 与最长回撤持续 K 线数。
+    返回: (max_drawdown, max_len)
+    """
+    value = np.asarray(value, dtype=float)
+    if len(value) == 0:
+        return 0.0, 0
+    peak = np.maximum.accumulate(value)
+    drawdown = 100.0 * (peak - value) / peak
+    underwater = drawdown != 0
+    # 连续处于回撤中的 K 线数，回到新高时清零
+    breaks = np.flatnonzero(np.diff(np.concatenate(([0], underwater.view(np.int8), [0]))))
+    max_len = int((breaks[1::2] - breaks[::2]).max()) if len(breaks) else 0
+    return float(max(drawdown.max(), 0.0)), max_len
+
+
+def run_native(name, csv_path, cash=10000.0, commission=0.001, **params):
+    """
+    以原生引擎运行策略 name (见 STRATEGIES)。
+    params: 覆盖策略参数默认值，名称与 backtrader 策略类的 params 相同
+    返回: dict
+        'value': 每根 K 线收盘时的账户价值 pd.Series
+        'fills': 成交 DataFrame (Date, Size, Price, Commission, Kind)
+        'final_value', 'sharpe', 'max_drawdown', 'max_drawdown_len': 与 cerebro 分析器的口径相同
+    """
+    spec = STRATEGIES[name]
+    unknown = set(params) - set(spec['params'])
+    if unknown:
+        raise ValueError(f"Unknown parameters for {name}: {sorted(unknown)}")
+    p = dict(spec['params'], **params)
+    times, ohlcv = load_arrays(csv_path)
+    open_, high, low, close, volume = (np.asarray(col) for col in ohlcv)
+
+    if spec['rules'] is None:
+        result = simulate_obv_macd_rsi(open_, high, low, close, volume, cash, commission, **p)
+    else:
+        rules = evaluate_rules(spec['rules'], dict(zip(('open', 'high', 'low', 'close', 'volume'), ohlcv)), p)
+        entry, exit_ = rules['entry'], rules['exit']
+        result = simulate_next_open(open_, close, entry, exit_, cash, commission, p[spec['size_pct']],
+                                    spec['size_mode'])
+
+    index = pd.DatetimeIndex(np.asarray(times).view('datetime64[ns]'))
+    fills = pd.DataFrame(result['fills'], columns=['Bar', 'Size', 'Price', 'Commission', 'Kind'])
+    fills.insert(0, 'Date', index[fills['Bar'].to_numpy(dtype=np.int64)])
+    fills['Kind'] = [FILL_KINDS[k] for k in fills['Kind']]
+    max_drawdown, max_len = bt_drawdown(result['value'])
+    return {
+        'value': pd.Series(result['value'], index=index),
+        'fills': fills.drop(columns='Bar'),
+        'final_value': result['cash'] + result['position'] * float(close[-1]) if len(close) else float(cash),
+        'sharpe': bt_sharpe(times, result['value'], cash),
+        'max_drawdown': max_drawdown,
+        'max_drawdown_len': max_len,
+    }
+
+
+def run_cerebro(name, csv_path, cash=10000.0, commission=0.001, **params):
+    """
+    以 cerebro.run() 运行同一个策略 (策略的日志输出被丢弃)，返回与 run_native 相同结构的 dict (不含 'value')。
+    """
+    import backtrader as bt
+
+    base = load_strategy_class(name)
+    executed = []
+
+    class Recorder(base):
+        def notify_order(self, order):
+            if order.status == order.Completed:
+                executed.append((bt.num2date(order.executed.dt), order.executed.size, order.executed.price,
+                                 order.executed.comm))
+            super().notify_order(order)
+
+    if 'printlog' in base.params._getkeys():
+        params = dict(params, printlog=False)
+    cerebro = bt.Cerebro(stdstats=False)
+    cerebro.addstrategy(Recorder, **params)
+    cerebro.adddata(bt_feed(csv_path))
+    cerebro.broker.setcash(cash)
+    cerebro.broker.setcommission(commission=commission)
+    cerebro.addanalyzer(bt.analyzers.SharpeRatio, _name='sharpe')
+    cerebro.addanalyzer(bt.analyzers.DrawDown, _name='drawdown')
+    with contextlib.redirect_stdout(io.StringIO()):
+        strat = cerebro.run()[0]
+    drawdown = strat.analyzers.drawdown.get_analysis()
+    return {
+        'fills': pd.DataFrame(executed, columns=['Date', 'Size', 'Price', 'Commission']),
+        'final_value': cerebro.broker.getvalue(),
+        'sharpe': strat.analyzers.sharpe.get_analysis()['sharperatio'],
+        'max_drawdown': drawdown['max']['drawdown'],
+        'max_drawdown_len': drawdown['max']['len'],
+    }
+
+
+def _close_enough(a, b, rtol):
+    if a is None or b is None:
+        return a is None and b is None
+    return abs(a - b) <= rtol * max(abs(a), abs(b), 1e-12)
+
+
+def parity(name, csv_path, cash=10000.0, commission=0.001, rtol=1e-9, **params):
+    """
+    在同一个 CSV 上分别运行原生引擎与 cerebro，逐项比较。
+    成交价允许 rtol 的相对误差：backtrader 的 executed.price 经过持仓均价换算，可能与开盘价相差 1 ulp。
+    返回: dict，各项比较结果 (bool)、两边的数值与耗时，'ok' 为全部一致
+    """
+    t0 = time.perf_counter()
+    native = run_native(name, csv_path, cash, commission, **params)
+    t1 = time.perf_counter()
+    ref = run_cerebro(name, csv_path, cash, commission, **params)
+    t2 = time.perf_counter()
+
+    # 参数默认值必须与策略类一致，否则不传参数时两边跑的不是同一个策略
+    defaults = dict(load_strategy_class(name).params._getitems())
+    defaults.pop('printlog', None)
+    a, b = native['fills'], ref['fills']
+    same_fills = len(a) == len(b) and bool(
+        (a['Date'].to_numpy() == pd.DatetimeIndex(b['Date']).to_numpy()).all()
+        and np.array_equal(np.abs(a['Size'].to_numpy()), np.abs(b['Size'].to_numpy(dtype=float)))
+        and np.allclose(a['Price'].to_numpy(dtype=float), b['Price'].to_numpy(dtype=float), rtol=rtol, atol=0)
+        and np.allclose(a['Commission'].to_numpy(dtype=float), b['Commission'].to_numpy(dtype=float),
+                        rtol=rtol, atol=0))
+    checks = {
+        'params': defaults == STRATEGIES[name]['params'],
+        'fills': same_fills,
+        'final_value': _close_enough(native['final_value'], ref['final_value'], rtol),
+        'sharpe': _close_enough(native['sharpe'], ref['sharpe'], rtol),
+        'max_drawdown': _close_enough(native['max_drawdown'], ref['max_drawdown'], rtol)
+        and native['max_drawdown_len'] == ref['max_drawdown_len'],
+    }
+    row = dict(checks, ok=all(checks.values()), trades=len(a), bt_trades=len(b),
+               native_value=native['final_value'], bt_value=ref['final_value'],
+               native_sharpe=native['sharpe'], bt_sharpe=ref['sharpe'],
+               native_drawdown=native['max_drawdown'], bt_drawdown=ref['max_drawdown'],
+               native_s=t1 - t0, bt_s=t2 - t1)
+    return row
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check native engine parity with cerebro.run()")
+    parser.add_argument('--strategies', nargs='+', default=list(STRATEGIES), choices=list(STRATEGIES))
+    parser.add_argument('--data', nargs='+', default=sorted(glob.glob('../data/day/*_1d.csv')),
+                        help="CSV files (default: every bundled daily file)")
+    parser.add_argument('--cash', type=float, default=10000.0)
+    parser.add_argument('--commission', type=float, default=0.001)
+    args = parser.parse_args(argv)
+
+    rows = []
+    for name in args.strategies:
+        for csv_path in args.data:
+            row = parity(name, csv_path, args.cash, args.commission)
+            rows.append(dict(strategy=name, data=os.path.basename(csv_path), **row))
+    report = pd.DataFrame(rows)
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(report[['strategy', 'data', 'ok', 'trades', 'native_value', 'bt_value', 'native_sharpe',
+                      'native_drawdown', 'native_s', 'bt_s']].to_string(index=False))
+    failed = report[~report['ok']]
+    if len(failed):
+        print("\nMismatches:")
+        print(failed.to_string(index=False))
+        return 1
+    print(f"\nAll {len(report)} runs match; native {report['native_s'].sum():.2f}s vs "
+          f"cerebro {report['bt_s'].sum():.2f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
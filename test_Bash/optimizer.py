@@ -0,0 +1,213 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from analytics import performance, infer_periods_per_year
+from data_store import load_arrays, data_fingerprint
+from backtester import simulate_long_only
+from indicators import ema, rsi, indicator_cache, _freeze
+from strategy import STRATEGY_RULES
+
+SCORE_COLUMNS = ['total_return', 'annual_return', 'sharpe', 'sortino', 'max_drawdown', 'trades']
+
+
+def param_grid(ranges):
+    """
+    展开参数范围为参数组合列表。
+    ranges: {参数名: 可迭代的取值}，如 {'fast_period': range(5, 21), ...}
+    返回: [{参数名: 值}, ...]
+    """
+    names = list(ranges)
+    return [dict(zip(names, values)) for values in itertools.product(*(list(ranges[n]) for n in names))]
+
+
+def _cached(csv_path, key, compute):
+    # 中间结果放在进程内的指标 LRU 缓存中，键为 ('optimizer', 数据指纹, 名称, 参数...)：
+    # 同一个 EMA 周期 / RSI 周期在整个参数扫描中只计算一次，内存占用有上限
+    key = ('optimizer', data_fingerprint(csv_path)) + key
+    return indicator_cache.get(key, lambda: _freeze((compute(),)))[0]
+
+
+def _close(csv_path):
+    return _cached(csv_path, ('close',), lambda: np.array(load_arrays(csv_path)[1][3]))
+
+
+def _with_defaults(strategy, params):
+    # ranges 中没有给出的参数取 strategy.STRATEGY_RULES 的默认值
+    return dict(STRATEGY_RULES[strategy][1], **params)
+
+
+def _macd_signals(csv_path, params):
+    p = _with_defaults('macd', params)
+    close = _close(csv_path)
+    fast = _cached(csv_path, ('ema', p['fast_period']), lambda: ema(close, p['fast_period']))
+    slow = _cached(csv_path, ('ema', p['slow_period']), lambda: ema(close, p['slow_period']))
+    macd = _cached(csv_path, ('macd', p['fast_period'], p['slow_period']), lambda: fast - slow)
+    macd_signal = ema(macd, p['signal_period'])
+    # 与 Strategy.generate_signals('macd') 相同：MACD 在信号线上方为 1，下方为 -1
+    signal = np.where(macd > macd_signal, 1, np.where(macd < macd_signal, -1, 0))
+    return signal, ~np.isnan(macd_signal)
+
+
+def _rsi_signals(csv_path, params):
+    p = _with_defaults('rsi', params)
+    close = _close(csv_path)
+    line = _cached(csv_path, ('rsi', p['rsi_period'], p['rsi_method']),
+                   lambda: rsi(close, p['rsi_period'], method=p['rsi_method']))
+    # 与 RSIStrategy 相同：RSI 低于下轨买入，高于上轨卖出
+    signal = np.where(line < p['rsi_lower'], 1, np.where(line > p['rsi_upper'], -1, 0))
+    return signal, ~np.isnan(line)
+
+
+SIGNAL_BUILDERS = {
+    'macd': _macd_signals,
+    'rsi': _rsi_signals,
+}
+
+
+def score_equity(equity, periods_per_year):
+    """
+    根据资金曲线计算打分指标 (见 analytics.performance)；equity 为二维时一次给多条曲线打分。
+    """
+    return performance(equity, periods_per_year)
+
+
+def _periods_per_year(csv_path):
+    return infer_periods_per_year(load_arrays(csv_path)[0])
+
+
+def evaluate(csv_path, strategy, params_list, initial_capital, commission_rate, slippage_rate, window=None):
+    """
+    在一个交易对上评估一批参数组合 (工作进程入口)。
+    window: 可选的 (起始, 结束) K 线下标，只在该区间内回测。指标仍在全部历史上计算 (并缓存)，
+            区间开头的指标值延续之前的历史，不从区间第一根 K 线重新预热
+    返回: [{指标名: 值}, ...]，与 params_list 一一对应；无效组合为 None
+    """
+    build = SIGNAL_BUILDERS[strategy]
+    close = _close(csv_path)
+    periods_per_year = _periods_per_year(csv_path)
+    scores = []
+    for params in params_list:
+        p = _with_defaults(strategy, params)
+        if strategy == 'macd' and p['fast_period'] >= p['slow_period']:
+            scores.append(None)
+            continue
+        signal, valid = build(csv_path, params)
+        # 与 pandas 流程中 dropna 一致：从指标全部有效的第一根 K 线开始
+        start = np.argmax(valid) if valid.any() else len(valid)
+        stop = len(close)
+        if window is not None:
+            start, stop = max(start, window[0]), min(stop, window[1])
+        if stop - start < 2:
+            scores.append(None)
+            continue
+        result = simulate_long_only(close[start:stop], signal[start:stop], initial_capital, commission_rate,
+                                    slippage_rate)
+        score = score_equity(result['equity'], periods_per_year)
+        score['trades'] = len(result['fills'])
+        scores.append(score)
+    return scores
+
+
+def _chunks(items, n):
+    size = max(1, -(-len(items) // n))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def sweep(csv_paths, ranges, strategy='macd', metric='sharpe', initial_capital=10000,
+          commission_rate=0.0, slippage_rate=0.0, max_workers=None, rungs=1, keep_fraction=1.0):
+    """
+    参数网格搜索：在所有交易对上评估每个参数组合，返回按 metric 排名的结果表。
+    csv_paths: {交易对: CSV 路径}
+    ranges: {参数名: 取值范围}；没有给出的参数使用策略的默认值 (strategy.STRATEGY_RULES)
+    strategy: 'macd' 或 'rsi'
+    metric: 排名所用指标 (越大越好；'max_drawdown' 按越小越好)
+    max_workers: 进程数，为 1 时在当前进程执行
+    rungs / keep_fraction: 提前淘汰。交易对分成 rungs 批依次评估，每批之后只保留
+                           当前平均指标排名前 keep_fraction 的组合，被淘汰的组合不再评估
+    返回: DataFrame，每行一个参数组合，包含参数、各指标在交易对上的均值 (忽略 NaN)、评估的交易对数量、是否被淘汰；
+          没有任何组合产生交易时打印警告 (通常是成本或资金设置有误)
+    """
+    combos = param_grid(ranges)
+    symbols = list(csv_paths)
+    max_workers = max_workers or os.cpu_count() or 1
+    # 各指标只累计有限值 (如从未交易的交易对上夏普为 NaN)，均值按各自的有效个数计算
+    sums = np.zeros((len(combos), len(SCORE_COLUMNS)))
+    finite = np.zeros((len(combos), len(SCORE_COLUMNS)), dtype=int)
+    counts = np.zeros(len(combos), dtype=int)
+    alive = np.ones(len(combos), dtype=bool)
+    sign = -1.0 if metric == 'max_drawdown' else 1.0
+
+    pool = ProcessPoolExecutor(max_workers=max_workers) if max_workers > 1 else None
+    try:
+        for rung, rung_symbols in enumerate(np.array_split(symbols, min(rungs, len(symbols)))):
+            live = np.flatnonzero(alive)
+            tasks = []
+            for symbol in rung_symbols:
+                # 同一交易对的组合分块交给工作进程，分块内共享指标缓存
+                for idx in _chunks(list(live), max(1, max_workers // len(rung_symbols))):
+                    args = (csv_paths[symbol], strategy, [combos[i] for i in idx],
+                            initial_capital, commission_rate, slippage_rate)
+                    tasks.append((idx, pool.submit(evaluate, *args) if pool else evaluate(*args)))
+            for idx, scores in tasks:
+                scores = scores.result() if pool else scores
+                for i, score in zip(idx, scores):
+                    if score is not None:
+                        values = np.array([score[c] for c in SCORE_COLUMNS], dtype=float)
+                        ok = np.isfinite(values)
+                        sums[i, ok] += values[ok]
+                        finite[i] += ok
+                        counts[i] += 1
+
+            if rung < rungs - 1 and keep_fraction < 1.0:
+                j = SCORE_COLUMNS.index(metric)
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    mean = sign * sums[:, j] / finite[:, j]
+                mean[~alive | (finite[:, j] == 0)] = -np.inf
+                keep = max(1, int(np.ceil(alive.sum() * keep_fraction)))
+                alive[:] = False
+                alive[np.argsort(-mean, kind='stable')[:keep]] = True
+    finally:
+        if pool:
+            pool.shutdown()
+
+    table = pd.DataFrame(combos)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for j, column in enumerate(SCORE_COLUMNS):
+            table[column] = sums[:, j] / finite[:, j]
+    table['symbols'] = counts
+    table['pruned'] = ~alive
+    table = table[counts > 0]
+    if len(table) and not (table['trades'] > 0).any():
+        print(f"Warning: none of the {len(table)} parameter combinations traded "
+              f"(commission {commission_rate}, slippage {slippage_rate}); the ranking is meaningless.")
+    table = table.sort_values(['pruned', metric], ascending=[True, metric == 'max_drawdown'], kind='stable')
+    table.insert(0, 'rank', np.arange(1, len(table) + 1))
+    return table.reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    import glob
+    import json
+    import time
+
+    with open('config.json', 'r') as f:
+        config = json.load(f)
+
+    paths = {os.path.basename(p).split('_')[0]: p for p in sorted(glob.glob('../data/day/*_1d.csv'))}
+    ranges = {
+        'fast_period': range(4, 24, 2),
+        'slow_period': range(20, 60, 4),
+        'signal_period': range(3, 13),
+    }
+    t0 = time.perf_counter()
+    result = sweep(paths, ranges, strategy='macd', metric='sharpe',
+                   initial_capital=config['initial_capital'],
+                   commission_rate=config['commission_rate'],
+                   slippage_rate=config['slippage_rate'])
+    print(f"Evaluated {len(param_grid(ranges))} combinations on {len(paths)} symbols "
+          f"in {time.perf_counter() - t0:.2f}s")
+    print(result.head(20).to_string(index=False))
@@ -0,0 +1,298 @@
+import numpy as np
+import pandas as pd
+
+from analytics import performance, infer_periods_per_year
+
+# 多资产组合回测：所有交易对对齐到同一时间索引，共用一个现金池。
+# 价格、信号、目标权重、持仓都是 (时间 × 资产) 矩阵；只在调仓 K 线上按资产维度向量化
+# 推进现金与持仓，其余 K 线的持仓与资金由矩阵运算一次性得到。
+
+SIZING_RULES = ('equal', 'fixed', 'inverse_vol')
+
+
+def align_panel(data, column='Close Price'):
+    """
+    把 {交易对: DataFrame} 的某一列对齐到所有时间索引的并集。
+    返回: (index, symbols, matrix)，matrix 为 (时间 × 资产) 的 float64 数组，缺失处为 NaN
+    """
+    symbols = list(data)
+    frame = pd.concat({s: data[s][column] for s in symbols}, axis=1, sort=True)
+    frame = frame.loc[~frame.index.duplicated(keep='last')]
+    return frame.index.rename(None), symbols, frame.to_numpy(dtype=float)
+
+
+def tradable_mask(close):
+    """
+    每个资产从第一根到最后一根有效价格之间可交易 (上市前、数据结束后不可交易)。
+    """
+    valid = ~np.isnan(close)
+    n = len(close)
+    first = np.where(valid.any(axis=0), valid.argmax(axis=0), n)
+    last = n - 1 - valid[::-1].argmax(axis=0)
+    bars = np.arange(n)[:, None]
+    return (bars >= first) & (bars <= last)
+
+
+def held_from_signals(signal):
+    """
+    信号矩阵 -> 持仓意图：与 Backtester 相同，最近一个非零信号为 1 时持有多仓。
+    signal: (时间 × 资产)，1 买入，-1 卖出，0 / NaN 保持
+    """
+    signal = pd.DataFrame(np.where(np.isnan(signal), 0, signal))
+    return (signal.where(signal != 0).ffill().to_numpy() == 1)
+
+
+def target_weights(held, close, sizing='equal', fraction=0.1, lookback=20, exposure=1.0, refresh=None):
+    """
+    根据仓位规则计算目标权重矩阵 (每行之和不超过 exposure，其余为现金)。
+    sizing:
+        'equal': 持有的资产等权分配 exposure
+        'fixed': 每个持有的资产占权益的 fraction，合计超过 exposure 时按比例缩小
+        'inverse_vol': 按过去 lookback 根 K 线收益率波动率的倒数分配 exposure。波动率只在持仓
+                       组合变化或 refresh 为 True 的 K 线上更新，避免每根 K 线都调仓
+    refresh: (T,) bool，可选的权重刷新 K 线 (如定期再平衡)
+    """
+    held = held.astype(float)
+    if sizing == 'equal':
+        raw = held
+    elif sizing == 'fixed':
+        raw = held * fraction
+    elif sizing == 'inverse_vol':
+        returns = pd.DataFrame(close).pct_change(fill_method=None)
+        vol = returns.rolling(lookback, min_periods=2).std().to_numpy()
+        update = np.ones(len(held), dtype=bool)
+        update[1:] = (held[1:] != held[:-1]).any(axis=1)
+        if refresh is not None:
+            update |= np.asarray(refresh, dtype=bool)
+        vol = pd.DataFrame(np.where(update[:, None], vol, np.nan)).ffill().to_numpy()
+        with np.errstate(divide='ignore'):
+            raw = np.where((vol > 0) & (held > 0), 1.0 / vol, 0.0)
+    else:
+        raise ValueError(f"Unknown sizing rule: {sizing}")
+
+    total = raw.sum(axis=1, keepdims=True)
+    if sizing == 'fixed':
+        scale = np.where(total > exposure, exposure / np.where(total > 0, total, 1.0), 1.0)
+    else:
+        scale = np.where(total > 0, exposure / np.where(total > 0, total, 1.0), 0.0)
+    return raw * scale
+
+
+def simulate_portfolio(close, weights, cash, commission_rate, slippage_rate, rebalance=None, liquidate=True):
+    """
+    共享现金的组合回测核心 (纯数组)。
+    close: (T × N) 收盘价，不可交易处为 NaN
+    weights: (T × N) 目标权重。权重变化的 K 线上只有权重变化的资产按收盘价调整到目标权重，
+             其余资产持仓不动
+    rebalance: (T,) bool，额外的再平衡 K 线 (如定期再平衡)，所有资产都调整到目标权重
+    liquidate: 最后一根 K 线清仓 (与 Backtester 的 SELL_FINAL 一致)
+    成本与 Backtester 相同：佣金 = 成交额 * commission_rate；滑点按成交额的 slippage_rate 计
+    (买入多付，卖出少收)。买入总额超过现金时按比例缩减，不借钱。
+    返回: dict
+        'equity': (T,) 每根 K 线调仓前的总资产 (最后一根为清仓后)
+        'cash': (T,) 每根 K 线调仓后的现金
+        'holdings': (T × N) 每根 K 线调仓后的持仓数量
+        'trades': 成交记录，dict: 'bar' / 'asset' / 'quantity' (负数为卖出) / 'price' /
+                  'commission' / 'slippage' 数组
+    """
+    close = np.asarray(close, dtype=float)
+    n, m = close.shape
+    tradable = tradable_mask(close)
+    price = pd.DataFrame(close).ffill().to_numpy()
+    price = np.where(np.isnan(price), 0.0, price)
+    weights = np.where(tradable, np.nan_to_num(np.asarray(weights, dtype=float)), 0.0)
+
+    if liquidate and n:
+        weights[-1] = 0.0
+    retarget = np.empty((n, m), dtype=bool)
+    retarget[0] = weights[0] != 0
+    retarget[1:] = weights[1:] != weights[:-1]
+    if rebalance is not None:
+        retarget |= np.asarray(rebalance, dtype=bool)[:, None] & (weights != 0)
+    events = np.flatnonzero(retarget.any(axis=1))
+
+    initial_cash = cash = float(cash)
+    h = np.zeros(m)
+    cash_states = np.empty(len(events))
+    holding_states = np.empty((len(events), m))
+    traded = np.zeros((len(events), m))
+    buy_cost = 1.0 + slippage_rate + commission_rate
+    sell_keep = 1.0 - slippage_rate - commission_rate
+    for e, t in enumerate(events.tolist()):
+        p = price[t]
+        equity = cash + h @ p
+        target = np.divide(weights[t] * equity, p, out=np.zeros(m), where=p > 0)
+        delta = np.where(retarget[t], target - h, 0.0)
+        sells = np.minimum(delta, 0.0)
+        buys = np.maximum(delta, 0.0)
+        cash -= sells @ p * sell_keep
+        spend = buys @ p * buy_cost
+        if spend > cash:
+            buys *= cash / spend if cash > 0 else 0.0
+            spend = buys @ p * buy_cost
+        cash -= spend
+        h = h + sells + buys
+        cash_states[e] = cash
+        holding_states[e] = h
+        traded[e] = sells + buys
+
+    # 调仓前状态 = 之前最后一次调仓后的状态；之后的 K 线用收盘价估值
+    bars = np.arange(n)
+    before = np.searchsorted(events, bars, side='left') - 1
+    after = np.searchsorted(events, bars, side='right') - 1
+    cash_path = np.concatenate(([initial_cash], cash_states))
+    hold_path = np.vstack((np.zeros((1, m)), holding_states))
+    equity = cash_path[before + 1] + (hold_path[before + 1] * price).sum(axis=1)
+    if liquidate and len(events) and events[-1] == n - 1:
+        equity[-1] = cash_states[-1]
+
+    e, asset = np.nonzero(traded)
+    quantity = traded[e, asset]
+    trade_price = price[events[e], asset]
+    notional = np.abs(quantity) * trade_price
+    return {
+        'equity': equity,
+        'cash': cash_path[after + 1],
+        'holdings': hold_path[after + 1],
+        'trades': {
+            'bar': events[e],
+            'asset': asset,
+            'quantity': quantity,
+            'price': trade_price,
+            'commission': notional * commission_rate,
+            'slippage': notional * slippage_rate,
+        },
+    }
+
+
+def attribution(close, holdings, trades, symbols, initial_capital):
+    """
+    按资产拆分组合盈亏：持仓盈亏 = 上一根调仓后持仓 * 本根价格变化，再减去该资产的佣金与滑点。
+    各资产 'Net PnL' 之和等于期末资产减初始资金。
+    返回: DataFrame，索引为交易对
+    """
+    price = pd.DataFrame(np.asarray(close, dtype=float)).ffill().fillna(0.0).to_numpy()
+    gross = (holdings[:-1] * np.diff(price, axis=0)).sum(axis=0)
+    m = len(symbols)
+    asset = trades['asset']
+    commission = np.bincount(asset, trades['commission'], minlength=m)
+    slippage = np.bincount(asset, trades['slippage'], minlength=m)
+    turnover = np.bincount(asset, np.abs(trades['quantity']) * trades['price'], minlength=m)
+    net = gross - commission - slippage
+    value = holdings * price
+    total = value.sum(axis=1)
+    return pd.DataFrame({
+        'Gross PnL': gross,
+        'Commission': commission,
+        'Slippage': slippage,
+        'Net PnL': net,
+        'Contribution (%)': net / initial_capital * 100,
+        'Trades': np.bincount(asset, minlength=m),
+        'Turnover': turnover,
+        'Exposure (%)': (holdings > 0).mean(axis=0) * 100,
+        'Avg Value': value.mean(axis=0),
+        'Avg Share of Holdings (%)': np.divide(value, total[:, None], out=np.zeros_like(value),
+                                               where=total[:, None] > 0).mean(axis=0) * 100,
+    }, index=pd.Index(symbols, name='Symbol'))
+
+
+class PortfolioBacktester:
+    """
+    多资产组合回测器：所有交易对共用 initial_capital 的现金池。
+    接口与 Backtester 相同 (run_backtest 返回资金曲线与成交记录)，另外提供
+    holdings / weights (时间 × 资产) 与按资产拆分的 attribution。
+    """
+
+    def __init__(self, initial_capital, commission_rate, slippage_rate):
+        self.initial_capital = float(initial_capital)
+        self.commission_rate = float(commission_rate)
+        self.slippage_rate = float(slippage_rate)
+        self.equity_curve = pd.Series(dtype=float)
+        self.trades = pd.DataFrame()
+        self.holdings = pd.DataFrame()
+        self.weights = pd.DataFrame()
+        self.attribution = pd.DataFrame()
+
+    def run_backtest(self, data, sizing='equal', weights=None, rebalance_every=None, liquidate=True,
+                     **sizing_params):
+        """
+        执行组合回测。
+        data: {交易对: 包含 'Close Price' 与 'Signal' 的 DataFrame}
+        sizing: 仓位规则，见 target_weights ('equal' / 'fixed' / 'inverse_vol')
+        weights: 可选的目标权重 DataFrame (时间 × 交易对)，给定时忽略信号与 sizing
+        rebalance_every: 每隔多少根 K 线按目标权重再平衡一次；None 表示只在权重变化时调仓
+        sizing_params: 传给 target_weights 的参数 (fraction / lookback / exposure)
+        返回: (equity_curve, trades_df)
+        """
+        index, symbols, close = align_panel(data)
+        rebalance = None
+        if rebalance_every:
+            rebalance = np.arange(len(index)) % rebalance_every == 0
+
+        if weights is None:
+            _, _, signal = align_panel(data, 'Signal')
+            w = target_weights(held_from_signals(signal), close, sizing, refresh=rebalance, **sizing_params)
+        else:
+            w = weights.reindex(index=index, columns=symbols).to_numpy(dtype=float)
+        w = np.where(tradable_mask(close), np.nan_to_num(w), 0.0)
+
+        result = simulate_portfolio(close, w, self.initial_capital, self.commission_rate, self.slippage_rate,
+                                    rebalance=rebalance, liquidate=liquidate)
+
+        self.equity_curve = pd.Series(result['equity'], index=index, dtype=float)
+        self.holdings = pd.DataFrame(result['holdings'], index=index, columns=symbols)
+        self.weights = pd.DataFrame(w, index=index, columns=symbols)
+        trades = result['trades']
+        self.trades = pd.DataFrame({
+            'Date': index[trades['bar']],
+            'Symbol': np.asarray(symbols, dtype=object)[trades['asset']],
+            'Type': np.where(trades['quantity'] > 0, 'BUY', 'SELL'),
+            'Price': trades['price'],
+            'Amount': np.abs(trades['quantity']),
+            'Commission': trades['commission'],
+            'Slippage': trades['slippage'],
+        })
+        self.attribution = attribution(close, result['holdings'], trades, symbols, self.initial_capital)
+        return self.equity_curve, self.trades
+
+    def analyze_performance(self):
+        """
+        组合的绩效指标 (见 analytics.performance)，exposure 为持有任一资产的 K 线占比。
+        """
+        equity = self.equity_curve.to_numpy(dtype=float)
+        metrics = {'initial_capital': self.initial_capital,
+                   'final_capital': float(equity[-1]) if len(equity) else self.initial_capital}
+        if len(equity) > 1:
+            metrics.update(performance(equity, infer_periods_per_year(self.equity_curve.index.values),
+                                       exposure=(self.holdings.to_numpy() != 0).any(axis=1)))
+        return metrics
+
+
+if __name__ == '__main__':
+    import glob
+    import json
+    import os
+    import time
+
+    from analytics import format_metrics
+    from runner import make_jobs, prepare_data
+
+    with open('config.json', 'r') as f:
+        config = json.load(f)
+
+    paths = sorted(glob.glob('../data/4hour/*_4h.csv'))
+    tokens = [os.path.basename(p).split('_')[0] for p in paths]
+    jobs = make_jobs(tokens, ['4h'], {'macd': config['strategy_params']['macd']}, {'4h': '../data/4hour'},
+                     config['initial_capital'], config['commission_rate'], config['slippage_rate'])
+    data = {job['symbol']: prepare_data(job) for job in jobs}
+
+    for sizing in SIZING_RULES:
+        backtester = PortfolioBacktester(config['initial_capital'], config['commission_rate'],
+                                         config['slippage_rate'])
+        t0 = time.perf_counter()
+        equity_curve, trades_df = backtester.run_backtest(data, sizing=sizing)
+        elapsed = time.perf_counter() - t0
+        print(f"\n--- {sizing}: {len(data)} assets x {len(equity_curve)} bars in {elapsed * 1e3:.1f} ms, "
+              f"{len(trades_df)} trades, final equity {equity_curve.iloc[-1]:,.2f} ---")
+        print(backtester.attribution.round(2).to_string())
+        print(format_metrics(backtester.analyze_performance()))
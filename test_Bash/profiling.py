@@ -0,0 +1,230 @@
+import contextlib
+import json
+import os
+import threading
+import time
+
+# 流水线的性能埋点：各阶段用 span('名称') 计时，count('名称') 计数，结果为 Chrome trace 格式的事件
+# (chrome://tracing 或 https://ui.perfetto.dev 打开)。工作进程把自己的事件随结果返回，主进程合并到同一份 trace，
+# 每个进程一条泳道。可选按任务 cProfile (.prof 文件，用 pstats / snakeviz 查看) 与内存高水位 (ru_maxrss)。
+# 没有调用 enable() 时 span 返回同一个空上下文、count 直接返回，埋点几乎没有开销。
+
+# 当前进程的 trace，未开启时为 None
+_trace = None
+_NULL = contextlib.nullcontext()
+
+
+def _now_us():
+    return time.perf_counter_ns() // 1000
+
+
+def _maxrss_kb():
+    try:
+        import resource
+    except ImportError: # Windows
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Trace:
+    """
+    一个进程内的事件记录。
+    """
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.events = []
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, start_us, dur_us, args):
+        memory = _maxrss_kb()
+        if memory is not None:
+            args['maxrss_kb'] = memory
+        event = {'name': name, 'ph': 'X', 'ts': start_us, 'dur': dur_us, 'pid': self.pid,
+                 'tid': threading.get_ident() % 1_000_000, 'args': args}
+        with self._lock:
+            self.events.append(event)
+
+    def count(self, name, n):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def export(self):
+        """
+        可 pickle / JSON 的快照 (工作进程随结果返回)。
+        """
+        return {'pid': self.pid, 'events': list(self.events), 'counters': dict(self.counters),
+                'maxrss_kb': _maxrss_kb()}
+
+
+class _Span:
+    __slots__ = ('name', 'args', 'start')
+
+    def __init__(self, name, args):
+        self.name, self.args = name, args
+
+    def __enter__(self):
+        self.start = _now_us()
+        return self
+
+    def __exit__(self, *exc):
+        trace = _trace
+        if trace is not None:
+            trace.add(self.name, self.start, _now_us() - self.start, self.args)
+
+
+def enabled():
+    """
+    当前进程是否开启了埋点 (fork 出的工作进程继承的主进程 trace 不算)。
+    """
+    return _trace is not None and _trace.pid == os.getpid()
+
+
+def enable():
+    """
+    在当前进程开启埋点 (已开启时沿用原来的 trace)。
+    返回: Trace
+    """
+    global _trace
+    if not enabled():
+        _trace = Trace()
+    return _trace
+
+
+def disable():
+    """
+    关闭埋点。
+    返回: 关闭前的 Trace (没有开启时为 None)
+    """
+    global _trace
+    trace, _trace = _trace, None
+    return trace
+
+
+def span(name, **args):
+    """
+    计时上下文：with span('indicators', symbol='BTCUSDT'): ...
+    未开启时返回共享的空上下文。
+    """
+    if _trace is None:
+        return _NULL
+    return _Span(name, args)
+
+
+def count(name, n=1):
+    """
+    累加计数器 (如解析的 CSV 行数、结果库命中次数)。
+    """
+    if _trace is not None:
+        _trace.count(name, n)
+
+
+@contextlib.contextmanager
+def capture(options, label):
+    """
+    在工作进程中包住一个任务：options 为 None 时什么都不做；否则开启埋点 (当前进程已开启时沿用)，
+    按 options['profile_dir'] 运行 cProfile，结束时把本进程新开启的 trace 导出到 yield 的 dict 中。
+    options: {'profile_dir': 目录或 None}
+    label: 任务名称，用作 span 名称与 .prof 文件名
+    """
+    out = {}
+    if options is None:
+        yield out
+        return
+    owner = not enabled()
+    trace = enable()
+    profile_dir = options.get('profile_dir')
+    profiler = None
+    if profile_dir:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        with span('job', label=label):
+            yield out
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(profile_dir, exist_ok=True)
+            path = os.path.join(profile_dir, f"{label}.prof")
+            profiler.dump_stats(path)
+            trace.events[-1]['args']['profile'] = path
+        if owner:
+            out.update(disable().export())
+
+
+def merge(exported):
+    """
+    把工作进程导出的 trace 合并到当前进程的 trace 中 (事件保留各自的 pid，计数器相加)。
+    """
+    trace = _trace
+    if trace is None or not exported:
+        return
+    with trace._lock:
+        trace.events.extend(exported['events'])
+        for name, n in exported['counters'].items():
+            trace.counters[name] = trace.counters.get(name, 0) + n
+
+
+def summary(trace=None):
+    """
+    按阶段汇总：次数、总耗时、平均与最大耗时 (毫秒)，以及内存高水位 (MB)。
+    返回: DataFrame，按总耗时降序
+    """
+    import pandas as pd
+
+    trace = trace or _trace
+    frame = pd.DataFrame([(e['name'], e['dur'] / 1000, e['args'].get('maxrss_kb', 0) / 1024) for e in trace.events],
+                         columns=['stage', 'ms', 'maxrss_mb'])
+    table = frame.groupby('stage').agg(calls=('ms', 'size'), total_ms=('ms', 'sum'), mean_ms=('ms', 'mean'),
+                                       max_ms=('ms', 'max'), maxrss_mb=('maxrss_mb', 'max'))
+    return table.sort_values('total_ms', ascending=False)
+
+
+def write_chrome_trace(path, trace=None):
+    """
+    写出 Chrome trace JSON (事件 + 计数器)，计数器另外放在 'otherData' 中便于脚本读取。
+    """
+    trace = trace or _trace
+    events = list(trace.events)
+    end = max((e['ts'] + e['dur'] for e in events), default=_now_us())
+    events += [{'name': name, 'ph': 'C', 'ts': end, 'pid': trace.pid, 'args': {name: n}}
+               for name, n in trace.counters.items()]
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms',
+                   'otherData': {'counters': trace.counters, 'maxrss_kb': _maxrss_kb()}}, f)
+    return path
+
+
+if __name__ == '__main__':
+    # 以脚本运行时本模块是 __main__，其他模块导入的是 profiling，开关要作用在后者上
+    import profiling
+    from runner import make_jobs, run_jobs
+
+    with open('config.json', 'r') as f:
+        config = json.load(f)
+    jobs = make_jobs(config['tokens'], ['1d', '4h'], {'macd': {}, 'rsi': {}}, config['data_paths'],
+                     config['initial_capital'], 0.0, 0.0)
+
+    # 关闭时的开销：空上下文的进入 / 退出
+    n = 1_000_000
+    t0 = time.perf_counter()
+    for _ in range(n):
+        with profiling.span('noop'):
+            pass
+    print(f"disabled span: {(time.perf_counter() - t0) / n * 1e9:.0f} ns per call")
+
+    run_jobs(jobs) # 预热：列式缓存与进程内缓存
+    for label, traced in (('off', False), ('on', True)):
+        t0 = time.perf_counter()
+        run_jobs(jobs, trace={} if traced else None)
+        print(f"tracing {label}: {len(jobs)} jobs in {(time.perf_counter() - t0) * 1e3:.1f} ms")
+    print(f"disabled after run_jobs: {not profiling.enabled()}")
+
+    trace = profiling.enable()
+    run_jobs(jobs, trace={})
+    print(profiling.summary().round(2).to_string())
+    print(f"counters: {trace.counters}")
+    print(f"trace written to {profiling.write_chrome_trace('../output/trace.json')}")
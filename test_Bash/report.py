@@ -0,0 +1,207 @@
+import html
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import profiling
+from analytics import format_metrics
+from result_plot import trade_points
+
+# 无界面的报告生成：主进程只把资金曲线、回撤、价格等序列用 LTTB 降采样到几千个点，
+# 打包成只含 NumPy 数组的小字典；工作进程以 Agg 后端导入 matplotlib 绘图，
+# 把 PNG 与 HTML 写到 output/。不生成报告时整个流程不会导入 matplotlib / seaborn。
+
+REPORT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'output', 'reports')
+MAX_POINTS = 2000 # 16 英寸宽的图上每个像素约一个点，再多看不出差别
+
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets 降采样：保留首尾两点，其余点均分为 threshold - 2 个桶，
+    每个桶取与 "上一个选中点" 和 "下一个桶均值" 构成三角形面积最大的点，峰谷等形状特征得以保留。
+    x, y: 一维数组 (x 单调递增，不含 NaN)
+    返回: 选中点的下标 (升序)；threshold >= len(y) 或 threshold < 3 时返回全部下标
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    # 桶边界；最后一个桶的 "下一个桶" 是最后一个点
+    edges = np.append(np.linspace(1, n - 1, threshold - 1).astype(np.int64), n)
+    csx = np.concatenate(([0.0], np.cumsum(x)))
+    csy = np.concatenate(([0.0], np.cumsum(y)))
+    counts = np.diff(edges)
+    avg_x = (csx[edges[2:]] - csx[edges[1:-1]]) / counts[1:]
+    avg_y = (csy[edges[2:]] - csy[edges[1:-1]]) / counts[1:]
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        xa, ya = x[a], y[a]
+        area = np.abs((xa - avg_x[i]) * (y[lo:hi] - ya) - (xa - x[lo:hi]) * (avg_y[i] - ya))
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def downsample(series, max_points=MAX_POINTS):
+    """
+    对时间索引的 Series 做 LTTB 降采样 (NaN 先去掉)。
+    返回: pd.Series
+    """
+    series = series.dropna()
+    if len(series) <= max_points:
+        return series
+    x = series.index.values.astype('datetime64[ns]').view(np.int64)
+    return series.iloc[lttb(x, series.to_numpy(dtype=float), max_points)]
+
+
+def _pack(series):
+    # 只传递两个数组，工作进程不需要反序列化 pandas 对象
+    return (series.index.values.astype('datetime64[ns]').view(np.int64), series.to_numpy(dtype=float))
+
+
+def _unpack(packed):
+    times, values = packed
+    return pd.Series(values, index=pd.DatetimeIndex(times.view('datetime64[ns]')))
+
+
+def report_payload(equity_curve, data_with_signals, performance_metrics, token, strategy_name, interval='',
+                   max_points=MAX_POINTS):
+    """
+    在主进程中准备一份报告的数据：回撤在完整资金曲线上计算后再降采样，买卖点全部保留。
+    返回: dict，可 pickle 后交给 render_report
+    """
+    peak = equity_curve.cummax()
+    payload = {
+        'token': token, 'interval': interval, 'strategy': strategy_name,
+        'metrics': dict(performance_metrics or {}),
+        'bars': len(equity_curve),
+        'equity': _pack(downsample(equity_curve, max_points)),
+        'drawdown': _pack(downsample((equity_curve - peak) / peak, max_points)),
+        'lines': {}, 'buys': None, 'sells': None,
+    }
+    if data_with_signals is not None and not data_with_signals.empty:
+        for col in ('Close Price', 'MACD', 'MACD_Signal'):
+            if col in data_with_signals.columns:
+                payload['lines'][col] = _pack(downsample(data_with_signals[col], max_points))
+        close = data_with_signals['Close Price']
+        buys, sells = trade_points(data_with_signals['Signal'])
+        payload['buys'], payload['sells'] = _pack(close.loc[buys]), _pack(close.loc[sells])
+    return payload
+
+
+def report_name(payload):
+    parts = [payload['token'], payload['interval'], payload['strategy']]
+    return '_'.join(p for p in parts if p)
+
+
+def _html(payload, images):
+    title = html.escape(f"{payload['token']} {payload['interval']} - {payload['strategy'].upper()}".strip())
+    rows = ''.join(f"<tr><th>{html.escape(str(k))}</th><td>{html.escape(str(v))}</td></tr>"
+                   for k, v in format_metrics(payload['metrics']).items())
+    figures = ''.join(f'<p><img src="{html.escape(name)}" style="max-width:100%"></p>' for name in images)
+    return (f"<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>{title}</title></head>\n"
+            f"<body><h1>{title}</h1>\n<p>{payload['bars']} bars</p>\n"
+            f"<table border=\"1\" cellpadding=\"4\">{rows}</table>\n{figures}\n</body></html>\n")
+
+
+def render_report(payload, out_dir=REPORT_DIR, dpi=100):
+    """
+    绘制一份报告 (工作进程入口)：equity.png、signals.png 与 report.html 写入 out_dir/<名称>/。
+    返回: report.html 的路径
+    """
+    from result_plot import setup_matplotlib, equity_figure, signal_figure
+
+    plt = setup_matplotlib('Agg')
+    target = os.path.join(out_dir, report_name(payload))
+    os.makedirs(target, exist_ok=True)
+    images = []
+
+    fig = equity_figure(plt, _unpack(payload['equity']), payload['token'], payload['strategy'],
+                        drawdown=_unpack(payload['drawdown']))
+    fig.savefig(os.path.join(target, 'equity.png'), dpi=dpi)
+    plt.close(fig)
+    images.append('equity.png')
+
+    if 'Close Price' in payload['lines']:
+        lines = {col: _unpack(packed) for col, packed in payload['lines'].items()}
+        fig = signal_figure(plt, lines, _unpack(payload['buys']), _unpack(payload['sells']),
+                            payload['token'], payload['strategy'])
+        fig.savefig(os.path.join(target, 'signals.png'), dpi=dpi)
+        plt.close(fig)
+        images.append('signals.png')
+
+    path = os.path.join(target, 'report.html')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(_html(payload, images))
+    return path
+
+
+def write_index(paths, out_dir=REPORT_DIR):
+    """
+    生成 out_dir/index.html，链接到各份报告。
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    links = ''.join(f'<li><a href="{html.escape(os.path.relpath(p, out_dir))}">'
+                    f'{html.escape(os.path.basename(os.path.dirname(p)))}</a></li>' for p in paths)
+    index = os.path.join(out_dir, 'index.html')
+    with open(index, 'w', encoding='utf-8') as f:
+        f.write(f"<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>Backtest reports</title></head>\n"
+                f"<body><h1>Backtest reports</h1>\n<ul>{links}</ul>\n</body></html>\n")
+    return index
+
+
+def render_reports(payloads, out_dir=REPORT_DIR, max_workers=None):
+    """
+    用进程池并行绘制多份报告，并生成索引页。
+    max_workers: 进程数，默认 CPU 核数；为 1 时在当前进程顺序执行
+    返回: index.html 的路径；没有报告时返回 None
+    """
+    if not payloads:
+        return None
+    max_workers = max_workers or min(len(payloads), os.cpu_count() or 1)
+    profiling.count('reports', len(payloads))
+    if max_workers == 1:
+        paths = []
+        for p in payloads:
+            with profiling.span('render_report', report=report_name(p)):
+                paths.append(render_report(p, out_dir))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            paths = list(pool.map(render_report, payloads, [out_dir] * len(payloads)))
+    return write_index(paths, out_dir)
+
+
+if __name__ == '__main__':
+    import json
+    import sys
+    import time
+
+    from runner import make_jobs, run_jobs, prepare_data
+
+    with open('config.json', 'r') as f:
+        config = json.load(f)
+
+    jobs = make_jobs(config['tokens'], ['1d', '4h'], {'macd': config['strategy_params']['macd']},
+                     config['data_paths'], config['initial_capital'], 0.0, 0.0)
+    results = run_jobs(jobs)
+    t0 = time.perf_counter()
+    payloads = []
+    for job, result in zip(jobs, results):
+        if 'error' in result:
+            continue
+        equity_curve = pd.Series(result['equity'], index=pd.to_datetime(result['equity_index']))
+        payloads.append(report_payload(equity_curve, prepare_data(job), result['metrics'], job['symbol'],
+                                       job['strategy'], job['interval']))
+    t1 = time.perf_counter()
+    # 准备数据包不需要 matplotlib，只有绘图的进程才导入
+    print(f"matplotlib imported before rendering: {'matplotlib' in sys.modules}")
+    index = render_reports(payloads)
+    print(f"{len(payloads)} reports: payloads {t1 - t0:.2f}s, rendering {time.perf_counter() - t1:.2f}s -> {index}")
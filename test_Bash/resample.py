@@ -0,0 +1,237 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from data_store import OHLCV_COLUMNS, load_arrays, data_fingerprint, sidecar_path, _write_atomic
+from day_data import interval_to_ns, _interval_origin
+
+# 多周期重采样：由本地最细的 K 线 (如 4h) 精确聚合出 1d / 1w 等更粗的周期，
+# 开 = 第一根的开盘价，高 / 低 = 区间最高 / 最低，收 = 最后一根的收盘价，量 = 成交量之和。
+# 聚合结果按源文件内容哈希缓存在列式缓存目录中 (resample_<周期>_*.npy)，源文件变化后自动重建。
+# aligned() 把粗周期的数据对齐到细周期的每根 K 线上：只使用在该 K 线收盘时已经收盘的粗周期 K 线，没有未来函数。
+# 回测任务的参数给出 'timeframes': ['1d', '1w'] 时，runner.prepare_data 用 multi_timeframe 加入这些列，
+# 规则中写 close_1d / column('Close Price_1w') 引用。
+
+RESAMPLE_VERSION = 1
+
+# 进程内缓存: (csv 路径, 周期) -> (源文件哈希, time, ohlcv, count)
+_resampled = {}
+
+
+def source_interval(csv_path):
+    """
+    由文件名 <SYMBOL>_<interval>.csv 得到源数据的周期，如 'BTCUSDT_4h.csv' -> '4h'。
+    """
+    interval = os.path.splitext(os.path.basename(csv_path))[0].rsplit('_', 1)[-1]
+    interval_to_ns(interval) # 校验格式
+    return interval
+
+
+def resample_arrays(times, ohlcv, interval, source=None):
+    """
+    把 K 线聚合到更粗的周期 interval (网格与币安一致：日线从 00:00 UTC 开始，周线从周一开始)。
+    times: int64 纳秒开盘时间 (升序)；ohlcv: (5, n) float64，行顺序与 OHLCV_COLUMNS 一致
+    source: 源数据周期，用于校验 interval 是它的整数倍；None 时不校验
+    返回: (time, ohlcv, count)，count 为每根粗周期 K 线包含的源 K 线数
+    """
+    step = interval_to_ns(interval)
+    if source is not None and step % interval_to_ns(source):
+        raise ValueError(f"{interval} is not a multiple of {source}")
+    times = np.asarray(times, dtype=np.int64)
+    ohlcv = np.asarray(ohlcv, dtype=np.float64)
+    if len(times) == 0:
+        return np.empty(0, dtype=np.int64), np.empty((5, 0)), np.empty(0, dtype=np.int64)
+
+    origin = _interval_origin(interval)
+    bucket = (times - origin) // step
+    starts = np.flatnonzero(np.concatenate(([True], bucket[1:] != bucket[:-1])))
+    ends = np.append(starts[1:], len(times)) - 1
+    out = np.empty((5, len(starts)))
+    out[0] = ohlcv[0, starts]
+    out[1] = np.maximum.reduceat(ohlcv[1], starts)
+    out[2] = np.minimum.reduceat(ohlcv[2], starts)
+    out[3] = ohlcv[3, ends]
+    out[4] = np.add.reduceat(ohlcv[4], starts)
+    return bucket[starts] * step + origin, out, np.diff(np.append(starts, len(times)))
+
+
+def _cache_paths(csv_path, interval):
+    return {name: sidecar_path(csv_path, f'resample_{interval}_{name}')
+            for name in ('time.npy', 'ohlcv.npy', 'count.npy', 'meta.json')}
+
+
+def _read_cache(paths, digest):
+    try:
+        with open(paths['meta.json'], 'r') as f:
+            meta = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if meta.get('version') != RESAMPLE_VERSION or meta.get('source_sha1') != digest:
+        return None
+    return tuple(np.load(paths[name], mmap_mode='r') for name in ('time.npy', 'ohlcv.npy', 'count.npy'))
+
+
+def resampled_arrays(csv_path, interval):
+    """
+    读取 csv_path 聚合到 interval 的 K 线 (缓存有效时直接以内存映射读取，否则聚合后写入缓存)。
+    返回: (time, ohlcv, count)，见 resample_arrays；包含首尾不完整的 K 线
+    """
+    key = (os.path.abspath(csv_path), interval)
+    digest = data_fingerprint(csv_path)
+    cached = _resampled.get(key)
+    if cached is not None and cached[0] == digest:
+        return cached[1:]
+
+    paths = _cache_paths(csv_path, interval)
+    arrays = _read_cache(paths, digest)
+    if arrays is None:
+        times, ohlcv = load_arrays(csv_path)
+        arrays = resample_arrays(times, ohlcv, interval, source_interval(csv_path))
+        for name, values in zip(('time.npy', 'ohlcv.npy', 'count.npy'), arrays):
+            _write_atomic(paths[name], lambda f, v=values: np.save(f, v))
+        # meta 最后写入，作为缓存有效的标记
+        meta = {'version': RESAMPLE_VERSION, 'source': os.path.basename(csv_path), 'source_sha1': digest,
+                'interval': interval, 'rows': int(len(arrays[0]))}
+        _write_atomic(paths['meta.json'], lambda f: f.write(json.dumps(meta, indent=2).encode('utf-8')))
+    _resampled[key] = (digest,) + tuple(arrays)
+    return arrays
+
+
+def load_resampled(csv_path, interval, complete_only=True):
+    """
+    读取聚合后的 K 线为 DataFrame，格式与 data_store.load_klines 相同。
+    complete_only: 只保留包含完整数量源 K 线的 K 线 (去掉数据首尾不完整的周期，以及中间缺数据的周期)
+    """
+    times, ohlcv, count = resampled_arrays(csv_path, interval)
+    keep = slice(None)
+    if complete_only:
+        keep = count == interval_to_ns(interval) // interval_to_ns(source_interval(csv_path))
+    index = pd.DatetimeIndex(np.asarray(times)[keep].view('datetime64[ns]'), name='Open Time')
+    return pd.DataFrame({col: np.asarray(ohlcv[i])[keep] for i, col in enumerate(OHLCV_COLUMNS)}, index=index)
+
+
+def align(base_times, base_interval, times, interval, values):
+    """
+    把粗周期的数值对齐到细周期的每根 K 线，不引入未来数据：
+    细周期 K 线在 t + base_step 收盘时，只能看到收盘时间 T + step <= t + base_step 的粗周期 K 线。
+    base_times / times: 两个周期的开盘时间 (int64 纳秒，升序)
+    values: 与 times 等长的数组 (或 (k, len(times)) 的多行数组)
+    返回: 与 base_times 等长 (最后一维) 的 float64 数组，此前还没有收盘的粗周期 K 线时为 NaN
+    """
+    base_close = np.asarray(base_times, dtype=np.int64) + interval_to_ns(base_interval)
+    close = np.asarray(times, dtype=np.int64) + interval_to_ns(interval)
+    idx = np.searchsorted(close, base_close, side='right') - 1
+    values = np.asarray(values, dtype=np.float64)
+    out = values[..., np.maximum(idx, 0)]
+    out[..., idx < 0] = np.nan
+    return out
+
+
+def multi_timeframe(csv_path, intervals=('1d', '1w'), columns=OHLCV_COLUMNS, complete_only=True):
+    """
+    策略用的多周期视图：源周期 K 线加上各粗周期对齐后的列 (列名 '<列>_<周期>'，如 'Close Price_1d')。
+    每一行只包含在该行 K 线收盘时已经收盘的粗周期数据，可以直接与源周期的信号组合。
+    返回: DataFrame，索引与 load_klines(csv_path) 相同
+    """
+    base = source_interval(csv_path)
+    times, ohlcv = load_arrays(csv_path)
+    index = pd.DatetimeIndex(np.asarray(times).view('datetime64[ns]'), name='Open Time')
+    frame = {col: np.asarray(ohlcv[i]) for i, col in enumerate(OHLCV_COLUMNS)}
+    for interval in intervals:
+        coarse = load_resampled(csv_path, interval, complete_only)
+        coarse_times = coarse.index.values.view(np.int64)
+        aligned = align(times, base, coarse_times, interval, coarse[list(columns)].to_numpy().T)
+        for i, col in enumerate(columns):
+            frame[f'{col}_{interval}'] = aligned[i]
+    return pd.DataFrame(frame, index=index)
+
+
+def compare(csv_path, reference_path, interval=None, volume_rtol=1e-6):
+    """
+    把 csv_path 聚合出的 K 线与另外下载的 reference_path (如 data/day 下的日线) 逐根比较。
+    只比较两边都有、且聚合结果完整的 K 线；价格要求完全相等，成交量允许 volume_rtol 的相对误差
+    (交易所给出的日成交量与 4h 成交量之和在十进制下相等，转成 float 后可能差几个 ulp)。
+    返回: dict，各列不一致的 K 线数、仅一边有的 K 线数，以及第一处不一致的时间
+    """
+    interval = interval or source_interval(reference_path)
+    ours = load_resampled(csv_path, interval)
+    ref_times, ref = load_arrays(reference_path)
+    ref_times = np.asarray(ref_times)
+    our_times = ours.index.values.view(np.int64)
+    common, i, j = np.intersect1d(our_times, ref_times, return_indices=True)
+
+    # 参考文件覆盖的时间范围内，聚合结果完整但参考文件缺少的 K 线，以及反过来
+    lo, hi = max(our_times[:1].max(initial=0), ref_times[:1].max(initial=0)), \
+        min(our_times[-1:].min(initial=0), ref_times[-1:].min(initial=0))
+    in_range = lambda t: t[(t >= lo) & (t <= hi)]
+    result = {'interval': interval, 'compared': len(common),
+              'missing_in_reference': len(np.setdiff1d(in_range(our_times), ref_times)),
+              'missing_in_source': len(np.setdiff1d(in_range(ref_times), our_times))}
+    first = None
+    for row, col in enumerate(OHLCV_COLUMNS):
+        a, b = ours[col].to_numpy()[i], np.asarray(ref[row])[j]
+        if col == 'Volume':
+            bad = ~np.isclose(a, b, rtol=volume_rtol, atol=0)
+        else:
+            bad = a != b
+        result[f'{col} mismatches'] = int(bad.sum())
+        if bad.any():
+            t = int(common[np.argmax(bad)])
+            first = t if first is None else min(first, t)
+    result['first_mismatch'] = pd.Timestamp(first) if first is not None else None
+    return result
+
+
+if __name__ == '__main__':
+    import argparse
+    import glob
+    import time
+
+    parser = argparse.ArgumentParser(description="Resample 4h klines and check them against the daily downloads")
+    parser.add_argument('--source', default='../data/4hour')
+    parser.add_argument('--reference', default='../data/day')
+    args = parser.parse_args()
+
+    rows = []
+    for path in sorted(glob.glob(os.path.join(args.source, '*_4h.csv'))):
+        symbol = os.path.basename(path).split('_')[0]
+        reference = os.path.join(args.reference, f'{symbol}_1d.csv')
+        if not os.path.exists(reference):
+            continue
+        t0 = time.perf_counter()
+        for interval in ('1d', '1w'):
+            resampled_arrays(path, interval)
+        elapsed = time.perf_counter() - t0
+        rows.append(dict(symbol=symbol, resample_s=elapsed, **compare(path, reference)))
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(pd.DataFrame(rows).to_string(index=False))
+
+    # 多周期视图示例：4h MACD 金叉，只在日线收盘价位于日线 20 日均线之上时入场
+    from indicators import macd, sma
+
+    view = multi_timeframe(os.path.join(args.source, 'BTCUSDT_4h.csv'), intervals=('1d',))
+    daily = load_resampled(os.path.join(args.source, 'BTCUSDT_4h.csv'), '1d')
+    trend = align(view.index.values.view(np.int64), '4h', daily.index.values.view(np.int64), '1d',
+                  daily['Close Price'].to_numpy() > sma(daily['Close Price'].to_numpy(), 20))
+    hist = macd(view['Close Price'].to_numpy())[2]
+    cross = (hist > 0) & (np.concatenate(([np.nan], hist[:-1])) <= 0)
+    print(f"\nBTCUSDT 4h MACD crosses: {int(cross.sum())}, with daily trend filter: {int((cross & (trend == 1)).sum())}")
+    print(view.tail(8).to_string())
+
+    # 同样的过滤写成规则，由回测任务的 'timeframes' 参数提供日线列 (sma 按 4h K 线计算，120 根约 20 天)
+    from runner import make_jobs, run_jobs
+
+    exit_rule = 'cross_down(macd_hist(close, 12, 26, 9), 0)'
+    strategies = {
+        'macd_hist': {'rules': {'buy': 'cross_up(macd_hist(close, 12, 26, 9), 0)', 'sell': exit_rule}},
+        'macd_hist_1d_trend': {'rules': {'buy': 'cross_up(macd_hist(close, 12, 26, 9), 0)'
+                                                ' and close_1d > sma(close_1d, 120)',
+                                         'sell': exit_rule},
+                               'timeframes': ['1d']},
+    }
+    jobs = make_jobs(['BTCUSDT'], ['4h'], strategies, {'4h': args.source}, 10000, 0.0, 0.0)
+    for result in run_jobs(jobs, max_workers=1):
+        print(f"{result['strategy']:20s} trades {result['metrics']['trades']:4.0f}  "
+              f"final {result['metrics']['final_capital']:12,.2f}")
@@ -1,17 +1,20 @@
-import matplotlib.pyplot as plt
-import seaborn as sns
 import pandas as pd
-import matplotlib as mpl
 
-def plot_results(equity_curve, data_with_signals, performance_metrics, token, strategy_name):
+from analytics import format_metrics
+
+
+def setup_matplotlib(backend=None):
     """
-    绘制回测结果和策略信号。
-    equity_curve: 资金曲线 Series
-    data_with_signals: 包含价格和信号的 DataFrame
-    performance_metrics: 绩效指标字典
-    token: 交易对名称
-    strategy_name: 策略名称
+    导入 matplotlib 并设置字体与样式 (只在真正绘图时导入，批量回测不承担导入开销)。
+    backend: 如 'Agg' (无界面，只保存文件)；None 时使用默认后端
+    返回: matplotlib.pyplot
     """
+    import matplotlib as mpl
+    if backend:
+        mpl.use(backend)
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
     # 确保使用英文友好字体
     mpl.rcParams['font.family'] = 'sans-serif'
     mpl.rcParams['font.sans-serif'] = ['Arial', 'Helvetica', 'DejaVu Sans', 'Liberation Sans', 'Bitstream Vera Sans']
@@ -19,8 +22,16 @@ def plot_results(equity_curve, data_with_signals, performance_metrics, token, st
 
     sns.set_style("whitegrid")
     plt.style.use("seaborn-v0_8-darkgrid")
+    return plt
 
-    # --- Plot 1: Equity Curve ---
+
+def equity_figure(plt, equity_curve, token, strategy_name, drawdown=None):
+    """
+    资金曲线 + 回撤图。
+    drawdown: 可选的回撤序列 (负数比例)；None 时由 equity_curve 计算。
+              equity_curve 经过降采样时应传入在完整序列上计算后再降采样的回撤，避免漏掉最深处
+    返回: Figure
+    """
     fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(16, 12), sharex=True, gridspec_kw={'height_ratios': [2, 1]})
 
     ax1.plot(equity_curve.index, equity_curve, label='Equity Curve', color='purple', linewidth=2)
@@ -30,8 +41,9 @@ def plot_results(equity_curve, data_with_signals, performance_metrics, token, st
     ax1.legend(loc='upper left', fontsize=12)
 
     # Plot drawdown below equity curve
-    peak = equity_curve.expanding(min_periods=1).max()
-    drawdown = (equity_curve - peak) / peak
+    if drawdown is None:
+        peak = equity_curve.expanding(min_periods=1).max()
+        drawdown = (equity_curve - peak) / peak
     ax2.fill_between(drawdown.index, drawdown, color='red', alpha=0.3)
     ax2.set_title('Drawdown', fontsize=16)
     ax2.set_xlabel('Date', fontsize=14)
@@ -40,54 +52,77 @@ def plot_results(equity_curve, data_with_signals, performance_metrics, token, st
     ax2.yaxis.set_major_formatter(plt.FuncFormatter(lambda y, _: f'{y*100:.0f}%')) # Format to percentage
     ax2.grid(True, linestyle='--', alpha=0.7)
 
+    fig.tight_layout()
+    return fig
 
-    plt.tight_layout()
-    plt.show()
 
-    # --- Plot 2: Price and Signals ---
-    plt.figure(figsize=(16, 8))
-    sns.lineplot(data=data_with_signals['Close Price'], label='Close Price', color='blue', linewidth=1.5)
-    
+def trade_points(signal):
+    """
+    由 'Signal' 列的变化得到买卖点。
+    返回: (buy_index, sell_index)
+    """
+    change = signal.diff()
+    return signal.index[change == 1], signal.index[change == -1]
+
+
+def signal_figure(plt, lines, buys, sells, token, strategy_name):
+    """
+    价格与信号图。
+    lines: {'Close Price': Series, 'MACD': Series, 'MACD_Signal': Series}，MACD 两条线可选
+    buys / sells: 买卖点 Series (索引为时间，值为当时的收盘价)
+    返回: Figure
+    """
+    import seaborn as sns
+
+    fig = plt.figure(figsize=(16, 8))
+    sns.lineplot(data=lines['Close Price'], label='Close Price', color='blue', linewidth=1.5)
+
     # Check if MACD lines exist to plot them
-    if 'MACD' in data_with_signals.columns and 'MACD_Signal' in data_with_signals.columns:
-        sns.lineplot(data=data_with_signals['MACD'], label='MACD', color='orange', linewidth=1)
-        sns.lineplot(data=data_with_signals['MACD_Signal'], label='MACD Signal Line', color='green', linewidth=1)
-
-    # Identify buy/sell points from position changes (data['Signal'].diff())
-    # Assuming `data_with_signals['Signal']` is the daily position (1: long, -1: short, 0: flat)
-    # To plot actual trade points, we need to find where signal changes
-    # For this backtester, 'Signal' is the position, so actual trades happen when position changes
-    # Let's derive trade points from `trades_df` if available, or just plot `Signal` changes
-    
-    # If using the backtester's trade log, we can plot precise trade points
-    # For simplicity here, we'll plot based on changes in `data_with_signals['Signal']` itself.
-    # Note: the backtester logs actual trades, which is more accurate.
-    # To use `trades_df` here, it would need to be passed from `main.py`
-    
-    # For now, let's derive from signal changes for visual consistency with price chart
-    data_with_signals['Trade_Point'] = data_with_signals['Signal'].diff()
-    
-    buy_signals_plot = data_with_signals[data_with_signals['Trade_Point'] == 1]
-    sell_signals_plot = data_with_signals[data_with_signals['Trade_Point'] == -1]
-
-    plt.scatter(buy_signals_plot.index,
-                data_with_signals['Close Price'].loc[buy_signals_plot.index],
-                marker='^', color='green', s=150, label='Buy Signal', alpha=1, zorder=5)
-
-    plt.scatter(sell_signals_plot.index,
-                data_with_signals['Close Price'].loc[sell_signals_plot.index],
-                marker='v', color='red', s=150, label='Sell Signal', alpha=1, zorder=5)
+    if 'MACD' in lines and 'MACD_Signal' in lines:
+        sns.lineplot(data=lines['MACD'], label='MACD', color='orange', linewidth=1)
+        sns.lineplot(data=lines['MACD_Signal'], label='MACD Signal Line', color='green', linewidth=1)
 
+    plt.scatter(buys.index, buys, marker='^', color='green', s=150, label='Buy Signal', alpha=1, zorder=5)
+    plt.scatter(sells.index, sells, marker='v', color='red', s=150, label='Sell Signal', alpha=1, zorder=5)
 
     plt.title(f'{token} - {strategy_name.upper()} Strategy Signals on Price Chart', fontsize=18)
     plt.xlabel('Date', fontsize=14)
     plt.ylabel('Price', fontsize=14)
     plt.legend(loc='upper left', fontsize=12)
     plt.grid(True, linestyle='--', alpha=0.7)
-    plt.tight_layout()
+    fig.tight_layout()
+    return fig
+
+
+def print_metrics(performance_metrics):
+    print("\n--- Performance Metrics ---")
+    for key, value in format_metrics(performance_metrics or {}).items():
+        print(f"{key}: {value}")
+
+
+def plot_results(equity_curve, data_with_signals, performance_metrics, token, strategy_name):
+    """
+    交互式绘制回测结果和策略信号 (plt.show() 会阻塞，批量运行请使用 report.render_reports)。
+    equity_curve: 资金曲线 Series
+    data_with_signals: 包含价格和信号的 DataFrame
+    performance_metrics: 绩效指标字典
+    token: 交易对名称
+    strategy_name: 策略名称
+    """
+    plt = setup_matplotlib()
+
+    # --- Plot 1: Equity Curve ---
+    equity_figure(plt, equity_curve, token, strategy_name)
+    plt.show()
+
+    # --- Plot 2: Price and Signals ---
+    # Trade points are derived from position changes in 'Signal' (the backtester's trade log is more precise)
+    close = data_with_signals['Close Price']
+    buys, sells = trade_points(data_with_signals['Signal'])
+    lines = {col: data_with_signals[col] for col in ('Close Price', 'MACD', 'MACD_Signal')
+             if col in data_with_signals.columns}
+    signal_figure(plt, lines, close.loc[buys], close.loc[sells], token, strategy_name)
     plt.show()
 
     # --- Print Performance Metrics ---
-    print("\n--- Performance Metrics ---")
-    for key, value in performance_metrics.items():
-        print(f"{key}: {value}")
\ No newline at end of file
+    print_metrics(performance_metrics)
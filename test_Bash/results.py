@@ -0,0 +1,247 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+from analytics import METRIC_NAMES, TRADE_METRIC_NAMES
+from backtester import ENGINE_VERSION, TRADE_DTYPE
+from data_store import data_fingerprint
+from strategy import Strategy
+
+# 回测结果库 (SQLite 单文件)：键为 (数据指纹, 策略, 参数, 实际求值的规则, 成本模型, 引擎版本, 计算代码) 的内容哈希，
+# 相同输入的回测直接从库中取出，不再计算。指标各占一列，可以按指标查询历史结果；
+# 资金曲线与成交记录以原始字节保存在同一行。总大小超过预算时按最近使用时间淘汰。
+# 计算代码 (CODE_MODULES) 的源码变化时旧结果自动失效；backtester.ENGINE_VERSION 仍在键中，递增它可使全部结果失效。
+
+RESULTS_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'output', 'results.sqlite')
+DEFAULT_BUDGET = 512 * 1024 * 1024
+# 计算代码：数据准备 (多周期列、预热期)、指标、规则语言与信号、回测引擎 (向量化 / 编译 / 成交模型 / 杠杆) 与指标统计
+CODE_MODULES = ('runner.py', 'resample.py', 'indicators.py', 'rules.py', 'strategy.py', 'backtester.py', 'kernels.py',
+                'execution.py', 'margin.py', 'analytics.py')
+# code_fingerprint 的进程内缓存
+_code_fingerprint = None
+
+# 指标列 (按指标查询与排序)
+METRIC_COLUMNS = ('final_capital',) + METRIC_NAMES + ('exposure',) + TRADE_METRIC_NAMES
+# 标识列
+KEY_COLUMNS = ('symbol', 'interval', 'strategy', 'params', 'engine')
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS runs (
+    key TEXT PRIMARY KEY,
+    {', '.join(f'{name} TEXT' for name in KEY_COLUMNS)},
+    spec TEXT,
+    {', '.join(f'{name} REAL' for name in METRIC_COLUMNS)},
+    metrics TEXT,
+    equity_data BLOB,
+    equity_index_data BLOB,
+    trades_data BLOB,
+    size INTEGER,
+    created REAL,
+    accessed REAL
+);
+CREATE INDEX IF NOT EXISTS runs_accessed ON runs (accessed);
+"""
+
+
+def job_engine(job):
+    """
+    任务使用的回测引擎名称 (与 runner.run_job 的选择一致)。
+    """
+    return 'margin' if job.get('margin') else 'execution' if job.get('execution') else 'vectorized'
+
+
+def code_fingerprint():
+    """
+    决定回测结果的源码 (CODE_MODULES) 的 sha1；其中任何一个修改后旧结果随之失效。
+    """
+    global _code_fingerprint
+    if _code_fingerprint is None:
+        h = hashlib.sha1()
+        for module in CODE_MODULES:
+            with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), module), 'rb') as f:
+                h.update(f.read())
+        _code_fingerprint = h.hexdigest()
+    return _code_fingerprint
+
+
+def run_spec(job):
+    """
+    决定回测结果的全部输入：数据指纹、策略与参数、实际求值的规则 (内置策略的规则与合并默认值后的参数)、
+    成本模型、引擎与版本、计算代码的指纹 (见 code_fingerprint)。
+    """
+    rules, params = Strategy(job['strategy'], job['params']).rules()
+    return {
+        'data': data_fingerprint(job['csv_path']),
+        'strategy': job['strategy'],
+        'params': job['params'],
+        'rules': {'rules': rules, 'params': params},
+        'code': code_fingerprint(),
+        'costs': {key: job.get(key) for key in ('initial_capital', 'commission_rate', 'slippage_rate',
+                                                'execution', 'margin')},
+        'engine': [job_engine(job), ENGINE_VERSION],
+    }
+
+
+def run_key(job):
+    """
+    任务的内容哈希 (run_spec 的规范 JSON 的 sha1)。
+    """
+    text = json.dumps(run_spec(job), sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def _metric_value(value):
+    value = float(value)
+    return None if np.isnan(value) else value
+
+
+class ResultStore:
+    """
+    回测结果库。
+    path: SQLite 文件路径，目录不存在时自动创建
+    budget: 磁盘预算 (字节)，put 之后超出时淘汰最久未使用的结果；None 表示不限制
+    """
+
+    def __init__(self, path=RESULTS_DB, budget=DEFAULT_BUDGET):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.budget = budget
+        self._db = sqlite3.connect(path)
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
+
+    def get(self, key):
+        """
+        按键取出结果，格式与 runner.run_job 相同 (另有 'cached': True)；不存在时返回 None。
+        """
+        row = self._db.execute(
+            "SELECT symbol, interval, strategy, params, metrics, equity_data, equity_index_data, trades_data "
+            "FROM runs WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self._db.execute("UPDATE runs SET accessed = ? WHERE key = ?", (time.time(), key))
+        self._db.commit()
+        symbol, interval, strategy, params, metrics, equity, equity_index, trades = row
+        return {
+            'symbol': symbol, 'interval': interval, 'strategy': strategy, 'params': json.loads(params),
+            'metrics': json.loads(metrics),
+            'equity': np.frombuffer(equity, dtype=np.float64),
+            'equity_index': np.frombuffer(equity_index, dtype=np.int64),
+            'trades': np.frombuffer(trades, dtype=TRADE_DTYPE),
+            'cached': True,
+        }
+
+    def put(self, key, job, result):
+        """
+        保存 run_job 的结果 (失败的结果不保存)。
+        """
+        if 'error' in result:
+            return
+        blobs = [np.ascontiguousarray(result[name]).tobytes() for name in ('equity', 'equity_index', 'trades')]
+        metrics = result['metrics']
+        now = time.time()
+        row = ([key, job['symbol'], job['interval'], job['strategy'], json.dumps(job['params'], sort_keys=True),
+                job_engine(job), json.dumps(run_spec(job), sort_keys=True, default=str)]
+               + [_metric_value(metrics.get(name, np.nan)) for name in METRIC_COLUMNS]
+               + [json.dumps(metrics, default=lambda v: v.item())] + blobs + [sum(len(b) for b in blobs), now, now])
+        self._db.execute(f"INSERT OR REPLACE INTO runs VALUES ({', '.join('?' * len(row))})", row)
+        self._db.commit()
+        if self.budget is not None:
+            self.evict(self.budget)
+
+    def query(self, order_by='sharpe', ascending=False, limit=None, **filters):
+        """
+        按指标查询历史结果 (不读取数组)。
+        order_by: 排序的指标列，见 METRIC_COLUMNS
+        filters: 标识列的等值条件，如 symbol='BTCUSDT'；或 '<指标>_min' / '<指标>_max' 的范围条件，如 trades_min=10
+        返回: DataFrame，每行一次回测，params 已解析为 dict
+        """
+        if order_by not in METRIC_COLUMNS:
+            raise ValueError(f"Unknown metric: {order_by}")
+        where, values = [], []
+        for name, value in filters.items():
+            column, _, bound = name.rpartition('_')
+            if bound in ('min', 'max') and column in METRIC_COLUMNS:
+                where.append(f"{column} {'>=' if bound == 'min' else '<='} ?")
+            elif name in KEY_COLUMNS:
+                where.append(f"{name} = ?")
+                value = json.dumps(value, sort_keys=True) if name == 'params' else value
+            else:
+                raise ValueError(f"Unknown filter: {name}")
+            values.append(value)
+        sql = (f"SELECT key, {', '.join(KEY_COLUMNS)}, {', '.join(METRIC_COLUMNS)}, created FROM runs"
+               + (f" WHERE {' AND '.join(where)}" if where else '')
+               + f" ORDER BY {order_by} IS NULL, {order_by} {'ASC' if ascending else 'DESC'}"
+               + (" LIMIT ?" if limit is not None else ''))
+        frame = pd.read_sql_query(sql, self._db, params=values + ([limit] if limit is not None else []))
+        frame['params'] = frame['params'].map(json.loads)
+        frame['created'] = pd.to_datetime(frame['created'], unit='s')
+        return frame
+
+    def size(self):
+        """
+        结果数据的总字节数 (资金曲线与成交记录)。
+        """
+        return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM runs").fetchone()[0]
+
+    def evict(self, budget):
+        """
+        按最近使用时间从旧到新删除结果，直到总大小不超过 budget 字节，并压缩数据库文件。
+        返回: 删除的结果数
+        """
+        total = self.size()
+        if total <= budget:
+            return 0
+        keys = []
+        for key, size in self._db.execute("SELECT key, size FROM runs ORDER BY accessed"):
+            if total <= budget:
+                break
+            keys.append((key,))
+            total -= size
+        self._db.executemany("DELETE FROM runs WHERE key = ?", keys)
+        self._db.commit()
+        self._db.execute("VACUUM")
+        return len(keys)
+
+    def clear(self):
+        self._db.execute("DELETE FROM runs")
+        self._db.commit()
+        self._db.execute("VACUUM")
+
+
+if __name__ == '__main__':
+    import tempfile
+
+    from runner import make_jobs, run_jobs
+
+    with open('config.json', 'r') as f:
+        config = json.load(f)
+
+    jobs = make_jobs(config['tokens'], ['1d', '4h'], {'macd': {}, 'rsi': {}}, config['data_paths'],
+                     config['initial_capital'], 0.0, 0.0)
+    with tempfile.TemporaryDirectory() as folder, ResultStore(os.path.join(folder, 'results.sqlite')) as store:
+        for attempt in ('cold', 'warm'):
+            t0 = time.perf_counter()
+            results = run_jobs(jobs, store=store)
+            hits = sum(bool(r.get('cached')) for r in results)
+            print(f"{attempt}: {len(jobs)} jobs in {(time.perf_counter() - t0) * 1e3:.1f} ms, {hits} from the store")
+        print(store.query('sharpe', trades_min=1)[['symbol', 'interval', 'strategy', 'sharpe', 'total_return',
+                                                    'trades']].to_string(index=False))
+        print(f"store holds {len(store)} runs, {store.size() / 1024:.0f} KiB")
+        print(f"evicted {store.evict(store.size() // 2)} runs to halve the budget, {len(store)} left")
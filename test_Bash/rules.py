@@ -0,0 +1,422 @@
+import ast
+
+import numpy as np
+import pandas as pd
+
+from indicators import sma, ema, smma, rsi, obv, atr, indicator_cache
+
+# 信号规则语言：规则写成 Python 表达式，如
+#     cross_up(obv(), sma(obv(), obv_period)) & (rsi(close, rsi_period) < rsi_overbought)
+# 用 ast 解析一次，编译成一个生成的 NumPy 函数，对整段序列整列求值，规则再复杂也没有逐 K 线的循环。
+# 编译时：参数名替换为常量并做常量折叠 (条件表达式 a if buy_logic_type == 'AND' else b 只保留选中的分支)；
+# macd / cross_up 等辅助函数按宏展开成基本运算；所有规则共用一张节点表，相同的子表达式
+# (如 buy 与 sell 中的 macd(close, 12, 26)、cross_up 里的 prev(x)) 只计算一次。
+# 名称解析顺序：宏参数 -> 同一组中的其他规则 -> 策略参数 -> 行情序列 (open/high/low/close/volume) -> 数据列 (如 MACD)。
+# 多周期列 (见 resample.multi_timeframe) 可写成 close_1d、high_1w 等，列名不是合法标识符时用 column('Close Price_1d')。
+# 求值时可给出缓存键前缀 (如 (symbol, interval, 数据指纹))，指标函数的结果按 前缀 + 规范表达式 (如 'ema(close, 12)')
+# 存入 indicators.indicator_cache，不同策略、不同参数组合与重复运行中相同的指标只计算一次。
+
+# 行情序列名 -> DataFrame 列名
+SERIES = {'open': 'Open', 'high': 'High', 'low': 'Low', 'close': 'Close Price', 'volume': 'Volume'}
+
+
+def _prev(values, k=1):
+    # 前 k 根的值，开头补 NaN
+    values = np.asarray(values, dtype=float)
+    out = np.full(len(values), np.nan)
+    if k < len(values):
+        out[k:] = values[:len(values) - k]
+    return out
+
+
+def _rolling(values, n, how):
+    return getattr(pd.Series(np.asarray(values, dtype=float)).rolling(n), how)().to_numpy()
+
+
+# 基本函数：参数为数组或常量 (以下划线开头的只在宏中使用)
+FUNCTIONS = {
+    'sma': sma,
+    'ema': ema,
+    'smma': smma,
+    'rsi': rsi,
+    '_obv': obv,
+    '_atr': atr,
+    'prev': _prev,
+    'highest': lambda x, n: _rolling(x, n, 'max'),
+    'lowest': lambda x, n: _rolling(x, n, 'min'),
+    'abs': np.abs,
+    'min': np.minimum,
+    'max': np.maximum,
+}
+
+# 结果经指标缓存的函数 (其余函数很便宜，不占缓存)
+CACHED_FUNCTIONS = {'sma', 'ema', 'smma', 'rsi', '_obv', '_atr', 'highest', 'lowest'}
+
+# 宏：(参数列表，函数体)；参数可带默认值 (默认值为规则语言中的表达式)
+MACROS = {
+    'macd': (('x', 'fast', 'slow'), 'ema(x, fast) - ema(x, slow)'),
+    'macd_signal': (('x', 'fast', 'slow', 'signal'), 'ema(macd(x, fast, slow), signal)'),
+    'macd_hist': (('x', 'fast', 'slow', 'signal'), 'macd(x, fast, slow) - macd_signal(x, fast, slow, signal)'),
+    'cross_up': (('a', 'b'), '(a > b) & (prev(a) <= prev(b))'),
+    'cross_down': (('a', 'b'), '(a < b) & (prev(a) >= prev(b))'),
+    'obv': (('x=close', 'v=volume'), '_obv(x, v)'),
+    'atr': (('n', 'h=high', 'l=low', 'c=close'), '_atr(h, l, c, n)'),
+}
+
+_BINARY = {ast.Add: '+', ast.Sub: '-', ast.Mult: '*', ast.Div: '/', ast.Pow: '**', ast.Mod: '%',
+           ast.BitAnd: 'and', ast.BitOr: 'or'}
+_COMPARE = {ast.Lt: '<', ast.LtE: '<=', ast.Gt: '>', ast.GtE: '>=', ast.Eq: '==', ast.NotEq: '!='}
+# a > b 与 b < a 归一为同一个节点
+_SWAPPED = {'>': '<', '>=': '<='}
+_COMMUTATIVE = {'+', '*', 'and', 'or', '==', '!='}
+_FOLD = {
+    '+': lambda a, b: a + b, '-': lambda a, b: a - b, '*': lambda a, b: a * b, '/': lambda a, b: a / b,
+    '**': lambda a, b: a ** b, '%': lambda a, b: a % b, 'and': lambda a, b: bool(a and b),
+    'or': lambda a, b: bool(a or b), '<': lambda a, b: a < b, '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b, '>=': lambda a, b: a >= b, '==': lambda a, b: a == b, '!=': lambda a, b: a != b,
+}
+_CONSTANT_TYPES = (bool, int, float, str)
+
+# 已编译的规则组: (规则, 参数) -> RuleProgram
+_programs = {}
+
+
+class RuleProgram:
+    """
+    编译后的规则组。
+    outputs: 规则名元组
+    source: 生成的 Python 源码 (每个唯一子表达式一行)
+    nodes: 需要在运行时计算的节点数
+    signatures: 指标调用的规范表达式 (生成代码中 call 的第一个参数为其下标)，用作缓存键
+    """
+
+    def __init__(self, outputs, source, constants, nodes, signatures=()):
+        self.outputs = outputs
+        self.source = source
+        self.nodes = nodes
+        self.signatures = signatures
+        namespace = {}
+        exec(compile(source, '<rules>', 'exec'), {'np': np, 'F': FUNCTIONS, 'K': constants}, namespace)
+        self._function = namespace['program']
+
+    def evaluate(self, data, cache_key=None):
+        """
+        在整段数据上求值。
+        data: DataFrame 或 {名称: 数组} (行情序列可用 'close' 等小写名或 'Close Price' 等列名)
+        cache_key: 可选的缓存键前缀，给定时指标函数的结果经 indicators.indicator_cache 缓存
+        返回: {规则名: 数组} (条件为 bool 数组，数值表达式为 float 数组；常量规则展开成整列)
+        """
+        return self.evaluate_with_warmup(data, cache_key)[0]
+
+    def evaluate_with_warmup(self, data, cache_key=None):
+        """
+        同 evaluate，另外返回预热期长度：规则用到的指标与数据列 (prev 除外) 全部有值的第一根 K 线的下标。
+        返回: ({规则名: 数组}, warmup)
+        """
+        n = len(next(iter(data.values())) if isinstance(data, dict) else data)
+        with np.errstate(all='ignore'):
+            values, inputs = self._function(data, _column, self._caller(cache_key))
+        warmup = max((_first_valid(v) for v in inputs if np.ndim(v)), default=0)
+        outputs = {name: np.full(n, v) if np.ndim(v) == 0 else np.asarray(v) for name, v in zip(self.outputs, values)}
+        return outputs, warmup
+
+    def _caller(self, cache_key):
+        if cache_key is None:
+            return _call
+        signatures = self.signatures
+
+        def call(index, function, *args, **kwargs):
+            return indicator_cache.get(tuple(cache_key) + (signatures[index],),
+                                       lambda: _readonly(function(*args, **kwargs)))
+        return call
+
+
+def _call(index, function, *args, **kwargs):
+    return function(*args, **kwargs)
+
+
+def _readonly(values):
+    # 缓存中的数组设为只读，防止调用方原地修改污染缓存
+    values = np.asarray(values, dtype=float)
+    values.setflags(write=False)
+    return values
+
+
+def _first_valid(values):
+    valid = ~np.isnan(np.asarray(values, dtype=float))
+    return int(np.argmax(valid)) if valid.any() else len(valid)
+
+
+def _plain(value):
+    # NumPy 标量 (如参数网格中的 np.int64) 转为 Python 标量，np.int64 / np.bool_ 不是 int / bool 的子类
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _column(data, name):
+    if name in SERIES and SERIES[name] in data:
+        return np.asarray(data[SERIES[name]], dtype=float)
+    if name in data:
+        return np.asarray(data[name], dtype=float)
+    # 多周期列：close_1d -> 'Close Price_1d'
+    series, _, interval = name.rpartition('_')
+    if series in SERIES and f'{SERIES[series]}_{interval}' in data:
+        return np.asarray(data[f'{SERIES[series]}_{interval}'], dtype=float)
+    raise ValueError(f"Unknown name in rule: {name}")
+
+
+class _Compiler:
+    def __init__(self, rules, params):
+        self.rules = rules
+        self.params = params
+        self.keys = {}  # 节点键 -> 节点下标 (公共子表达式消除)
+        self.nodes = [] # (键, 生成的表达式)；常量节点的表达式为 None
+        self.constants = []
+        self.slots = {} # 常量节点键 -> constants 中的下标
+        self.signatures = [] # 经缓存的指标调用的规范表达式
+        self.resolving = []
+
+    def intern(self, key, expr=None):
+        index = self.keys.get(key)
+        if index is None:
+            index = self.keys[key] = len(self.nodes)
+            self.nodes.append((key, expr))
+        return index
+
+    def constant(self, value):
+        value = _plain(value)
+        if not isinstance(value, _CONSTANT_TYPES):
+            raise ValueError(f"Unsupported constant in rule: {value!r}")
+        key = ('const', type(value).__name__, value)
+        if key not in self.slots:
+            self.slots[key] = len(self.constants)
+            self.constants.append(value)
+        return self.intern(key)
+
+    def value(self, index):
+        # 常量节点的值；非常量返回 None
+        key = self.nodes[index][0]
+        return key[2] if key[0] == 'const' else None
+
+    def is_constant(self, index):
+        return self.nodes[index][0][0] == 'const'
+
+    def ref(self, index):
+        key = self.nodes[index][0]
+        return f'K[{self.slots[key]}]' if key[0] == 'const' else f't{index}'
+
+    def binary(self, op, a, b):
+        if op in _SWAPPED:
+            op, a, b = _SWAPPED[op], b, a
+        if self.is_constant(a) and self.is_constant(b):
+            return self.constant(_FOLD[op](self.value(a), self.value(b)))
+        if op in _COMMUTATIVE and a > b:
+            a, b = b, a
+        if op == 'and':
+            expr = f'np.logical_and({self.ref(a)}, {self.ref(b)})'
+        elif op == 'or':
+            expr = f'np.logical_or({self.ref(a)}, {self.ref(b)})'
+        else:
+            expr = f'{self.ref(a)} {op} {self.ref(b)}'
+        return self.intern(('op', op, a, b), expr)
+
+    def compile(self, node, scope):
+        if isinstance(node, ast.Expression):
+            return self.compile(node.body, scope)
+        if isinstance(node, ast.Constant):
+            return self.constant(node.value)
+        if isinstance(node, ast.Name):
+            return self.name(node.id, scope)
+        if isinstance(node, ast.BinOp) and type(node.op) in _BINARY:
+            return self.binary(_BINARY[type(node.op)], self.compile(node.left, scope),
+                               self.compile(node.right, scope))
+        if isinstance(node, ast.BoolOp):
+            op = 'and' if isinstance(node.op, ast.And) else 'or'
+            result = self.compile(node.values[0], scope)
+            for value in node.values[1:]:
+                result = self.binary(op, result, self.compile(value, scope))
+            return result
+        if isinstance(node, ast.Compare):
+            # a < b < c -> (a < b) & (b < c)
+            left = self.compile(node.left, scope)
+            result = None
+            for op, right in zip(node.ops, node.comparators):
+                if type(op) not in _COMPARE:
+                    raise ValueError(f"Unsupported comparison in rule: {type(op).__name__}")
+                right = self.compile(right, scope)
+                term = self.binary(_COMPARE[type(op)], left, right)
+                result = term if result is None else self.binary('and', result, term)
+                left = right
+            return result
+        if isinstance(node, ast.UnaryOp):
+            operand = self.compile(node.operand, scope)
+            if isinstance(node.op, (ast.Not, ast.Invert)):
+                if self.is_constant(operand):
+                    return self.constant(not self.value(operand))
+                return self.intern(('not', operand), f'np.logical_not({self.ref(operand)})')
+            if isinstance(node.op, ast.USub):
+                if self.is_constant(operand):
+                    return self.constant(-self.value(operand))
+                return self.intern(('neg', operand), f'-{self.ref(operand)}')
+            if isinstance(node.op, ast.UAdd):
+                return operand
+        if isinstance(node, ast.IfExp):
+            test = self.compile(node.test, scope)
+            if self.is_constant(test):
+                return self.compile(node.body if self.value(test) else node.orelse, scope)
+            body, orelse = self.compile(node.body, scope), self.compile(node.orelse, scope)
+            return self.intern(('where', test, body, orelse),
+                               f'np.where({self.ref(test)}, {self.ref(body)}, {self.ref(orelse)})')
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+            return self.call(node, scope)
+        raise ValueError(f"Unsupported syntax in rule: {ast.dump(node)[:80]}")
+
+    def name(self, name, scope):
+        if name in scope:
+            return scope[name]
+        if name in self.rules:
+            if name in self.resolving:
+                raise ValueError(f"Circular rule reference: {' -> '.join(self.resolving + [name])}")
+            self.resolving.append(name)
+            try:
+                return self.compile(parse(self.rules[name]), {})
+            finally:
+                self.resolving.pop()
+        if name in self.params:
+            return self.constant(self.params[name])
+        if name in ('True', 'False'):
+            return self.constant(name == 'True')
+        return self.intern(('column', name), f'column(data, {name!r})')
+
+    def call(self, node, scope):
+        name = node.func.id
+        if name == 'column':
+            # column('列名')：直接引用数据列
+            if len(node.args) != 1 or node.keywords or not isinstance(node.args[0], ast.Constant) \
+                    or not isinstance(node.args[0].value, str):
+                raise ValueError("column() takes a single column name string")
+            column = node.args[0].value
+            return self.intern(('column', column), f'column(data, {column!r})')
+        args = [self.compile(arg, scope) for arg in node.args]
+        kwargs = {kw.arg: self.compile(kw.value, scope) for kw in node.keywords}
+        if name in MACROS:
+            names, body = MACROS[name]
+            bound = {}
+            for i, spec in enumerate(names):
+                param, _, default = spec.partition('=')
+                if i < len(args):
+                    bound[param] = args[i]
+                elif param in kwargs:
+                    bound[param] = kwargs.pop(param)
+                elif default:
+                    bound[param] = self.compile(parse(default), {})
+                else:
+                    raise ValueError(f"{name}() missing argument '{param}'")
+            if len(args) > len(names) or kwargs:
+                raise ValueError(f"Too many arguments for {name}()")
+            return self.compile(parse(body), bound)
+        if name not in FUNCTIONS:
+            raise ValueError(f"Unknown function in rule: {name}")
+        if name == 'prev' and args and self.is_constant(args[0]):
+            return args[0] # 常量序列的前值仍是该常量
+        items = [self.ref(a) for a in args] + [f'{k}={self.ref(v)}' for k, v in sorted(kwargs.items())]
+        key = ('call', name, tuple(args), tuple(sorted(kwargs.items())))
+        if name in CACHED_FUNCTIONS and key not in self.keys:
+            self.signatures.append(self.text(key))
+            return self.intern(key, f"call({len(self.signatures) - 1}, F[{name!r}], {', '.join(items)})")
+        return self.intern(key, f"F[{name!r}]({', '.join(items)})")
+
+    def text(self, key):
+        # 节点的规范表达式 (与所在规则组无关)，如 'ema((ema(close, 12) - ema(close, 26)), 9)'
+        def sub(index):
+            return self.text(self.nodes[index][0])
+
+        kind = key[0]
+        if kind == 'const':
+            return repr(key[2])
+        if kind == 'column':
+            return key[1]
+        if kind == 'op':
+            return f'({sub(key[2])} {key[1]} {sub(key[3])})'
+        if kind == 'not':
+            return f'(not {sub(key[1])})'
+        if kind == 'neg':
+            return f'(-{sub(key[1])})'
+        if kind == 'where':
+            return f'({sub(key[2])} if {sub(key[1])} else {sub(key[3])})'
+        items = [sub(i) for i in key[2]] + [f'{k}={sub(v)}' for k, v in key[3]]
+        return f"{key[1]}({', '.join(items)})"
+
+    def inputs(self):
+        # 决定预热期的节点：数据列与除 prev 以外的函数调用 (NaN 由此产生，运算只是传递)
+        return [i for i, (key, expr) in enumerate(self.nodes)
+                if key[0] == 'column' or (key[0] == 'call' and key[1] != 'prev')]
+
+    def source(self, outputs):
+        lines = ['def program(data, column, call):']
+        for index, (key, expr) in enumerate(self.nodes):
+            if expr is not None:
+                lines.append(f'    t{index} = {expr}')
+        lines.append(f"    return ({''.join(self.ref(i) + ', ' for i in outputs)}), "
+                     f"({''.join(self.ref(i) + ', ' for i in self.inputs())})")
+        return '\n'.join(lines) + '\n'
+
+
+def parse(expression):
+    """
+    解析一条规则表达式，语法错误时抛出 ValueError。
+    """
+    try:
+        return ast.parse(expression.strip(), mode='eval')
+    except SyntaxError as e:
+        raise ValueError(f"Invalid rule {expression!r}: {e.msg}") from None
+
+
+def compile_rules(rules, params=None):
+    """
+    把一组规则编译为 RuleProgram (相同的规则与参数只编译一次)。
+    rules: {规则名: 表达式}，表达式中可以引用同一组中的其他规则
+    params: {参数名: 常量}，编译时代入；非常量的参数 (如嵌套的 dict) 被忽略
+    """
+    params = {k: _plain(v) for k, v in (params or {}).items()}
+    params = {k: v for k, v in params.items() if isinstance(v, _CONSTANT_TYPES)}
+    key = (tuple(sorted(rules.items())), tuple(sorted(params.items())))
+    program = _programs.get(key)
+    if program is None:
+        compiler = _Compiler(rules, params)
+        outputs = [compiler.name(name, {}) for name in rules]
+        program = RuleProgram(tuple(rules), compiler.source(outputs), tuple(compiler.constants),
+                              sum(expr is not None for _, expr in compiler.nodes), tuple(compiler.signatures))
+        _programs[key] = program
+    return program
+
+
+def evaluate_rules(rules, data, params=None, cache_key=None):
+    """
+    编译 (或取缓存) 并在 data 上求值，见 compile_rules 与 RuleProgram.evaluate。
+    """
+    return compile_rules(rules, params).evaluate(data, cache_key)
+
+
+if __name__ == '__main__':
+    import time
+
+    from data_store import load_klines
+
+    data = load_klines('../data/4hour/BTCUSDT_4h.csv')
+    rules = {
+        'obv_up': 'cross_up(obv(), sma(obv(), obv_period))',
+        'macd_up': 'cross_up(macd_hist(close, macd1, macd2, macdsig), 0)',
+        'buy': '(obv_up or macd_up) and rsi(close, rsi_period) < rsi_overbought',
+        'sell': 'cross_down(obv(), sma(obv(), obv_period)) | cross_down(macd_hist(close, macd1, macd2, macdsig), 0)'
+                ' | (rsi(close, rsi_period) > rsi_overbought)',
+    }
+    params = dict(obv_period=10, rsi_period=10, macd1=8, macd2=17, macdsig=5, rsi_overbought=70)
+    t0 = time.perf_counter()
+    program = compile_rules(rules, params)
+    t1 = time.perf_counter()
+    result = program.evaluate(data)
+    t2 = time.perf_counter()
+    print(program.source)
+    print(f"compiled {program.nodes} nodes in {(t1 - t0) * 1e3:.2f} ms, evaluated {len(data)} bars in "
+          f"{(t2 - t1) * 1e3:.2f} ms")
+    print({name: int(values.sum()) for name, values in result.items()})
@@ -0,0 +1,271 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from data_store import load_klines, OHLCV_COLUMNS
+from day_data import calculate_all_indicators
+from indicators import data_fingerprint
+from strategy import Strategy
+import profiling
+from backtester import Backtester
+from execution import fee_rates
+from margin import funding_path
+from results import run_key
+from resample import multi_timeframe
+
+# run_job(shared=True) 经共享内存返回的数组
+SHARED_KEYS = ('equity', 'equity_index', 'trades')
+
+
+def make_jobs(tokens, intervals, strategies, data_paths, initial_capital, commission_rate, slippage_rate,
+              execution=None, fee_schedule=None, margin=None):
+    """
+    生成 交易对 × 周期 × 策略 的回测任务列表。
+    tokens: 交易对列表
+    intervals: 周期列表，如 ['1d', '4h']
+    strategies: {策略名: 参数字典}
+    data_paths: {周期: 数据目录}
+    execution: 给定时使用 K 线内成交模型回测，选项见 Backtester 的 execution
+    fee_schedule: 按交易对的 maker / taker 费率 (见 execution.fee_rates)，只用于成交模型
+    margin: 给定时使用多空杠杆模型回测，选项见 Backtester 的 margin；另可给 'funding_dir'
+            (资金费率文件目录，文件名见 margin.funding_path)
+    返回: 任务字典列表，只包含可 pickle 的基础类型
+    """
+    jobs = []
+    for interval in intervals:
+        for token in tokens:
+            csv_path = os.path.join(data_paths[interval], f"{token}_{interval}.csv")
+            fees = fee_rates(token, fee_schedule, commission_rate)
+            margin_options = None
+            if margin:
+                margin_options = {key: value for key, value in margin.items() if key != 'funding_dir'}
+                if margin.get('funding_dir'):
+                    margin_options['funding_file'] = funding_path(token, margin['funding_dir'])
+            for strategy_name, strategy_params in strategies.items():
+                jobs.append({
+                    'symbol': token,
+                    'interval': interval,
+                    'csv_path': csv_path,
+                    'strategy': strategy_name,
+                    'params': strategy_params,
+                    'initial_capital': initial_capital,
+                    'commission_rate': commission_rate,
+                    'slippage_rate': slippage_rate,
+                    'execution': dict(execution, fees=fees) if execution else None,
+                    'margin': margin_options,
+                })
+    return jobs
+
+
+def prepare_data(job, indicators=True):
+    """
+    从本地列式缓存读取数据并生成信号。
+    信号在完整历史上求值后再去掉指标预热期 (含 NaN) 的行。规则中的指标经进程内指标缓存计算，
+    重复运行与参数扫描直接复用。
+    参数中给出 'timeframes' (如 ['1d', '1w']) 时加入对齐后的粗周期列，见 resample.multi_timeframe。
+    indicators: 为 True 时另外加入策略的指标列 (如 MACD / MACD_Signal，供绘图使用)；回测本身不需要
+    返回: 带 'Signal' 列的 DataFrame；数据不足时返回空 DataFrame
+    """
+    with profiling.span('load', path=job['csv_path']):
+        data = load_klines(job['csv_path']).sort_index().dropna()
+    if data.empty:
+        return data
+    timeframes = job['params'].get('timeframes')
+    if timeframes:
+        # 由本文件聚合、按收盘时间对齐的粗周期列 (规则中写 close_1d 等)
+        with profiling.span('timeframes', intervals=','.join(timeframes)):
+            coarse = multi_timeframe(job['csv_path'], timeframes)
+            data = data.join(coarse.drop(columns=OHLCV_COLUMNS))
+    if indicators:
+        with profiling.span('indicators', strategy=job['strategy']):
+            data = calculate_all_indicators(data, job['strategy'], job['params'],
+                                            symbol=job['symbol'], interval=job['interval'])
+    with profiling.span('signals', strategy=job['strategy']):
+        strategy = Strategy(job['strategy'], job['params'])
+        cache_key = (job['symbol'], job['interval'], data_fingerprint(data))
+        return strategy.generate_signals(data.copy(), cache_key, drop_warmup=True)
+
+
+def run_job(job, shared=False):
+    """
+    在工作进程中执行单个回测任务，只返回紧凑结果，避免在进程间传递整张 DataFrame。
+    shared: 为 True 时把数组写入共享内存，只返回共享内存的名称与布局 (见 attach_shared)
+    返回: dict，包含任务标识、'metrics'、'equity' (float64 数组)、'equity_index' (int64 纳秒时间戳)、
+          'trades' (backtester.TRADE_DTYPE 结构化数组，可用 backtester.trades_frame 转成 DataFrame)；
+          失败时包含 'error'；任务带 'trace' 选项时另有 'trace' (见 profiling.capture)
+    """
+    label = f"{job['symbol']}_{job['interval']}_{job['strategy']}"
+    with profiling.capture(job.get('trace'), label) as trace:
+        result = _run_job(job, shared)
+    if trace:
+        result['trace'] = trace
+    return result
+
+
+def _run_job(job, shared):
+    result = {key: job[key] for key in ('symbol', 'interval', 'strategy', 'params')}
+    try:
+        data_with_signals = prepare_data(job, indicators=False)
+        if data_with_signals.empty:
+            result['error'] = "data became empty after dropping NaNs"
+            return result
+
+        execution, margin = job.get('execution'), job.get('margin')
+        backtester = Backtester(job['initial_capital'], job['commission_rate'], job['slippage_rate'],
+                                execution, margin)
+        engine = 'margin' if margin else 'execution' if execution else 'vectorized'
+        with profiling.span('backtest', engine=engine, bars=len(data_with_signals)):
+            equity, trade_log = backtester.run(data_with_signals, engine)
+        with profiling.span('metrics'):
+            result['metrics'] = backtester.analyze_performance()
+        arrays = {
+            'equity': equity,
+            'equity_index': backtester.equity_times.view(np.int64),
+            'trades': trade_log.records,
+        }
+        if shared:
+            result['shared'] = share_arrays(arrays)
+        else:
+            result.update(arrays)
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    return result
+
+
+def share_arrays(arrays):
+    """
+    把若干数组复制到一块新的共享内存 (工作进程端)。
+    返回: 描述 dict (名称与各数组的 dtype / 形状 / 偏移)，体积与数组大小无关，pickle 开销可忽略
+    """
+    layout, offset = [], 0
+    for key, values in arrays.items():
+        values = np.ascontiguousarray(values)
+        offset = -(-offset // 16) * 16 # 按 16 字节对齐
+        layout.append((key, values.dtype, values.shape, offset))
+        offset += values.nbytes
+    block = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for (key, dtype, shape, start), values in zip(layout, arrays.values()):
+        np.ndarray(shape, dtype, buffer=block.buf, offset=start)[...] = values
+    # 不在这里 unlink：由主进程 release_shared 释放。工作进程与主进程共用主进程的 resource_tracker
+    # (见 _run_all)，主进程异常退出时未释放的共享内存由它清理
+    block.close()
+    return {'name': block.name, 'layout': layout}
+
+
+def attach_shared(result):
+    """
+    在主进程中把 run_job(shared=True) 的结果映射为数组 (不复制)：result 中加入 'equity'、
+    'equity_index'、'trades'，共享内存句柄保存在 result['_block']。用完后调用 release_shared。
+    """
+    desc = result.pop('shared', None)
+    if desc is None:
+        return result
+    block = shared_memory.SharedMemory(name=desc['name'])
+    _map_arrays(result, block.buf, desc['layout'])
+    result['_block'] = (block, desc['layout'])
+    return result
+
+
+def _map_arrays(result, buffer, layout):
+    # np.frombuffer 的数组 (及其切片、视图) 持有缓冲区的导出，存在时 SharedMemory.close 抛出 BufferError，
+    # 不会在数组仍可访问时解除映射；np.ndarray(buffer=...) 不保留导出，不能用在这里
+    for key, dtype, shape, offset in layout:
+        count = int(np.prod(shape, dtype=np.int64))
+        result[key] = np.frombuffer(buffer, dtype, count, offset).reshape(shape)
+
+
+def release_shared(results):
+    """
+    释放 attach_shared 映射的共享内存，结果中的数组随之移除。
+    还有数组 (或它的切片、视图) 在别处被引用的共享内存无法关闭 (SharedMemory.close 抛出 BufferError)：
+    这些结果保持原样，其余照常释放，最后抛出 BufferError；需要保留的数组先 .copy()，删除引用后可再次调用。
+    """
+    busy = []
+    for result in results:
+        if '_block' not in result:
+            continue
+        block, layout = result.pop('_block')
+        for key in SHARED_KEYS:
+            result.pop(key, None)
+        try:
+            block.close()
+        except BufferError:
+            # close 已释放 block.buf，但映射本身仍然有效：直接在映射上重建数组放回结果中
+            _map_arrays(result, block._mmap, layout)
+            result['_block'] = (block, layout)
+            busy.append(f"{result['symbol']} {result['interval']} {result['strategy']}")
+            continue
+        block.unlink()
+    if busy:
+        raise BufferError(f"shared arrays are still referenced ({', '.join(busy)}); "
+                          f"drop them or .copy() them before release_shared")
+
+
+def run_jobs(jobs, max_workers=None, shared=False, store=None, trace=None):
+    """
+    用进程池并行执行回测任务，结果顺序与 jobs 一致。
+    大文件的任务先提交，使总耗时接近最慢的单个任务。
+    max_workers: 进程数，默认 CPU 核数；为 1 时在当前进程顺序执行 (便于调试)
+    shared: 为 True 时工作进程通过共享内存返回数组，主进程零拷贝读取 (顺序执行时同样经过共享内存)；
+            用完后须调用 release_shared(results)
+    store: 可选的 results.ResultStore。已有结果的任务直接从库中读取 (结果带 'cached': True)，
+           其余任务执行后写入库中
+    trace: 给定时 (profiling.capture 的选项，如 {} 或 {'profile_dir': ...}) 每个任务在工作进程中埋点，
+           事件合并到主进程的 trace (需先调用 profiling.enable())
+    """
+    if trace is not None:
+        jobs = [dict(job, trace=trace) for job in jobs]
+    if store is None:
+        return _run_all(jobs, max_workers, shared)
+    keys = [_store_key(job) for job in jobs]
+    results = [store.get(key) if key else None for key in keys]
+    pending = [i for i, result in enumerate(results) if result is None]
+    profiling.count('store_hits', len(jobs) - len(pending))
+    profiling.count('store_misses', len(pending))
+    for i, result in zip(pending, _run_all([jobs[i] for i in pending], max_workers, shared)):
+        if keys[i]:
+            with profiling.span('store_put'):
+                store.put(keys[i], jobs[i], result)
+        results[i] = result
+    return results
+
+
+def _store_key(job):
+    # 数据文件不存在或策略无效的任务没有键：照常执行 (得到带 'error' 的结果)，不读写结果库
+    try:
+        return run_key(job)
+    except (OSError, ValueError):
+        return None
+
+
+def _run_all(jobs, max_workers, shared):
+    if not jobs:
+        return []
+    max_workers = max_workers or min(len(jobs), os.cpu_count() or 1)
+    if shared:
+        # 工作进程继承主进程的 resource_tracker，共享内存登记在主进程这一侧
+        resource_tracker.ensure_running()
+    if max_workers == 1:
+        return [_merge_trace(attach_shared(run_job(job, shared))) for job in jobs]
+
+    order = sorted(range(len(jobs)), key=lambda i: -_job_size(jobs[i]))
+    results = [None] * len(jobs)
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {i: pool.submit(run_job, jobs[i], shared) for i in order}
+        for i, future in futures.items():
+            results[i] = _merge_trace(attach_shared(future.result()))
+    return results
+
+
+def _merge_trace(result):
+    profiling.merge(result.pop('trace', None))
+    return result
+
+
+def _job_size(job):
+    try:
+        return os.path.getsize(job['csv_path'])
+    except OSError:
+        return 0
@@ -1,40 +1,105 @@
 import pandas as pd
 import numpy as np
 
+from rules import compile_rules
+
+# 策略 = 一组规则 (见 rules.py) + 参数默认值。规则 'buy' 为真输出 1，'sell' 为真输出 -1 (同时为真时卖出优先)，
+# 其余为 0。新增策略只需在 config.json 的 strategy_params 中加一项，并在参数里给出 'rules'：
+#     "obv_rsi": {"rules": {"buy": "cross_up(obv(), sma(obv(), obv_period)) & (rsi(close, rsi_period) < 70)",
+#                           "sell": "cross_down(obv(), sma(obv(), obv_period))"},
+#                 "obv_period": 10, "rsi_period": 10}
+
+# OBV_MACD_RSI_Strategy (stragedy/day/macd_rsi_onv.py) 的参数默认值，与类的 params 相同 (native.parity 会核对)。
+# 规则、kernels.simulate_obv_macd_rsi 与 streaming.ObvMacdRsiStream 都从这里取默认值
+OBV_MACD_RSI_PARAMS = dict(
+    obv_period=10,
+    rsi_period=10,
+    macd1=8,
+    macd2=17,
+    macdsig=5,
+    drawdown_limit=0.25,
+    cooldown_period=5,
+    rsi_overbought=70,
+    rsi_oversold=30,
+    atr_period=14,
+    trailing_stop_multiplier=2.0,
+    trailing_stop_active=True,
+    buy_logic_type='MIXED',
+    sell_logic_type='OR',
+)
+
+# OBV_MACD_RSI_Strategy 的进出场条件；回撤冷却与 ATR 移动止损依赖持仓路径，不属于信号规则
+# (原样的路径依赖逻辑见 native.py / kernels.simulate_obv_macd_rsi)
+_OBV_MACD_RSI_RULES = {
+    'obv_cross_up': 'cross_up(obv(), sma(obv(), obv_period))',
+    'macd_cross_up': 'cross_up(macd_hist(close, macd1, macd2, macdsig), 0)',
+    'rsi_not_overbought': 'rsi(close, rsi_period) < rsi_overbought',
+    'rsi_oversold_bounce': 'cross_up(rsi(close, rsi_period), rsi_oversold)',
+    'buy_and': 'obv() > sma(obv(), obv_period) and macd_cross_up and rsi_not_overbought',
+    'buy_or': '(obv_cross_up and macd_cross_up) or (obv_cross_up and rsi_oversold_bounce)'
+              ' or (macd_cross_up and rsi_oversold_bounce)',
+    'buy_mixed': '(obv_cross_up or macd_cross_up) and rsi_not_overbought',
+    'exit_obv': 'cross_down(obv(), sma(obv(), obv_period))',
+    'exit_macd': 'cross_down(macd_hist(close, macd1, macd2, macdsig), 0)',
+    'exit_rsi': 'rsi(close, rsi_period) > rsi_overbought',
+    'buy': "buy_and if buy_logic_type == 'AND' else buy_or if buy_logic_type == 'OR' else buy_mixed",
+    'sell': "(exit_obv and exit_macd and exit_rsi) if sell_logic_type == 'AND' else "
+            "(exit_obv or exit_macd or exit_rsi)",
+}
+
+# 内置策略: 名称 -> (规则, 参数默认值)
+STRATEGY_RULES = {
+    # MACD 在信号线上方为 1 (买入/持有)，下方为 -1，回测器只在持仓变化处成交
+    'macd': ({'buy': 'macd(close, fast_period, slow_period) > signal_line',
+              'sell': 'macd(close, fast_period, slow_period) < signal_line',
+              'signal_line': 'macd_signal(close, fast_period, slow_period, signal_period)'},
+             dict(fast_period=12, slow_period=26, signal_period=9)),
+    # 短期均线在长期均线上方买入，下方卖出
+    'moving_average_crossover': ({'buy': 'sma(close, short_period) > sma(close, long_period)',
+                                  'sell': 'sma(close, short_period) < sma(close, long_period)'},
+                                 dict(short_period=5, long_period=20)),
+    'rsi': ({'buy': 'rsi(close, rsi_period, rsi_method) < rsi_lower',
+             'sell': 'rsi(close, rsi_period, rsi_method) > rsi_upper'},
+            dict(rsi_period=14, rsi_method='sma', rsi_lower=30, rsi_upper=70)),
+    'obv': ({'buy': 'cross_up(obv(), sma(obv(), obv_ma_period))',
+             'sell': 'cross_down(obv(), sma(obv(), obv_ma_period))'},
+            dict(obv_ma_period=20)),
+    'obv_macd_rsi': (_OBV_MACD_RSI_RULES,
+                     {name: OBV_MACD_RSI_PARAMS[name] for name in ('obv_period', 'rsi_period', 'macd1', 'macd2',
+                                                                   'macdsig', 'rsi_overbought', 'rsi_oversold',
+                                                                   'buy_logic_type', 'sell_logic_type')}),
+}
+
+
 class Strategy:
     def __init__(self, name, params):
         self.name = name
         self.params = params
 
-    def generate_signals(self, data):
+    def rules(self):
+        """
+        策略的规则与合并默认值后的参数：参数中给出 'rules' 时使用它，否则使用 STRATEGY_RULES 中的内置策略。
+        返回: (rules, params)
+        """
+        rules = self.params.get('rules')
+        defaults = {}
+        if rules is None:
+            if self.name not in STRATEGY_RULES:
+                raise ValueError(f"Unknown strategy name: {self.name}")
+            rules, defaults = STRATEGY_RULES[self.name]
+        if 'buy' not in rules or 'sell' not in rules:
+            raise ValueError(f"Strategy {self.name} must define 'buy' and 'sell' rules")
+        return rules, dict(defaults, **self.params)
+
+    def generate_signals(self, data, cache_key=None, drop_warmup=False):
         """
-        根据策略逻辑生成买入/卖出信号。
-        data: 包含指标的 DataFrame
+        根据策略规则生成买入/卖出信号 (规则在整列上一次求值)。
+        data: 包含 OHLCV 的 DataFrame
+        cache_key: 可选的指标缓存键前缀，如 (symbol, interval, 数据指纹)，见 RuleProgram.evaluate
+        drop_warmup: 为 True 时去掉规则所用指标的预热期 (指标为 NaN) 的行
         返回: 包含 'Signal' 列的 DataFrame (1: 买入, -1: 卖出, 0: 持有)
         """
-        data['Signal'] = 0
-
-        if self.name == "macd":
-            # MACD 金叉买入 (MACD 上穿 Signal Line)
-            data.loc[data['MACD'] > data['MACD_Signal'], 'Signal'] = 1
-            # MACD 死叉卖出 (MACD 下穿 Signal Line)
-            data.loc[data['MACD'] < data['MACD_Signal'], 'Signal'] = -1
-            
-            # 仅在信号发生变化时产生交易信号
-            # 例如：从持有到买入，从持有到卖出
-            # data['Position'] = data['Signal'].diff()
-            # 1: 买入，-1: 卖出, 0: 不动
-            # 为了简化，这里直接用 Signal 作为 Position，回测器会处理实际交易点
-            
-        elif self.name == "moving_average_crossover":
-            # 示例：短期均线穿过长期均线
-            # data['Short_MA'] = data['Close Price'].rolling(window=self.params['short_period']).mean()
-            # data['Long_MA'] = data['Close Price'].rolling(window=self.params['long_period']).mean()
-            # data.loc[data['Short_MA'] > data['Long_MA'], 'Signal'] = 1
-            # data.loc[data['Short_MA'] < data['Long_MA'], 'Signal'] = -1
-            pass # 占位符，如果启用需要计算 MA 指标
-
-        else:
-            raise ValueError(f"Unknown strategy name: {self.name}")
-
-        return data
\ No newline at end of file
+        rules, params = self.rules()
+        result, warmup = compile_rules(rules, params).evaluate_with_warmup(data, cache_key)
+        data['Signal'] = np.where(result['sell'], -1, np.where(result['buy'], 1, 0))
+        return data.iloc[warmup:] if drop_warmup else data
@@ -0,0 +1,411 @@
+import math
+import time
+from collections import deque, namedtuple
+
+import numpy as np
+
+from data_store import load_arrays
+from strategy import OBV_MACD_RSI_PARAMS
+
+# 逐根 K 线的流式 (实盘/模拟盘) 模式。指标状态按 K 线 O(1) 更新，不回看窗口重算；
+# 计算方式与 indicators.py / backtrader 一致，因此信号与批量回测相同。
+
+NAN = float('nan')
+
+Bar = namedtuple('Bar', ['time', 'open', 'high', 'low', 'close', 'volume'])
+
+
+# ----------------------
+# 增量指标
+# ----------------------
+class IncSMA:
+    """
+    简单移动平均，环形缓冲 + Kahan 补偿的滑动和。
+    """
+
+    def __init__(self, period):
+        self.period = period
+        self.window = deque()
+        self.total = 0.0
+        self._comp = 0.0
+        self.value = NAN
+
+    def _add(self, x):
+        y = x - self._comp
+        t = self.total + y
+        self._comp = (t - self.total) - y
+        self.total = t
+
+    def update(self, x):
+        if math.isnan(x):
+            return self.value
+        self.window.append(x)
+        self._add(x)
+        if len(self.window) > self.period:
+            self._add(-self.window.popleft())
+        if len(self.window) == self.period:
+            self.value = self.total / self.period
+        return self.value
+
+
+class IncEMA:
+    """
+    指数平滑：前 period 个有效值取简单平均作为种子，之后 y = y * (1 - alpha) + x * alpha。
+    alpha 默认 2 / (period + 1) (EMA)；Wilder 平滑传入 1 / period。
+    """
+
+    def __init__(self, period, alpha=None):
+        self.period = period
+        self.alpha = 2.0 / (period + 1) if alpha is None else alpha
+        self.count = 0
+        self.total = 0.0
+        self.value = NAN
+
+    def update(self, x):
+        if math.isnan(x):
+            return self.value
+        if self.count < self.period:
+            self.count += 1
+            self.total += x
+            if self.count == self.period:
+                self.value = self.total / self.period
+        else:
+            self.value = self.value * (1 - self.alpha) + x * self.alpha
+        return self.value
+
+
+class IncMACD:
+    def __init__(self, fast_period=12, slow_period=26, signal_period=9):
+        self.fast = IncEMA(fast_period)
+        self.slow = IncEMA(slow_period)
+        self.signal_ema = IncEMA(signal_period)
+        self.macd = self.signal = self.hist = NAN
+
+    def update(self, close):
+        self.macd = self.fast.update(close) - self.slow.update(close)
+        self.signal = self.signal_ema.update(self.macd)
+        self.hist = self.macd - self.signal
+        return self.hist
+
+
+class IncRSI:
+    """
+    RSI。method: 'wilder' (bt.ind.RSI) 或 'sma' (bt.ind.RSI_SMA)。
+    """
+
+    def __init__(self, period=14, method='wilder'):
+        if method == 'wilder':
+            self.up, self.down = IncEMA(period, 1.0 / period), IncEMA(period, 1.0 / period)
+        elif method == 'sma':
+            self.up, self.down = IncSMA(period), IncSMA(period)
+        else:
+            raise ValueError(f"Unknown RSI method: {method}")
+        self.prev_close = NAN
+        self.value = NAN
+
+    def update(self, close):
+        delta = close - self.prev_close
+        self.prev_close = close
+        if math.isnan(delta):
+            return self.value
+        up = self.up.update(max(delta, 0.0))
+        down = self.down.update(max(-delta, 0.0))
+        if not math.isnan(up):
+            # 与 indicators.rsi 相同：下跌均值为 0 时取 100，上涨与下跌均值都为 0 时为 NaN
+            if down == 0:
+                self.value = NAN if up == 0 else 100.0
+            else:
+                self.value = 100.0 - 100.0 / (1.0 + up / down)
+        return self.value
+
+
+class IncOBV:
+    def __init__(self):
+        self.prev_close = NAN
+        self.value = NAN
+
+    def update(self, close, volume):
+        if math.isnan(self.prev_close):
+            self.value = volume
+        elif close > self.prev_close:
+            self.value += volume
+        elif close < self.prev_close:
+            self.value -= volume
+        self.prev_close = close
+        return self.value
+
+
+class IncATR:
+    def __init__(self, period=14):
+        self.smma = IncEMA(period, 1.0 / period)
+        self.prev_close = NAN
+        self.value = NAN
+
+    def update(self, high, low, close):
+        if not math.isnan(self.prev_close):
+            tr = max(high, self.prev_close) - min(low, self.prev_close)
+            self.value = self.smma.update(tr)
+        self.prev_close = close
+        return self.value
+
+
+# ----------------------
+# 数据源
+# ----------------------
+class ReplaySource:
+    """
+    回放本地 K 线文件 (如 data/4hour/*.csv)，像实盘一样逐根推送已收盘的 K 线。
+    csv_path: K 线 CSV 路径 (通过列式缓存读取)
+    delay: 每根 K 线之间等待的秒数，0 表示尽快推送
+    """
+
+    def __init__(self, csv_path, delay=0.0, start=None, end=None):
+        self.csv_path = csv_path
+        self.delay = delay
+        self.start = start
+        self.end = end
+
+    def __iter__(self):
+        times, ohlcv = load_arrays(self.csv_path)
+        lo = 0 if self.start is None else int(np.searchsorted(times, np.datetime64(self.start, 'ns').view(np.int64)))
+        hi = len(times) if self.end is None else int(np.searchsorted(times, np.datetime64(self.end, 'ns').view(np.int64), side='right'))
+        columns = [ohlcv[i, lo:hi].tolist() for i in range(5)]
+        for t, o, h, l, c, v in zip(times[lo:hi].tolist(), *columns):
+            if self.delay:
+                time.sleep(self.delay)
+            yield Bar(t, o, h, l, c, v)
+
+
+# ----------------------
+# 模拟经纪商
+# ----------------------
+class PaperBroker:
+    """
+    与 backtrader 默认 BackBroker 一致的模拟撮合：市价单在下一根 K 线开盘价成交，
+    佣金为成交额的 commission 比例。提交时按下单时收盘价预检现金，成交时现金不足则拒绝。
+    """
+
+    def __init__(self, cash=10000.0, commission=0.0):
+        self.cash = float(cash)
+        self.commission = commission
+        self.position = 0
+        self.price = 0.0 # 持仓均价
+        self.pending = [] # [(size, created_price)]
+        self.fills = [] # [(time, size, price, commission)]
+        self.rejected = 0
+
+    def value(self, close):
+        return self.cash + self.position * close
+
+    def submit(self, size, created_price):
+        self.pending.append((size, created_price))
+
+    def on_bar_open(self, bar):
+        """
+        新 K 线开始时撮合挂单。返回本根 K 线的成交列表。
+        """
+        if not self.pending:
+            return []
+        orders, self.pending = self.pending, []
+
+        # 提交预检：按下单时价格模拟执行，现金为负则拒绝
+        cash, accepted = self.cash, []
+        for size, created_price in orders:
+            cash += -size * created_price # 买入减少现金，卖出增加
+            cash -= abs(size) * self.commission * created_price
+            if cash >= 0.0:
+                accepted.append(size)
+            else:
+                self.rejected += 1
+
+        fills = []
+        for size in accepted:
+            price = bar.open
+            commission = abs(size) * self.commission * price
+            if size > 0:
+                cash = self.cash - size * price - commission
+                if cash < 0.0:
+                    self.rejected += 1
+                    continue
+                self.cash = cash
+                self.price = price
+            else:
+                closed = -size
+                self.cash += closed * self.price + closed * (price - self.price)
+                self.cash -= commission
+            self.position += size
+            fills.append((bar.time, size, price, commission))
+        self.fills.extend(fills)
+        return fills
+
+
+# ----------------------
+# 流式策略
+# ----------------------
+class MacdSignalStream:
+    """
+    与 Strategy.generate_signals('macd') 一致：MACD 在信号线上方输出 1，下方输出 -1，相等输出 0；
+    预热期 (指标为 NaN，批量流程中会被 dropna) 输出 None。
+    """
+
+    def __init__(self, fast_period=12, slow_period=26, signal_period=9):
+        self.macd = IncMACD(fast_period, slow_period, signal_period)
+
+    def on_bar(self, bar):
+        self.macd.update(bar.close)
+        if math.isnan(self.macd.signal):
+            return None
+        if self.macd.macd > self.macd.signal:
+            return 1
+        if self.macd.macd < self.macd.signal:
+            return -1
+        return 0
+
+
+class ObvMacdRsiStream:
+    """
+    OBV_MACD_RSI_Strategy.next 的流式版本，配合 PaperBroker 复现 backtrader 的下单与成交。
+    参数与 OBV_MACD_RSI_Strategy.params 相同，默认值见 strategy.OBV_MACD_RSI_PARAMS。
+    on_bar 返回本根 K 线产生的下单动作 [(动作, 数量)]，动作为 'BUY' / 'SELL' / 'STOP' / 'CLOSE'。
+    """
+
+    params = OBV_MACD_RSI_PARAMS
+
+    def __init__(self, broker=None, **kwargs):
+        unknown = set(kwargs) - set(self.params)
+        if unknown:
+            raise ValueError(f"Unknown parameters: {sorted(unknown)}")
+        self.p = dict(self.params, **kwargs)
+        self.broker = broker or PaperBroker()
+        self.obv = IncOBV()
+        self.obv_ma = IncSMA(self.p['obv_period'])
+        self.macd = IncMACD(self.p['macd1'], self.p['macd2'], self.p['macdsig'])
+        self.rsi = IncRSI(self.p['rsi_period'])
+        self.atr = IncATR(self.p['atr_period'])
+        self.prev = (NAN, NAN, NAN, NAN) # 上一根的 obv, obv_ma, macd_hist, rsi
+        self.cooldown_counter = 0
+        self.max_portfolio_value = self.broker.value(0.0)
+        self.highest_price_since_entry = -1
+
+    def on_bar(self, bar):
+        self.broker.on_bar_open(bar)
+        obv = self.obv.update(bar.close, bar.volume)
+        obv_ma = self.obv_ma.update(obv)
+        hist = self.macd.update(bar.close)
+        rsi = self.rsi.update(bar.close)
+        atr = self.atr.update(bar.high, bar.low, bar.close)
+        prev_obv, prev_obv_ma, prev_hist, prev_rsi = self.prev
+        self.prev = (obv, obv_ma, hist, rsi)
+        if math.isnan(obv_ma) or math.isnan(hist) or math.isnan(rsi) or math.isnan(atr):
+            return [] # 预热期，对应 backtrader 的 prenext
+        return self._next(bar, obv, obv_ma, hist, rsi, atr, prev_obv, prev_obv_ma, prev_hist, prev_rsi)
+
+    def _next(self, bar, obv, obv_ma, hist, rsi, atr, prev_obv, prev_obv_ma, prev_hist, prev_rsi):
+        p, broker = self.p, self.broker
+        current_value = broker.value(bar.close)
+        self.max_portfolio_value = max(self.max_portfolio_value, current_value)
+        drawdown = (self.max_portfolio_value - current_value) / self.max_portfolio_value
+
+        if drawdown > p['drawdown_limit']:
+            actions = []
+            if broker.position:
+                actions.append(('CLOSE', -broker.position))
+                broker.submit(-broker.position, bar.close)
+            self.cooldown_counter = p['cooldown_period']
+            return actions
+
+        if self.cooldown_counter > 0:
+            self.cooldown_counter -= 1
+            return []
+
+        pos = broker.position
+        obv_cross_up = obv > obv_ma and prev_obv <= prev_obv_ma
+        obv_above_ma = obv > obv_ma
+        macd_cross_up = hist > 0 and prev_hist <= 0
+        rsi_not_overbought = rsi < p['rsi_overbought']
+        rsi_oversold_bounce = rsi > p['rsi_oversold'] and prev_rsi <= p['rsi_oversold']
+
+        if not pos:
+            buy_condition_met = False
+            if bar.close > 0.00000001:
+                if p['buy_logic_type'] == 'AND':
+                    buy_condition_met = obv_above_ma and macd_cross_up and rsi_not_overbought
+                elif p['buy_logic_type'] == 'OR':
+                    buy_condition_met = ((obv_cross_up and macd_cross_up) or
+                                         (obv_cross_up and rsi_oversold_bounce) or
+                                         (macd_cross_up and rsi_oversold_bounce))
+                elif p['buy_logic_type'] == 'MIXED':
+                    buy_condition_met = (obv_cross_up or macd_cross_up) and rsi_not_overbought
+
+            if buy_condition_met:
+                size = int(broker.cash / bar.close * 0.95)
+                if size > 0:
+                    broker.submit(size, bar.close)
+                    self.highest_price_since_entry = bar.high
+                    return [('BUY', size)]
+            return []
+
+        self.highest_price_since_entry = max(self.highest_price_since_entry, bar.high)
+
+        exit_obv_cross_down = obv < obv_ma and prev_obv >= prev_obv_ma
+        exit_macd_cross_down = hist < 0 and prev_hist >= 0
+        exit_rsi_overbought = rsi > p['rsi_overbought']
+
+        sell_condition_met = False
+        if p['sell_logic_type'] == 'OR':
+            sell_condition_met = exit_obv_cross_down or exit_macd_cross_down or exit_rsi_overbought
+        elif p['sell_logic_type'] == 'AND':
+            sell_condition_met = exit_obv_cross_down and exit_macd_cross_down and exit_rsi_overbought
+
+        if p['trailing_stop_active'] and self.highest_price_since_entry > 0:
+            trailing_stop_price = self.highest_price_since_entry - (atr * p['trailing_stop_multiplier'])
+            if bar.close < trailing_stop_price:
+                broker.submit(-pos, bar.close)
+                self.highest_price_since_entry = -1
+                return [('STOP', -pos)]
+
+        if sell_condition_met:
+            broker.submit(-pos, bar.close)
+            self.highest_price_since_entry = -1
+            return [('SELL', -pos)]
+        return []
+
+
+def run_stream(source, strategy):
+    """
+    把数据源的 K 线逐根送入 strategy.on_bar，并测量每根 K 线的处理延迟。
+    返回: dict，'outputs' 为 [(time, on_bar 返回值)] (只记录非空输出)，
+          'latency_ns' 为每根 K 线的处理耗时数组，'latency' 为延迟统计 (微秒)
+    """
+    outputs = []
+    latencies = []
+    clock = time.perf_counter_ns
+    for bar in source:
+        t0 = clock()
+        out = strategy.on_bar(bar)
+        latencies.append(clock() - t0)
+        if out:
+            outputs.append((bar.time, out))
+
+    latency_ns = np.array(latencies, dtype=np.int64)
+    stats = {}
+    if len(latency_ns):
+        us = latency_ns / 1000.0
+        stats = {
+            'bars': int(len(us)),
+            'mean_us': float(us.mean()),
+            'p50_us': float(np.percentile(us, 50)),
+            'p99_us': float(np.percentile(us, 99)),
+            'max_us': float(us.max()),
+        }
+    return {'outputs': outputs, 'latency_ns': latency_ns, 'latency': stats}
+
+
+if __name__ == '__main__':
+    import glob
+    import os
+
+    for path in sorted(glob.glob('../data/4hour/*_4h.csv')):
+        result = run_stream(ReplaySource(path), ObvMacdRsiStream(PaperBroker(10000, commission=0.001)))
+        symbol = os.path.basename(path).split('_')[0]
+        print(f"{symbol}: {len(result['outputs'])} orders, latency {result['latency']}")
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# test_Bash 的模块按平铺方式相互导入 (from backtester import ...)，测试从任意目录运行时都要能找到它们
+TEST_BASH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(TEST_BASH, '..', 'data')
+if TEST_BASH not in sys.path:
+    sys.path.insert(0, TEST_BASH)
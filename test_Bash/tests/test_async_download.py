@@ -0,0 +1,37 @@
+import asyncio
+import os
+
+import numpy as np
+
+from async_download import MockKlineServer, download_all
+from conftest import DATA_DIR
+from data_store import load_klines
+
+
+def _source(symbol):
+    return load_klines(os.path.join(DATA_DIR, '4hour', f'{symbol}_4h.csv')).loc['2024-01-01':'2024-12-31 20:00']
+
+
+def test_download_all_against_mock_server(tmp_path):
+    futures = {'BTCUSDT': _source('BTCUSDT')}
+    spot = {'ETHUSDT': _source('ETHUSDT')} # 合约接口返回 Invalid symbol，转用现货
+    # 本地已有 BTC 的上半年，只下载缺失部分
+    futures['BTCUSDT'].loc[:'2024-06-30'].to_csv(tmp_path / 'BTCUSDT_4h.csv')
+
+    async def run():
+        async with MockKlineServer(futures=futures, spot=spot, fail_rate=0.2) as server:
+            results = await download_all(['BTCUSDT', 'ETHUSDT'], '4h', '2024-01-01', '2024-12-31 20:00', str(tmp_path),
+                                         rate=1000, burst=100, futures_url=server.futures_url,
+                                         spot_url=server.spot_url, now='2025-06-01', backoff=0.01)
+        return results, server.requests
+
+    results, requests = asyncio.run(run())
+
+    assert requests > 0
+    for symbol, expected in {**futures, **spot}.items():
+        df, fetched = results[symbol]
+        assert fetched
+        stored = load_klines(str(tmp_path / f'{symbol}_4h.csv'))
+        for frame in (df, stored):
+            assert frame.index.equals(expected.index)
+            np.testing.assert_allclose(frame.to_numpy(), expected.to_numpy())
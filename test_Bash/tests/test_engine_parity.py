@@ -0,0 +1,35 @@
+import os
+
+import numpy as np
+import pytest
+
+from backtester import Backtester
+from conftest import DATA_DIR
+from data_store import load_klines
+from strategy import Strategy
+
+ENGINES = ('loop', 'vectorized', 'compiled')
+
+
+@pytest.fixture(scope='module')
+def data():
+    return load_klines(os.path.join(DATA_DIR, '4hour', 'BTCUSDT_4h.csv'))
+
+
+@pytest.mark.parametrize('commission_rate, slippage_rate', [(0.0, 0.0), (0.001, 0.0005)])
+@pytest.mark.parametrize('strategy', ['macd', 'rsi', 'obv', 'obv_macd_rsi'])
+def test_engines_agree(data, strategy, commission_rate, slippage_rate):
+    signals = Strategy(strategy, {}).generate_signals(data)
+    runs = {}
+    for engine in ENGINES:
+        backtester = Backtester(10000, commission_rate, slippage_rate)
+        equity_curve, trades_df = backtester.run_backtest(signals, engine)
+        runs[engine] = (equity_curve, trades_df)
+
+    reference_equity, reference_trades = runs['loop']
+    assert len(reference_trades) > 0
+    for engine in ENGINES[1:]:
+        equity_curve, trades_df = runs[engine]
+        assert equity_curve.index.equals(reference_equity.index), engine
+        np.testing.assert_array_equal(equity_curve.to_numpy(), reference_equity.to_numpy(), err_msg=engine)
+        assert trades_df.equals(reference_trades), engine
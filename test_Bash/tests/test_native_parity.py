@@ -0,0 +1,17 @@
+import os
+
+import pytest
+
+from conftest import DATA_DIR
+from native import STRATEGIES, parity
+
+# 随仓库附带的日线数据中挑选的几个：BTC 历史最长，SOL / SUI 上市较晚且波动大
+CSV_FILES = [os.path.join(DATA_DIR, 'day', f'{symbol}_1d.csv') for symbol in ('BTCUSDT', 'SOLUSDT', 'SUIUSDT')]
+
+
+@pytest.mark.parametrize('csv_path', CSV_FILES, ids=os.path.basename)
+@pytest.mark.parametrize('name', list(STRATEGIES))
+def test_native_matches_cerebro(name, csv_path):
+    row = parity(name, csv_path)
+    failed = [key for key in ('params', 'fills', 'final_value', 'sharpe', 'max_drawdown') if not row[key]]
+    assert not failed, f"{name} differs from cerebro on {failed}: {row}"
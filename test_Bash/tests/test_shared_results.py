@@ -0,0 +1,35 @@
+import os
+
+import numpy as np
+import pytest
+
+from conftest import DATA_DIR
+from runner import SHARED_KEYS, make_jobs, release_shared, run_jobs
+
+
+@pytest.fixture(scope='module')
+def jobs():
+    return make_jobs(['BTCUSDT', 'ETHUSDT'], ['1d'], {'macd': {}}, {'1d': os.path.join(DATA_DIR, 'day')},
+                     10000, 0.001, 0.0005)
+
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+def test_shared_results_match_and_release(jobs, max_workers):
+    expected = run_jobs(jobs, max_workers=1)
+    results = run_jobs(jobs, max_workers=max_workers, shared=True)
+    assert all('_block' in result for result in results)
+    for result, reference in zip(results, expected):
+        for key in SHARED_KEYS:
+            np.testing.assert_array_equal(result[key], reference[key])
+
+    # 还在使用的切片让对应的共享内存无法释放，其余结果照常释放
+    held = results[0]['equity'][10:20]
+    with pytest.raises(BufferError):
+        release_shared(results)
+    assert '_block' in results[0] and '_block' not in results[1]
+    np.testing.assert_array_equal(held, expected[0]['equity'][10:20])
+    np.testing.assert_array_equal(results[0]['equity'], expected[0]['equity'])
+
+    del held
+    release_shared(results)
+    assert not any(key in result for result in results for key in SHARED_KEYS + ('_block',))
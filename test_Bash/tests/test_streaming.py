@@ -0,0 +1,50 @@
+import os
+
+import numpy as np
+import pytest
+
+from conftest import DATA_DIR
+from data_store import load_klines
+from indicators import rsi
+from native import run_native
+from strategy import Strategy
+from streaming import IncRSI, MacdSignalStream, ObvMacdRsiStream, PaperBroker, ReplaySource
+
+CSV_FILES = [os.path.join(DATA_DIR, '4hour', f'{symbol}_4h.csv') for symbol in ('BTCUSDT', 'SOLUSDT', 'SUIUSDT')]
+
+
+@pytest.mark.parametrize('csv_path', CSV_FILES, ids=os.path.basename)
+def test_macd_stream_matches_generate_signals(csv_path):
+    expected = Strategy('macd', {}).generate_signals(load_klines(csv_path))['Signal'].to_numpy()
+    stream = MacdSignalStream()
+    outputs = [stream.on_bar(bar) for bar in ReplaySource(csv_path)]
+
+    warmup = np.array([out is None for out in outputs])
+    # 预热期流式输出 None，批量流程输出 0
+    assert warmup.sum() > 0 and not (expected[warmup] != 0).any()
+    np.testing.assert_array_equal(np.array([out for out in outputs if out is not None]), expected[~warmup])
+
+
+@pytest.mark.parametrize('csv_path', CSV_FILES, ids=os.path.basename)
+def test_obv_macd_rsi_stream_matches_native(csv_path):
+    broker = PaperBroker(10000, commission=0.001)
+    stream = ObvMacdRsiStream(broker)
+    for bar in ReplaySource(csv_path):
+        stream.on_bar(bar)
+    expected = run_native('obv_macd_rsi', csv_path, 10000, 0.001)['fills']
+
+    assert len(broker.fills) == len(expected) > 0
+    times, sizes, prices, commissions = (np.array(column) for column in zip(*broker.fills))
+    np.testing.assert_array_equal(times.view('datetime64[ns]'), expected['Date'].to_numpy())
+    np.testing.assert_array_equal(sizes, expected['Size'].to_numpy())
+    np.testing.assert_array_equal(prices, expected['Price'].to_numpy())
+    np.testing.assert_allclose(commissions, expected['Commission'].to_numpy(), rtol=1e-12)
+
+
+@pytest.mark.parametrize('method', ['wilder', 'sma'])
+def test_inc_rsi_matches_batch_on_flat_prices(method):
+    # 价格不变的区间上涨与下跌均值都为 0，两种实现都应给出 NaN；只涨不跌时为 100
+    close = np.concatenate((np.full(20, 10.0), np.arange(10.0, 30.0), np.full(20, 30.0), np.arange(30.0, 10.0, -1)))
+    indicator = IncRSI(5, method)
+    streamed = np.array([indicator.update(c) for c in close])
+    np.testing.assert_allclose(streamed, rsi(close, 5, method), rtol=1e-12, equal_nan=True)
@@ -0,0 +1,148 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import DATA_DIR
+from data_store import load_klines
+from day_data import sync_klines
+
+NOW = '2026-01-01'
+
+
+class FakeExchange:
+    """
+    本地假交易所：按 get_historical_klines 的接口从给定的 K 线返回 [start_ms, end_ms] 内的数据，并记录每次请求。
+    """
+
+    def __init__(self, klines, interval_ms):
+        self.klines = klines
+        self.interval_ms = interval_ms
+        self.requests = []
+
+    def get_historical_klines(self, symbol, interval, start_str, end_str, klines_type=None):
+        self.requests.append((start_str, end_str))
+        open_ms = self.klines.index.values.astype('datetime64[ms]').astype(np.int64)
+        inside = (open_ms >= start_str) & (open_ms <= end_str)
+        values = self.klines.loc[inside, ['Open', 'High', 'Low', 'Close Price', 'Volume']].to_numpy().tolist()
+        return [[t, o, h, l, c, v, t + self.interval_ms - 1, 0.0, 0, 0.0, 0.0, '0']
+                for t, (o, h, l, c, v) in zip(open_ms[inside].tolist(), values)]
+
+
+def _ms(timestamp):
+    return pd.Timestamp(timestamp).value // 1_000_000
+
+
+@pytest.fixture
+def source():
+    return load_klines(os.path.join(DATA_DIR, 'day', 'BTCUSDT_1d.csv')).loc['2024-01-01':'2024-12-31']
+
+
+def test_sync_downloads_only_the_gaps(tmp_path, source):
+    # 本地文件缺少开头一周、中间 10 天与最后一个月
+    local = source.drop(source.loc['2024-06-01':'2024-06-10'].index).loc['2024-01-08':'2024-11-30']
+    local.to_csv(tmp_path / 'BTCUSDT_1d.csv')
+    exchange = FakeExchange(source, 86_400_000)
+
+    df, fetched = sync_klines('BTCUSDT', '1d', '2024-01-01', '2024-12-31', exchange, str(tmp_path), now=NOW)
+
+    assert fetched
+    assert exchange.requests == [(_ms('2024-01-01'), _ms('2024-01-07')), (_ms('2024-06-01'), _ms('2024-06-10')),
+                                 (_ms('2024-12-01'), _ms('2024-12-31'))]
+    assert df.index.equals(source.index)
+    np.testing.assert_allclose(df.to_numpy(), source.to_numpy())
+    saved = pd.read_csv(tmp_path / 'BTCUSDT_1d.csv', index_col=0, parse_dates=True)
+    assert saved.index.equals(source.index)
+
+    # 再次同步时本地数据已完整，不再请求
+    df, fetched = sync_klines('BTCUSDT', '1d', '2024-01-01', '2024-12-31', exchange, str(tmp_path), now=NOW)
+    assert not fetched
+    assert len(exchange.requests) == 3
+    assert df.index.equals(source.index)
+
+
+def test_sync_remembers_ranges_the_exchange_does_not_have(tmp_path, source):
+    # 交易所没有 2024 年之前的数据 (如上市之前)：第一次请求后记为空区间，之后不再请求
+    source.to_csv(tmp_path / 'BTCUSDT_1d.csv')
+    exchange = FakeExchange(source, 86_400_000)
+
+    sync_klines('BTCUSDT', '1d', '2023-12-01', '2024-12-31', exchange, str(tmp_path), now=NOW)
+    first = len(exchange.requests)
+    df, fetched = sync_klines('BTCUSDT', '1d', '2023-12-01', '2024-12-31', exchange, str(tmp_path), now=NOW)
+
+    assert first > 0
+    assert not fetched
+    assert len(exchange.requests) == first
+    assert df.index.equals(source.index)
+
+
+def test_sync_stops_at_the_last_closed_bar(tmp_path, source):
+    # 结束时间晚于当前时间时只同步到最近一根已收盘的 K 线
+    source.loc[:'2024-06-30'].to_csv(tmp_path / 'BTCUSDT_1d.csv')
+    exchange = FakeExchange(source, 86_400_000)
+
+    df, _ = sync_klines('BTCUSDT', '1d', '2024-01-01', '2024-12-31', exchange, str(tmp_path), now='2024-07-10 12:00')
+
+    assert exchange.requests == [(_ms('2024-07-01'), _ms('2024-07-09'))]
+    assert df.index[-1] == pd.Timestamp('2024-07-09')
+
+
+class FlakyExchange(FakeExchange):
+    """
+    前 ok 次请求正常，之后每次请求都抛出异常 (模拟断网)。
+    """
+
+    def __init__(self, klines, interval_ms, ok):
+        super().__init__(klines, interval_ms)
+        self.ok = ok
+
+    def get_historical_klines(self, symbol, interval, start_str, end_str, klines_type=None):
+        if len(self.requests) >= self.ok:
+            self.requests.append((start_str, end_str))
+            raise ConnectionError("network is unreachable")
+        return super().get_historical_klines(symbol, interval, start_str, end_str, klines_type)
+
+
+def test_sync_keeps_ranges_downloaded_before_an_error(tmp_path, source):
+    local = source.drop(source.loc['2024-06-01':'2024-06-10'].index).loc[:'2024-11-30']
+    local.to_csv(tmp_path / 'BTCUSDT_1d.csv')
+
+    # 第一个缺口下载成功后断网：已下载的部分写入本地，失败的缺口不记为空区间
+    df, fetched = sync_klines('BTCUSDT', '1d', '2024-01-01', '2024-12-31', FlakyExchange(source, 86_400_000, 1),
+                              str(tmp_path), now=NOW)
+    assert fetched
+    assert df.index.equals(source.loc[:'2024-11-30'].index)
+
+    exchange = FakeExchange(source, 86_400_000)
+    df, fetched = sync_klines('BTCUSDT', '1d', '2024-01-01', '2024-12-31', exchange, str(tmp_path), now=NOW)
+    assert fetched
+    assert exchange.requests == [(_ms('2024-12-01'), _ms('2024-12-31'))]
+    assert df.index.equals(source.index)
+
+
+def test_sync_reports_no_fetch_when_every_request_fails(tmp_path, source):
+    source.loc[:'2024-06-30'].to_csv(tmp_path / 'BTCUSDT_1d.csv')
+
+    df, fetched = sync_klines('BTCUSDT', '1d', '2024-01-01', '2024-12-31', FlakyExchange(source, 86_400_000, 0),
+                              str(tmp_path), now=NOW)
+
+    assert not fetched
+    assert df.index.equals(source.loc[:'2024-06-30'].index)
+
+
+def test_sync_retries_ranges_missed_after_listing(tmp_path, source):
+    # 交易所一次没有返回中间的 10 天 (停机或空响应)：这不是上市前的区间，下次同步重新请求
+    local = source.drop(source.loc['2024-06-01':'2024-06-10'].index)
+    local.to_csv(tmp_path / 'BTCUSDT_1d.csv')
+
+    outage = FakeExchange(local, 86_400_000)
+    sync_klines('BTCUSDT', '1d', '2024-01-01', '2024-12-31', outage, str(tmp_path), now=NOW)
+    # 合约接口没有返回数据时再请求现货，同一个区间请求两次
+    assert set(outage.requests) == {(_ms('2024-06-01'), _ms('2024-06-10'))}
+
+    exchange = FakeExchange(source, 86_400_000)
+    df, fetched = sync_klines('BTCUSDT', '1d', '2024-01-01', '2024-12-31', exchange, str(tmp_path), now=NOW)
+    assert fetched
+    assert exchange.requests == [(_ms('2024-06-01'), _ms('2024-06-10'))]
+    assert df.index.equals(source.index)
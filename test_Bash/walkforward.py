@@ -0,0 +1,164 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from data_store import load_arrays
+from backtester import simulate_long_only
+from optimizer import SIGNAL_BUILDERS, SCORE_COLUMNS, param_grid, evaluate, score_equity, _close, _periods_per_year
+
+# 滚动前推 (walk-forward) 优化：每个交易对的历史切成连续的 样本内 / 样本外 区间，
+# 在样本内区间做参数搜索，用最优参数回测紧随其后的样本外区间，最后把各样本外资金曲线拼接起来。
+# 指标在整段历史上计算一次 (optimizer 的进程内缓存)，每个区间只截取对应的片段，
+# 因此样本外区间开头的指标状态延续之前的全部历史，与实盘逐根推进时一致。
+
+
+def make_folds(n, train_bars, test_bars, anchored=False):
+    """
+    生成滚动区间。样本外区间首尾相接、互不重叠。
+    n: K 线总数
+    train_bars / test_bars: 样本内 / 样本外 K 线数
+    anchored: True 时样本内区间从第 0 根开始逐步扩大 (扩展窗口)，否则为固定长度的滚动窗口
+    返回: [(is_start, is_end, oos_start, oos_end), ...]，均为左闭右开的下标
+    """
+    folds = []
+    oos_start = train_bars
+    while oos_start < n:
+        oos_end = min(oos_start + test_bars, n)
+        if oos_end - oos_start < 2:
+            break
+        folds.append((0 if anchored else oos_start - train_bars, oos_start, oos_start, oos_end))
+        oos_start = oos_end
+    return folds
+
+
+def run_fold(csv_path, strategy, combos, fold, metric, initial_capital, commission_rate, slippage_rate):
+    """
+    单个区间 (工作进程入口)：样本内评估所有参数组合，选出 metric 最优的一组，在样本外区间回测。
+    返回: dict，包含 'params'、'is'/'oos' (指标字典)、'start' (样本外实际起始下标)、'equity'、'trades'；
+          样本内没有有效组合时 'params' 为 None
+    """
+    is_start, is_end, oos_start, oos_end = fold
+    scores = evaluate(csv_path, strategy, combos, initial_capital, commission_rate, slippage_rate,
+                      window=(is_start, is_end))
+    sign = -1.0 if metric == 'max_drawdown' else 1.0
+    ranked = [(sign * s[metric], i) for i, s in enumerate(scores) if s is not None and np.isfinite(s[metric])]
+    if not ranked:
+        return {'params': None}
+    best = max(ranked, key=lambda r: (r[0], -r[1]))[1]
+
+    params = combos[best]
+    signal, valid = SIGNAL_BUILDERS[strategy](csv_path, params)
+    close = _close(csv_path)
+    start = max(oos_start, int(np.argmax(valid)) if valid.any() else len(valid))
+    if oos_end - start < 2:
+        return {'params': None}
+    result = simulate_long_only(close[start:oos_end], signal[start:oos_end], initial_capital,
+                                commission_rate, slippage_rate)
+    oos = score_equity(result['equity'], _periods_per_year(csv_path))
+    oos['trades'] = len(result['fills'])
+    return {'params': params, 'is': scores[best], 'oos': oos, 'start': start,
+            'equity': result['equity'], 'trades': oos['trades']}
+
+
+def stitch(pieces, initial_capital):
+    """
+    拼接各样本外区间的资金曲线：每段都以 initial_capital 起步回测，按前面各段的累计收益缩放后首尾相接
+    (回测按现金比例下单，缩放与用上一段期末资金回测等价)。
+    pieces: [(times, equity), ...]，按时间排序
+    返回: pd.Series
+    """
+    scale = 1.0
+    values, times = [], []
+    for t, equity in pieces:
+        values.append(equity * scale)
+        times.append(t)
+        scale *= equity[-1] / initial_capital
+    if not values:
+        return pd.Series(dtype=float)
+    return pd.Series(np.concatenate(values) if len(values) > 1 else values[0],
+                     index=pd.to_datetime(np.concatenate(times)))
+
+
+def walk_forward(csv_paths, ranges, strategy='macd', metric='sharpe', train_bars=1095, test_bars=546,
+                 anchored=False, initial_capital=10000, commission_rate=0.0, slippage_rate=0.0, max_workers=None):
+    """
+    在多个交易对上做滚动前推优化，所有 (交易对, 区间) 并行执行。
+    csv_paths: {交易对: CSV 路径}
+    ranges: {参数名: 取值范围}，见 optimizer.param_grid
+    train_bars / test_bars: 样本内 / 样本外 K 线数 (默认约 6 个月 / 3 个月的 4 小时 K 线)
+    返回: (folds, equity, summary)
+        folds: DataFrame，每行一个区间：时间范围、最优参数、样本内与样本外指标
+        equity: {交易对: 拼接后的样本外资金曲线 pd.Series}
+        summary: DataFrame，每个交易对拼接曲线的指标，以及样本外 / 样本内 metric 均值之比 ('efficiency')
+    """
+    combos = param_grid(ranges)
+    tasks = []
+    for symbol, csv_path in csv_paths.items():
+        n = len(load_arrays(csv_path)[0])
+        tasks += [(symbol, k, fold) for k, fold in enumerate(make_folds(n, train_bars, test_bars, anchored))]
+
+    max_workers = max_workers or min(len(tasks), os.cpu_count() or 1) or 1
+    args = [(csv_paths[symbol], strategy, combos, fold, metric, initial_capital, commission_rate, slippage_rate)
+            for symbol, _, fold in tasks]
+    if max_workers == 1:
+        results = [run_fold(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            results = list(pool.map(run_fold, *zip(*args)))
+
+    rows, pieces = [], {}
+    for (symbol, k, (is_start, is_end, oos_start, oos_end)), result in zip(tasks, results):
+        if result['params'] is None:
+            continue
+        times = load_arrays(csv_paths[symbol])[0]
+        row = {'symbol': symbol, 'fold': k,
+               'is_start': pd.Timestamp(times[is_start]), 'is_end': pd.Timestamp(times[is_end - 1]),
+               'oos_start': pd.Timestamp(times[result['start']]), 'oos_end': pd.Timestamp(times[oos_end - 1])}
+        row.update(result['params'])
+        row.update({f'is_{c}': result['is'][c] for c in SCORE_COLUMNS})
+        row.update({f'oos_{c}': result['oos'][c] for c in SCORE_COLUMNS})
+        rows.append(row)
+        pieces.setdefault(symbol, []).append((times[result['start']:oos_end], result['equity']))
+    folds = pd.DataFrame(rows)
+
+    equity = {symbol: stitch(p, initial_capital) for symbol, p in pieces.items()}
+    summary = []
+    for symbol, curve in equity.items():
+        score = score_equity(curve.to_numpy(), _periods_per_year(csv_paths[symbol]))
+        mine = folds[folds['symbol'] == symbol]
+        is_mean, oos_mean = mine[f'is_{metric}'].mean(), mine[f'oos_{metric}'].mean()
+        score.update({'symbol': symbol, 'folds': len(mine), f'mean_is_{metric}': is_mean,
+                      f'mean_oos_{metric}': oos_mean,
+                      'efficiency': oos_mean / is_mean if is_mean else np.nan})
+        summary.append(score)
+    summary = pd.DataFrame(summary)
+    if not summary.empty:
+        summary = summary.set_index('symbol')
+    return folds, equity, summary
+
+
+if __name__ == '__main__':
+    import glob
+    import json
+    import time
+
+    with open('config.json', 'r') as f:
+        config = json.load(f)
+
+    paths = {os.path.basename(p).split('_')[0]: p for p in sorted(glob.glob('../data/4hour/*_4h.csv'))}
+    ranges = {
+        'fast_period': range(6, 20, 2),
+        'slow_period': range(20, 52, 4),
+        'signal_period': range(5, 12, 2),
+    }
+    t0 = time.perf_counter()
+    folds, equity, summary = walk_forward(paths, ranges, strategy='macd', metric='sharpe',
+                                          initial_capital=config['initial_capital'],
+                                          commission_rate=config['commission_rate'],
+                                          slippage_rate=config['slippage_rate'])
+    print(f"{len(folds)} folds x {len(param_grid(ranges))} combinations on {len(paths)} symbols "
+          f"in {time.perf_counter() - t0:.2f}s")
+    print(folds.tail(10).to_string(index=False))
+    print(summary.to_string())